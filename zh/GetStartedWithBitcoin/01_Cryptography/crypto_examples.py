@@ -67,9 +67,13 @@ class BitcoinCrypto:
         nonce = 0
         start_time = time.time()
         
+        # 前缀data在每次尝试中都不变：预先喂入哈希对象，之后每次只copy()并追加nonce
+        prefix_state = hashlib.sha256(data.encode('utf-8'))
+        
         while True:
-            test_data = f"{data}{nonce}"
-            hash_result = self.sha256(test_data)
+            test_hasher = prefix_state.copy()
+            test_hasher.update(str(nonce).encode('utf-8'))
+            hash_result = test_hasher.hexdigest()
             
             if hash_result.startswith(target):
                 elapsed = time.time() - start_time
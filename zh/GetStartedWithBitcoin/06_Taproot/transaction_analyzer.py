@@ -14,6 +14,79 @@ import time
 from typing import List, Dict, Any, Optional
 from collections import defaultdict
 
+# 标准锁定脚本的字节模板：按脚本长度分组，每个模板是需要检查的 (偏移, 字节值)，
+# 与第18讲 script_examples.py 的 classify_script 使用相同的模板（各讲的代码独立运行，这里保留一份）
+SCRIPT_TEMPLATES = {
+    25: [("P2PKH", ((0, 0x76), (1, 0xa9), (2, 0x14), (23, 0x88), (24, 0xac)))],
+    23: [("P2SH", ((0, 0xa9), (1, 0x14), (22, 0x87)))],
+    22: [("P2WPKH", ((0, 0x00), (1, 0x14)))],
+    34: [("P2WSH", ((0, 0x00), (1, 0x20))), ("P2TR", ((0, 0x51), (1, 0x20)))],
+    35: [("P2PK", ((0, 0x21), (34, 0xac)))],
+    67: [("P2PK", ((0, 0x41), (66, 0xac)))],
+}
+
+SCRIPT_TYPE_LABELS = {
+    "P2PK": 'P2PK (公钥)',
+    "P2PKH": 'P2PKH (Legacy)',
+    "P2SH": 'P2SH (Legacy)',
+    "P2WPKH": 'P2WPKH (SegWit)',
+    "P2WSH": 'P2WSH (SegWit)',
+    "P2TR": 'P2TR (Taproot)',
+    "MultiSig": 'MultiSig (裸多签)',
+    "OP_RETURN": 'OP_RETURN (数据)',
+}
+
+def _is_multisig(raw: bytes) -> bool:
+    """OP_m <公钥>... OP_n OP_CHECKMULTISIG，公钥为33或65字节"""
+    size = len(raw)
+    if size < 37 or raw[-1] != 0xae:
+        return False
+    m = raw[0] - 0x50
+    n = raw[-2] - 0x50
+    if not 1 <= m <= n <= 16:
+        return False
+    pos = 1
+    for _ in range(n):
+        if pos >= size or raw[pos] not in (0x21, 0x41):
+            return False
+        pos += 1 + raw[pos]
+    return pos == size - 2
+
+def classify_script(raw: bytes) -> str:
+    """按字节模板识别锁定脚本类型，只检查固定偏移上的字节"""
+    for name, checks in SCRIPT_TEMPLATES.get(len(raw), ()):
+        for offset, value in checks:
+            if raw[offset] != value:
+                break
+        else:
+            return name
+    if raw and raw[0] == 0x6a:
+        return "OP_RETURN"
+    if _is_multisig(raw):
+        return "MultiSig"
+    return "Custom"
+
+def script_pushes(raw: bytes) -> Optional[List[bytes]]:
+    """取出解锁脚本中的所有压栈数据；包含非压栈操作码或数据不完整时返回None"""
+    pushes = []
+    pos = 0
+    while pos < len(raw):
+        opcode = raw[pos]
+        pos += 1
+        if opcode <= 0x4b:
+            length = opcode
+        elif opcode in (0x4c, 0x4d, 0x4e):
+            size = {0x4c: 1, 0x4d: 2, 0x4e: 4}[opcode]
+            length = int.from_bytes(raw[pos:pos + size], 'little')
+            pos += size
+        else:
+            return None
+        if pos + length > len(raw):
+            return None
+        pushes.append(raw[pos:pos + length])
+        pos += length
+    return pushes
+
 class BitcoinRPC:
     """比特币RPC客户端"""
     
@@ -140,9 +213,10 @@ class TransactionAnalyzer:
         
         # 检测特殊特征
         analysis['segwit'] = any('witness' in inp and inp['witness'] for inp in decoded_tx['vin'])
-        analysis['taproot'] = any('witness_v1_taproot' in out_type for out_type in analysis['output_types'])
-        analysis['multisig'] = any('multisig' in out_type for out_type in analysis['output_types'])
-        analysis['op_return'] = any('nulldata' in out_type for out_type in analysis['output_types'])
+        analysis['taproot'] = any(out_type.startswith('P2TR') for out_type in analysis['output_types'])
+        analysis['multisig'] = any('多签' in script_type
+                                   for script_type in analysis['input_types'] + analysis['output_types'])
+        analysis['op_return'] = any(out_type.startswith('OP_RETURN') for out_type in analysis['output_types'])
         
         # 估算费用
         analysis['fee_estimate'] = self._estimate_fee(analysis['virtual_size'])
@@ -153,54 +227,95 @@ class TransactionAnalyzer:
         return analysis
     
     def _analyze_input(self, inp: Dict[str, Any]) -> str:
-        """分析输入类型"""
-        # 检查是否有witness数据
-        if 'witness' in inp and inp['witness']:
-            witness_count = len(inp['witness'])
-            if witness_count == 2:
-                return 'P2WPKH (SegWit)'
-            elif witness_count == 3:
-                return 'P2WSH (SegWit多签)'
-            elif witness_count > 3:
-                return 'Complex SegWit'
-            else:
-                return 'Unknown SegWit'
-        
-        # 检查scriptSig
-        if 'scriptSig' in inp and inp['scriptSig']['hex']:
-            script_hex = inp['scriptSig']['hex']
-            if len(script_hex) == 130:  # 65字节签名 + 65字节公钥
-                return 'P2PKH (Legacy)'
-            elif len(script_hex) > 130:
-                return 'P2SH (Legacy多签)'
-            else:
-                return 'Unknown Legacy'
+        """分析输入类型
         
-        return 'Coinbase'  # 创币交易
+        有被花费输出的scriptPubKey时（getrawtransaction verbosity=2 的 prevout 字段）直接按模板识别；
+        否则根据scriptSig中的压栈数据和witness的结构推断。两条路径得到类型后用同一套标签，
+        P2SH/P2WSH再看赎回脚本和见证脚本是否为多签。
+        """
+        if 'coinbase' in inp:
+            return 'Coinbase'  # 创币交易
+        
+        script_sig = bytes.fromhex(inp.get('scriptSig', {}).get('hex', ''))
+        pushes = (script_pushes(script_sig) if script_sig else []) or []
+        witness = [bytes.fromhex(item) for item in inp.get('witness') or []]
+        
+        prevout_hex = inp.get('prevout', {}).get('scriptPubKey', {}).get('hex')
+        spent_type = classify_script(bytes.fromhex(prevout_hex)) if prevout_hex else "Custom"
+        if spent_type == "Custom":
+            spent_type = self._infer_spent_type(pushes, witness)
+        return self._input_label(spent_type, pushes, witness)
+    
+    @staticmethod
+    def _infer_spent_type(pushes: List[bytes], witness: List[bytes]) -> str:
+        """没有prevout时，从scriptSig压栈数据和witness结构推断被花费输出的类型"""
+        if witness:
+            # 嵌套SegWit：scriptSig只压入一个见证程序
+            if pushes and classify_script(pushes[-1]) in ("P2WPKH", "P2WSH"):
+                return "P2SH"
+            last = witness[-1]
+            if len(witness) == 1 and len(last) in (64, 65):
+                return "P2TR"  # 密钥路径
+            if len(witness) >= 2 and last and last[0] & 0xfe == 0xc0 and (len(last) - 33) % 32 == 0:
+                return "P2TR"  # 脚本路径：最后一项是控制块
+            if len(witness) == 2 and len(last) == 33:
+                return "P2WPKH"
+            return "P2WSH" if len(witness) >= 2 else "Custom"
+        
+        if pushes:
+            if len(pushes) == 2 and len(pushes[1]) in (33, 65):
+                return "P2PKH"
+            if len(pushes) == 1:
+                return "P2PK"
+            return "P2SH"
+        return "Custom"
+    
+    @staticmethod
+    def _input_label(spent_type: str, pushes: List[bytes], witness: List[bytes]) -> str:
+        """把被花费输出的类型转换为输入标签"""
+        if spent_type == "P2SH":
+            redeem_type = classify_script(pushes[-1]) if pushes else "Custom"
+            if witness and redeem_type in ("P2WPKH", "P2WSH"):
+                multisig = redeem_type == "P2WSH" and classify_script(witness[-1]) == "MultiSig"
+                return f'P2SH-{redeem_type} (嵌套SegWit{"多签" if multisig else ""})'
+            if redeem_type == "MultiSig":
+                return 'P2SH (Legacy多签)'
+        elif spent_type == "P2WSH":
+            if witness and classify_script(witness[-1]) == "MultiSig":
+                return 'P2WSH (SegWit多签)'
+        elif spent_type == "P2TR" and witness:
+            # 去掉附件(annex)后只剩一项是密钥路径，否则是脚本路径
+            items = len(witness) - (len(witness) >= 2 and witness[-1][:1] == b'\x50')
+            return 'P2TR (Taproot密钥路径)' if items == 1 else 'P2TR (Taproot脚本路径)'
+        elif spent_type == "Custom":
+            return 'Unknown SegWit' if witness else 'Unknown Legacy'
+        return SCRIPT_TYPE_LABELS[spent_type]
     
     def _analyze_output(self, out: Dict[str, Any]) -> str:
-        """分析输出类型"""
+        """分析输出类型：优先按scriptPubKey的原始字节识别，节点返回的type作为后备"""
         script_pub_key = out['scriptPubKey']
-        script_type = script_pub_key.get('type', 'unknown')
+        if script_pub_key.get('hex'):
+            script_type = classify_script(bytes.fromhex(script_pub_key['hex']))
+            if script_type != "Custom":
+                return SCRIPT_TYPE_LABELS[script_type]
         
+        script_type = script_pub_key.get('type', 'unknown')
         if script_type == 'pubkeyhash':
             return 'P2PKH (Legacy)'
         elif script_type == 'scripthash':
-            # 检查是否是多签
-            if 'addresses' in script_pub_key and len(script_pub_key['addresses']) == 1:
-                return 'P2SH (Legacy多签)'
-            else:
-                return 'P2SH (Legacy)'
+            return 'P2SH (Legacy)'
         elif script_type == 'witness_v0_keyhash':
             return 'P2WPKH (SegWit)'
         elif script_type == 'witness_v0_scripthash':
-            return 'P2WSH (SegWit多签)'
+            return 'P2WSH (SegWit)'
         elif script_type == 'witness_v1_taproot':
             return 'P2TR (Taproot)'
         elif script_type == 'nulldata':
             return 'OP_RETURN (数据)'
         elif script_type == 'pubkey':
             return 'P2PK (公钥)'
+        elif script_type == 'multisig':
+            return 'MultiSig (裸多签)'
         else:
             return f'Unknown ({script_type})'
     
@@ -4,11 +4,24 @@
 比特币数据结构的Python实现，包括区块链、默克尔树、SPV等核心组件
 """
 
+import bisect
 import hashlib
-import json
+import heapq
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import tempfile
 import time
+from array import array
 from typing import List, Optional, Dict, Tuple
 
+try:
+    import numpy as np  # 可选依赖：批量计算SipHash、解码区块过滤器
+except ImportError:
+    np = None
+
 
 def double_sha256(data: bytes) -> bytes:
     """比特币使用的双重SHA256哈希"""
@@ -31,87 +44,825 @@ class HashPointer:
         return self.hash == self.calculate_hash(data)
 
 
+class BlockHeader:
+    """比特币区块头：80字节小端序布局
+
+    | version(4) | prev_hash(32) | merkle_root(32) | timestamp(4) | bits(4) | nonce(4) |
+
+    prev_hash和merkle_root按内部字节序保存（区块浏览器显示的是反转后的十六进制）。
+    区块哈希缓存起来，修改任意字段都会让缓存失效。
+    """
+
+    __slots__ = ("_version", "_prev_hash", "_merkle_root", "_timestamp", "_bits", "_nonce",
+                 "_raw", "_hash")
+
+    SIZE = 80
+    _INT_FIELDS = struct.Struct("<III")   # timestamp, bits, nonce
+    _LAYOUT = struct.Struct("<I32s32sIII")
+
+    def __init__(self, version: int = 1, prev_hash: bytes = bytes(32),
+                 merkle_root: bytes = bytes(32), timestamp: int = 0,
+                 bits: int = 0x207fffff, nonce: int = 0):
+        if len(prev_hash) != 32 or len(merkle_root) != 32:
+            raise ValueError("prev_hash和merkle_root必须是32字节")
+        self._version = version
+        self._prev_hash = prev_hash
+        self._merkle_root = merkle_root
+        self._timestamp = timestamp
+        self._bits = bits
+        self._nonce = nonce
+        self._raw = None
+        self._hash = None
+
+    @classmethod
+    def from_bytes(cls, data, offset: int = 0) -> "BlockHeader":
+        """从字节串或memoryview解析区块头
+
+        不复制数据：prev_hash/merkle_root是原缓冲区的memoryview切片，
+        计算哈希时也直接使用原始的80字节。调用方在使用期间不要修改底层缓冲区。
+        """
+        view = memoryview(data)[offset:offset + cls.SIZE]
+        if len(view) != cls.SIZE:
+            raise ValueError(f"区块头需要{cls.SIZE}字节，实际只有{len(view)}字节")
+
+        header = cls.__new__(cls)
+        header._version = int.from_bytes(view[0:4], "little")
+        header._prev_hash = view[4:36]
+        header._merkle_root = view[36:68]
+        header._timestamp, header._bits, header._nonce = cls._INT_FIELDS.unpack_from(view, 68)
+        header._raw = view
+        header._hash = None
+        return header
+
+    def to_bytes(self) -> bytes:
+        """序列化为80字节"""
+        if self._raw is not None:
+            return bytes(self._raw)
+        return self._LAYOUT.pack(self._version, bytes(self._prev_hash), bytes(self._merkle_root),
+                                 self._timestamp, self._bits, self._nonce)
+
+    @property
+    def hash(self) -> bytes:
+        """区块哈希（内部字节序的双重SHA256）"""
+        if self._hash is None:
+            self._hash = double_sha256(self._raw if self._raw is not None else self.to_bytes())
+        return self._hash
+
+    @property
+    def hash_hex(self) -> str:
+        """区块浏览器显示的哈希（字节序反转）"""
+        return self.hash[::-1].hex()
+
+    def target(self) -> int:
+        """由紧凑难度位bits计算目标值"""
+        exponent = self._bits >> 24
+        mantissa = self._bits & 0x007fffff
+        if exponent <= 3:
+            return mantissa >> (8 * (3 - exponent))
+        return mantissa << (8 * (exponent - 3))
+
+    @staticmethod
+    def bits_for_target(target: int) -> int:
+        """把目标值编码为紧凑难度位（与Bitcoin Core的GetCompact相同，低位被舍去）"""
+        size = (target.bit_length() + 7) // 8
+        if size <= 3:
+            mantissa = target << (8 * (3 - size))
+        else:
+            mantissa = target >> (8 * (size - 3))
+        # 最高位是符号位，需要让出来
+        if mantissa & 0x00800000:
+            mantissa >>= 8
+            size += 1
+        return (size << 24) | mantissa
+
+    def work(self) -> int:
+        """该区块代表的期望哈希次数，用于累计工作量的比较"""
+        return 2 ** 256 // (self.target() + 1)
+
+    def check_proof_of_work(self) -> bool:
+        """区块哈希（按小端序解释为整数）不超过目标值"""
+        return int.from_bytes(self.hash, "little") <= self.target()
+
+    def _invalidate(self):
+        self._raw = None
+        self._hash = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @version.setter
+    def version(self, value: int):
+        self._version = value
+        self._invalidate()
+
+    @property
+    def prev_hash(self) -> bytes:
+        return self._prev_hash
+
+    @prev_hash.setter
+    def prev_hash(self, value: bytes):
+        if len(value) != 32:
+            raise ValueError("prev_hash必须是32字节")
+        self._prev_hash = value
+        self._invalidate()
+
+    @property
+    def merkle_root(self) -> bytes:
+        return self._merkle_root
+
+    @merkle_root.setter
+    def merkle_root(self, value: bytes):
+        if len(value) != 32:
+            raise ValueError("merkle_root必须是32字节")
+        self._merkle_root = value
+        self._invalidate()
+
+    @property
+    def timestamp(self) -> int:
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value: int):
+        self._timestamp = value
+        self._invalidate()
+
+    @property
+    def bits(self) -> int:
+        return self._bits
+
+    @bits.setter
+    def bits(self, value: int):
+        self._bits = value
+        self._invalidate()
+
+    @property
+    def nonce(self) -> int:
+        return self._nonce
+
+    @nonce.setter
+    def nonce(self, value: int):
+        self._nonce = value
+        self._invalidate()
+
+    def __repr__(self):
+        return f"BlockHeader(hash={self.hash_hex[:16]}..., timestamp={self._timestamp}, nonce={self._nonce})"
+
+
 class Block:
-    """比特币区块的简化实现"""
+    """比特币区块的简化实现
+
+    区块头字段保存在 self.header（BlockHeader）中，哈希按比特币的80字节布局计算。
+    为了方便阅读，prev_hash/merkle_root/hash 对外仍是十六进制字符串（内部字节序）。
+    """
     
     def __init__(self, transactions: List[str], prev_hash: str, timestamp: int = None):
-        self.version = 1
-        self.prev_hash = prev_hash
-        self.timestamp = timestamp or int(time.time())
-        self.transactions = transactions
+        self.header = BlockHeader(prev_hash=bytes.fromhex(prev_hash),
+                                  timestamp=timestamp or int(time.time()))
+        self.transactions = list(transactions)
+        # 保留默克尔树，之后增删交易时只需增量更新
+        self.merkle_tree = MerkleTree(self.transactions)
         self.merkle_root = self.calculate_merkle_root()
-        self.nonce = 0
         self.hash = self.calculate_hash()
+    
+    @property
+    def version(self) -> int:
+        return self.header.version
+    
+    @version.setter
+    def version(self, value: int):
+        self.header.version = value
+    
+    @property
+    def prev_hash(self) -> str:
+        return self.header.prev_hash.hex()
+    
+    @prev_hash.setter
+    def prev_hash(self, value: str):
+        self.header.prev_hash = bytes.fromhex(value)
+    
+    @property
+    def merkle_root(self) -> str:
+        return self.header.merkle_root.hex()
+    
+    @merkle_root.setter
+    def merkle_root(self, value: str):
+        self.header.merkle_root = bytes.fromhex(value)
+    
+    @property
+    def timestamp(self) -> int:
+        return self.header.timestamp
+    
+    @timestamp.setter
+    def timestamp(self, value: int):
+        self.header.timestamp = value
+    
+    @property
+    def bits(self) -> int:
+        return self.header.bits
+    
+    @bits.setter
+    def bits(self, value: int):
+        self.header.bits = value
+    
+    @property
+    def nonce(self) -> int:
+        return self.header.nonce
+    
+    @nonce.setter
+    def nonce(self, value: int):
+        self.header.nonce = value
         
     def calculate_merkle_root(self) -> str:
         """计算区块中所有交易的默克尔根"""
         if not self.transactions:
             return "0" * 64
         
-        # 构建默克尔树并返回根哈希
-        merkle_tree = MerkleTree(self.transactions)
-        return merkle_tree.root.hash if merkle_tree.root else "0" * 64
+        return self.merkle_tree.root_hash.hex()
+    
+    def add_transaction(self, tx: str):
+        """向候选区块追加交易（构建区块模板时使用）"""
+        self.transactions.append(tx)
+        self.merkle_tree.append(tx)
+        self._refresh_header()
+    
+    def replace_transaction(self, index: int, tx: str):
+        """替换候选区块中的交易，例如滚动extranonce后的coinbase（越界时抛出ValueError，区块不变）"""
+        self.merkle_tree.update(index, tx)
+        self.transactions[index] = tx
+        self._refresh_header()
+    
+    def _refresh_header(self):
+        self.merkle_root = self.calculate_merkle_root()
+        self.hash = self.calculate_hash()
         
     def calculate_hash(self) -> str:
-        """计算区块头的哈希值"""
-        block_header = {
-            "version": self.version,
-            "prev_hash": self.prev_hash,
-            "merkle_root": self.merkle_root,
-            "timestamp": self.timestamp,
-            "nonce": self.nonce
-        }
-        header_string = json.dumps(block_header, sort_keys=True)
-        return hashlib.sha256(header_string.encode()).hexdigest()
+        """计算区块头的哈希值（80字节区块头的双重SHA256，字段未变时直接用缓存）"""
+        return self.header.hash.hex()
+    
+    def to_bytes(self) -> bytes:
+        """序列化：80字节区块头 + 交易数量(varint) + 每笔交易(varint长度 + UTF-8内容)"""
+        parts = [self.header.to_bytes(), encode_varint(len(self.transactions))]
+        for tx in self.transactions:
+            data = tx.encode()
+            parts.append(encode_varint(len(data)))
+            parts.append(data)
+        return b''.join(parts)
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Block":
+        """从to_bytes()的结果恢复区块"""
+        header = BlockHeader.from_bytes(data)
+        count, offset = decode_varint(data, BlockHeader.SIZE)
+        transactions = []
+        for _ in range(count):
+            length, offset = decode_varint(data, offset)
+            transactions.append(bytes(data[offset:offset + length]).decode())
+            offset += length
+        
+        block = cls(transactions, header.prev_hash.hex(), header.timestamp)
+        block.header = header
+        block.hash = block.calculate_hash()
+        return block
+
+
+class BlockStore:
+    """区块的磁盘存储引擎
+    
+    - 区块数据追加写入 blk00000.dat、blk00001.dat ...，每条记录为 magic(4) + 长度(4) + 区块数据
+    - 索引追加写入 index.dat，每条48字节：哈希(32) + 高度(4) + 文件号(4) + 偏移(4) + 长度(4)
+    - 启动时把索引读进内存（哈希→位置、高度→哈希），区块本身通过mmap按需读取
+    
+    先写区块数据再写索引。崩溃后重新打开时会截掉不完整的尾部记录，
+    并把"数据已写入但索引没写完"的区块重新加入索引，从而恢复链的最高区块。
+    
+    高度→哈希只记录主链：接在主链末端的区块直接延长主链，分叉区块只写入哈希索引。
+    和Blockchain一起使用时，主链由Blockchain按累计工作量通过 set_main_chain 维护；
+    单独打开时取最高（同高度先写入）的区块作为主链末端。
+    """
+    
+    MAGIC = b'\xf9\xbe\xb4\xd9'
+    _RECORD_HEADER = struct.Struct("<4sI")
+    _INDEX_ENTRY = struct.Struct("<32sIIII")
+    
+    def __init__(self, directory: str, max_file_size: int = 128 * 1024 * 1024, sync: bool = False):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.sync = sync  # 每次写入后是否fsync（更安全但更慢）
+        os.makedirs(directory, exist_ok=True)
+        
+        self._index: Dict[str, Tuple[int, int, int, int]] = {}  # 哈希 -> (高度, 文件号, 偏移, 长度)
+        self._by_height: List[str] = []  # 高度 -> 主链上的区块哈希
+        self._maps: Dict[int, mmap.mmap] = {}
+        self.tip_hash: Optional[str] = None
+        self.tip_height = -1
+        
+        self._load_index()
+        self._current_file = max([0] + [entry[1] for entry in self._index.values()])
+        # 崩溃可能发生在刚切换到新文件之后
+        while os.path.exists(self._block_path(self._current_file + 1)):
+            self._current_file += 1
+        self._recover_unindexed_blocks()
+        self._rebuild_main_chain()
+        self._block_file = open(self._block_path(self._current_file), "ab")
+        self._index_file = open(self._index_path(), "ab")
+    
+    def _block_path(self, file_no: int) -> str:
+        return os.path.join(self.directory, f"blk{file_no:05d}.dat")
+    
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.dat")
+    
+    def _load_index(self):
+        """读取索引文件，丢弃不完整的尾部条目和指向缺失数据的条目"""
+        path = self._index_path()
+        if not os.path.exists(path):
+            return
+        
+        with open(path, "rb") as f:
+            data = f.read()
+        entry_size = self._INDEX_ENTRY.size
+        valid_size = 0
+        file_sizes = {}
+        for pos in range(0, len(data) - entry_size + 1, entry_size):
+            block_hash, height, file_no, offset, length = self._INDEX_ENTRY.unpack_from(data, pos)
+            if file_no not in file_sizes:
+                block_path = self._block_path(file_no)
+                file_sizes[file_no] = os.path.getsize(block_path) if os.path.exists(block_path) else 0
+            if offset + length > file_sizes[file_no]:
+                break
+            self._index[block_hash.hex()] = (height, file_no, offset, length)
+            valid_size = pos + entry_size
+        
+        if valid_size != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+    
+    def _recover_unindexed_blocks(self):
+        """扫描最后一个数据文件中索引之后的记录：完整的补进索引，残缺的截掉"""
+        path = self._block_path(self._current_file)
+        if not os.path.exists(path):
+            return
+        
+        indexed_end = max([0] + [offset + length for _, file_no, offset, length in self._index.values()
+                                 if file_no == self._current_file])
+        with open(path, "rb") as f:
+            f.seek(indexed_end)
+            data = f.read()
+        
+        pos = 0
+        recovered = []
+        while pos + self._RECORD_HEADER.size <= len(data):
+            magic, length = self._RECORD_HEADER.unpack_from(data, pos)
+            start = pos + self._RECORD_HEADER.size
+            if magic != self.MAGIC or start + length > len(data):
+                break
+            recovered.append((indexed_end + start, bytes(data[start:start + length])))
+            pos = start + length
+        
+        if pos != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(indexed_end + pos)
+        
+        if recovered:
+            with open(self._index_path(), "ab") as index_file:
+                for offset, payload in recovered:
+                    header = BlockHeader.from_bytes(payload)
+                    height = self._height_for_parent(header.prev_hash.hex())
+                    if height is None:
+                        continue  # 前置区块缺失的孤立记录不加入索引
+                    entry = (height, self._current_file, offset, len(payload))
+                    index_file.write(self._INDEX_ENTRY.pack(header.hash, *entry))
+                    self._index[header.hash.hex()] = entry
+    
+    def _height_for_parent(self, prev_hash: str) -> Optional[int]:
+        """新区块的高度；前置区块不在存储中时返回None（只有空存储可以写入创世区块）"""
+        if prev_hash in self._index:
+            return self._index[prev_hash][0] + 1
+        if prev_hash == "0" * 64 and not self._index:
+            return 0
+        return None
+    
+    def _rebuild_main_chain(self):
+        """打开存储时，从最高（同高度先写入）的区块沿前置哈希回溯出主链"""
+        if not self._index:
+            return
+        tip_hash = None
+        tip_height = -1
+        for block_hash, (height, _, _, _) in self._index.items():
+            if height > tip_height:
+                tip_hash, tip_height = block_hash, height
+        
+        chain = [None] * (tip_height + 1)
+        block_hash = tip_hash
+        for height in range(tip_height, -1, -1):
+            chain[height] = block_hash
+            _, file_no, offset, _ = self._index[block_hash]
+            block_hash = BlockHeader.from_bytes(self._read(file_no, offset, BlockHeader.SIZE)).prev_hash.hex()
+        self.set_main_chain(-1, chain)
+    
+    def set_main_chain(self, fork_height: int, block_hashes: List[str]):
+        """重组：保留主链上高度 <= fork_height 的部分，其后替换为block_hashes（按高度升序）"""
+        for block_hash in block_hashes:
+            if block_hash not in self._index:
+                raise KeyError(f"区块不在存储中: {block_hash}")
+        del self._by_height[fork_height + 1:]
+        self._by_height.extend(block_hashes)
+        self.tip_hash = self._by_height[-1] if self._by_height else None
+        self.tip_height = len(self._by_height) - 1
+    
+    def put(self, block: Block) -> int:
+        """追加一个区块，返回它的高度。前一个区块必须已经在存储中（创世区块除外）"""
+        if block.hash in self._index:
+            return self._index[block.hash][0]
+        height = self._height_for_parent(block.prev_hash)
+        if height is None:
+            raise KeyError(f"找不到前置区块: {block.prev_hash}")
+        
+        payload = block.to_bytes()
+        if self._block_file.tell() > 0 and self._block_file.tell() + len(payload) > self.max_file_size:
+            self._block_file.close()
+            self._current_file += 1
+            self._block_file = open(self._block_path(self._current_file), "ab")
+        
+        offset = self._block_file.tell() + self._RECORD_HEADER.size
+        self._block_file.write(self._RECORD_HEADER.pack(self.MAGIC, len(payload)))
+        self._block_file.write(payload)
+        self._flush(self._block_file)
+        
+        entry = (height, self._current_file, offset, len(payload))
+        self._index_file.write(self._INDEX_ENTRY.pack(bytes.fromhex(block.hash), *entry))
+        self._flush(self._index_file)
+        self._index[block.hash] = entry
+        if block.prev_hash == self.tip_hash or self.tip_hash is None:
+            self.set_main_chain(height - 1, [block.hash])
+        return height
+    
+    def _flush(self, f):
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+    
+    def _read(self, file_no: int, offset: int, length: int) -> bytes:
+        """通过mmap读取区块数据；文件增长后重新映射"""
+        mapped = self._maps.get(file_no)
+        if mapped is None or len(mapped) < offset + length:
+            if mapped is not None:
+                mapped.close()
+            with open(self._block_path(file_no), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[file_no] = mapped
+        return mapped[offset:offset + length]
+    
+    def get(self, block_hash: str) -> Optional[Block]:
+        """根据哈希读取区块，O(1)查找索引后从mmap中解析"""
+        entry = self._index.get(block_hash)
+        if entry is None:
+            return None
+        return Block.from_bytes(self._read(*entry[1:]))
+    
+    def get_height(self, block_hash: str) -> Optional[int]:
+        entry = self._index.get(block_hash)
+        return entry[0] if entry else None
+    
+    def get_block_at_height(self, height: int) -> Optional[Block]:
+        """读取主链上指定高度的区块"""
+        if 0 <= height < len(self._by_height):
+            return self.get(self._by_height[height])
+        return None
+    
+    def iter_headers(self):
+        """按写入顺序遍历所有区块头，只读取每个区块的前80字节"""
+        for block_hash, (_, file_no, offset, _) in list(self._index.items()):
+            yield block_hash, BlockHeader.from_bytes(self._read(file_no, offset, BlockHeader.SIZE))
+    
+    # 让Blockchain可以像使用dict一样使用BlockStore
+    def __setitem__(self, block_hash: str, block: Block):
+        if block_hash != block.hash:
+            raise ValueError("键必须是区块哈希")
+        self.put(block)
+    
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._index
+    
+    def __len__(self) -> int:
+        return len(self._index)
+    
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+        self._block_file.close()
+        self._index_file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _invert_lowest_one(n: int) -> int:
+    """去掉二进制表示中最低位的1"""
+    return n & (n - 1)
+
+
+def _get_skip_height(height: int) -> int:
+    """跳跃指针指向的高度（与Bitcoin Core的GetSkipHeight相同），保证向任意祖先跳转只需O(log n)步"""
+    if height < 2:
+        return 0
+    if height & 1:
+        return _invert_lowest_one(_invert_lowest_one(height - 1)) + 1
+    return _invert_lowest_one(height)
+
+
+class BlockIndexEntry:
+    """区块索引树的节点：记录父节点、高度、累计工作量和跳跃指针"""
+    
+    __slots__ = ("hash", "prev", "height", "chain_work", "skip", "sequence")
+    
+    def __init__(self, block_hash: str, prev: Optional["BlockIndexEntry"], work: int, sequence: int):
+        self.hash = block_hash
+        self.prev = prev
+        self.height = prev.height + 1 if prev else 0
+        self.chain_work = (prev.chain_work if prev else 0) + work
+        self.sequence = sequence  # 收到的顺序，累计工作量相同时先收到的优先
+        self.skip = prev.get_ancestor(_get_skip_height(self.height)) if prev else None
+    
+    def get_ancestor(self, height: int) -> Optional["BlockIndexEntry"]:
+        """沿跳跃指针找到指定高度的祖先"""
+        if height < 0 or height > self.height:
+            return None
+        walk = self
+        while walk.height > height:
+            skip_height = _get_skip_height(walk.height)
+            skip_height_prev = _get_skip_height(walk.height - 1)
+            if walk.skip is not None and (
+                    skip_height == height or
+                    (skip_height > height and not (skip_height_prev < skip_height - 2 and
+                                                   skip_height_prev >= height))):
+                walk = walk.skip
+            else:
+                walk = walk.prev
+        return walk
+
+
+def find_fork_point(a: BlockIndexEntry, b: BlockIndexEntry) -> BlockIndexEntry:
+    """两个区块的最近公共祖先：先用跳跃指针对齐高度，再一起回退分叉深度那么多步"""
+    if a.height > b.height:
+        a = a.get_ancestor(b.height)
+    elif b.height > a.height:
+        b = b.get_ancestor(a.height)
+    while a is not b:
+        if a.prev is None or b.prev is None:
+            raise ValueError("两个区块没有公共祖先")
+        a = a.prev
+        b = b.prev
+    return a
+
+
+def _verify_header_segment(segment: Tuple[int, Optional[str], List[Tuple[str, bytes]]]
+                           ) -> Tuple[Optional[int], Optional[str]]:
+    """在子进程中验证一段连续的区块头，返回 (失败区块的位置, 原因)，全部通过时返回 (None, None)"""
+    start, prev_hash, items = segment
+    for i, (block_hash, header_bytes) in enumerate(items):
+        header = BlockHeader.from_bytes(header_bytes)
+        if prev_hash is not None and header.prev_hash.hex() != prev_hash:
+            return start + i, f"哈希链接验证失败: {header.prev_hash.hex()} != {prev_hash}"
+        if header.hash.hex() != block_hash:
+            return start + i, f"区块哈希验证失败: {block_hash}"
+        prev_hash = block_hash
+    return None, None
 
 
 class Blockchain:
-    """区块链的简化实现"""
+    """区块链的简化实现
+    
+    所有收到的区块组成一棵索引树，每个节点记录累计工作量。
+    累计工作量最大的区块就是链的最高区块，它变化时通过重组切换到新的分支。
+    """
     
-    def __init__(self):
-        """初始化区块链，创建创世区块"""
+    def __init__(self, store: Optional[BlockStore] = None):
+        """初始化区块链
+        
+        不传store时区块都保存在内存dict中；传入BlockStore时区块写入磁盘，
+        如果存储中已有区块，就从区块头重建索引树，恢复创世区块和链的最高区块。
+        """
+        self.blocks = store if store is not None else {}
+        self.store = store
+        # 验证检查点：该区块及之前的区块已经验证通过
+        self.verified_hash: Optional[str] = None
+        self.verified_height = -1
+        
+        self.index: Dict[str, BlockIndexEntry] = {}
+        self.active_chain: List[BlockIndexEntry] = []  # 高度 -> 主链上的索引节点
+        self._tip_heap = []  # (-累计工作量, 收到顺序, 哈希)
+        self.tips = set()  # 没有子区块的区块哈希
+        self.reorgs: List[Dict] = []
+        
+        if store is not None and store.tip_hash is not None:
+            for block_hash, header in store.iter_headers():
+                if self.index and header.prev_hash.hex() not in self.index:
+                    continue  # 不接在索引树上的区块不能成为第二个根
+                self._add_to_index(block_hash, header)
+            self.genesis = store.get(next(iter(self.index)))
+            self.head = self.genesis
+            self.height = 0
+            self.active_chain = [self.index[self.genesis.hash]]
+            self._activate_best_chain()
+            return
+        
         self.genesis = Block(["Genesis Transaction"], "0" * 64)
-        self.blocks = {self.genesis.hash: self.genesis}
+        self.blocks[self.genesis.hash] = self.genesis
+        self.active_chain = [self._add_to_index(self.genesis.hash, self.genesis.header)]
         self.head = self.genesis
         self.height = 0
         
-    def add_block(self, transactions: List[str]) -> Block:
-        """添加新区块到区块链"""
-        new_block = Block(transactions, self.head.hash)
-        self.blocks[new_block.hash] = new_block
-        self.head = new_block
-        self.height += 1
+    def add_block(self, transactions: List[str], prev_hash: str = None) -> Block:
+        """创建新区块并提交。默认接在当前最高区块之后，指定prev_hash可以在旧区块上分叉"""
+        new_block = Block(transactions, prev_hash or self.head.hash)
+        self.submit_block(new_block)
         return new_block
+    
+    def submit_block(self, block: Block) -> bool:
+        """接收一个区块（例如来自其他矿工），返回链的最高区块是否因此改变"""
+        if block.hash in self.index:
+            return False
+        if block.prev_hash not in self.index:
+            raise KeyError(f"找不到前置区块: {block.prev_hash}")
+        
+        self.blocks[block.hash] = block
+        self._add_to_index(block.hash, block.header)
+        return self._activate_best_chain()
+    
+    def _add_to_index(self, block_hash: str, header: BlockHeader) -> BlockIndexEntry:
+        prev = self.index.get(header.prev_hash.hex())
+        entry = BlockIndexEntry(block_hash, prev, header.work(), len(self.index))
+        self.index[block_hash] = entry
+        heapq.heappush(self._tip_heap, (-entry.chain_work, entry.sequence, block_hash))
+        if prev is not None:
+            self.tips.discard(prev.hash)
+        self.tips.add(block_hash)
+        return entry
+    
+    def _activate_best_chain(self) -> bool:
+        """切换到累计工作量最大的分支。
+        
+        累计工作量沿着链只增不减，所以堆顶就是最佳链的最高区块，不需要删除旧元素。
+        """
+        best = self.index[self._tip_heap[0][2]]
+        old_tip = self.active_chain[-1]
+        if best is old_tip:
+            return False
+        
+        if best.prev is old_tip:
+            disconnected = 0
+            fork = old_tip
+        else:
+            fork = find_fork_point(old_tip, best)
+            disconnected = old_tip.height - fork.height
+        
+        # 主链数组截到分叉点，再补上新分支
+        connected = []
+        walk = best
+        while walk is not fork:
+            connected.append(walk)
+            walk = walk.prev
+        connected.reverse()
+        del self.active_chain[fork.height + 1:]
+        self.active_chain.extend(connected)
+        if self.store is not None:
+            self.store.set_main_chain(fork.height, [entry.hash for entry in connected])
+        
+        if disconnected:
+            self.reorgs.append({
+                "fork_height": fork.height,
+                "depth": disconnected,
+                "old_head": old_tip.hash,
+                "new_head": best.hash
+            })
+        self.head = self.get_block(best.hash)
+        self.height = best.height
+        return True
+    
+    def is_in_main_chain(self, block_hash: str) -> bool:
+        """O(1) 判断区块是否在主链上"""
+        entry = self.index.get(block_hash)
+        return (entry is not None and entry.height < len(self.active_chain) and
+                self.active_chain[entry.height] is entry)
+    
+    def get_chain_tips(self) -> List[Dict]:
+        """列出所有分支的末端及其累计工作量"""
+        tips = []
+        for block_hash in self.tips:
+            entry = self.index[block_hash]
+            fork = entry
+            while not self.is_in_main_chain(fork.hash):
+                fork = fork.prev
+            tips.append({
+                "hash": block_hash,
+                "height": entry.height,
+                "chain_work": entry.chain_work,
+                "branch_length": entry.height - fork.height,
+                "status": "active" if fork is entry else "valid-fork"
+            })
+        return sorted(tips, key=lambda tip: -tip["chain_work"])
         
     def get_block(self, block_hash: str) -> Optional[Block]:
         """根据哈希获取区块"""
         return self.blocks.get(block_hash)
         
-    def verify_chain(self) -> bool:
-        """验证整条区块链的完整性"""
-        current = self.head
+    def verify_chain(self, full: bool = False, parallel: bool = False, workers: int = None) -> bool:
+        """验证区块链的完整性
         
-        # 从头部区块开始向后验证
-        while current.prev_hash != "0" * 64:  # 直到创世区块
-            # 获取前一个区块
+        默认只验证上次验证通过的检查点之后新增的区块；full=True时从创世区块重新验证，
+        parallel=True时把整条链分段交给进程池并行验证。详细结果见 verify_chain_report。
+        """
+        report = self.verify_chain_report(full=full, parallel=parallel, workers=workers)
+        if not report["valid"]:
+            print(f"区块验证失败 (高度 {report['failed_height']}): {report['reason']}")
+        return report["valid"]
+    
+    def verify_chain_report(self, full: bool = False, parallel: bool = False,
+                            workers: int = None) -> Dict:
+        """验证区块链并返回报告：是否有效、失败的区块和原因、各阶段耗时"""
+        report = {
+            "valid": True,
+            "checked_blocks": 0,
+            "failed_block": None,
+            "failed_height": None,
+            "reason": None,
+            "timings": {}
+        }
+        
+        # 阶段1：从头部向后收集需要验证的区块，遇到检查点就停止
+        phase_start = time.perf_counter()
+        stop_hash = None if (full or parallel) else self.verified_hash
+        blocks = []
+        current = self.head
+        while current.hash != stop_hash:
+            blocks.append(current)
+            if current.prev_hash == "0" * 64:  # 到达创世区块
+                break
             previous = self.get_block(current.prev_hash)
-            if not previous:
-                print(f"找不到前置区块: {current.prev_hash}")
-                return False
-                
-            # 验证哈希链接
-            if current.prev_hash != previous.hash:
-                print(f"哈希链接验证失败: {current.prev_hash} != {previous.hash}")
-                return False
-                
-            # 验证当前区块的哈希
-            if current.hash != current.calculate_hash():
-                print(f"区块哈希验证失败: {current.hash}")
-                return False
-                
+            if previous is None:
+                report.update(valid=False, failed_block=current.hash,
+                              failed_height=self.height - len(blocks) + 1,
+                              reason=f"找不到前置区块: {current.prev_hash}")
+                report["timings"]["collect"] = time.perf_counter() - phase_start
+                return report
             current = previous
-            
-        return True
+        blocks.reverse()
+        first_height = self.height - len(blocks) + 1
+        report["timings"]["collect"] = time.perf_counter() - phase_start
+        
+        # 阶段2：验证哈希链接和区块哈希
+        phase_start = time.perf_counter()
+        if parallel and blocks:
+            failed_index, reason = self._verify_blocks_parallel(blocks, workers, report["timings"])
+        else:
+            failed_index, reason = self._verify_blocks_serial(blocks)
+        report["timings"]["verify"] = time.perf_counter() - phase_start
+        
+        if failed_index is not None:
+            report.update(valid=False, checked_blocks=failed_index + 1,
+                          failed_block=blocks[failed_index].hash,
+                          failed_height=first_height + failed_index, reason=reason)
+            return report
+        
+        report["checked_blocks"] = len(blocks)
+        self.verified_hash = self.head.hash
+        self.verified_height = self.height
+        return report
+    
+    @staticmethod
+    def _verify_blocks_serial(blocks: List[Block]) -> Tuple[Optional[int], Optional[str]]:
+        for i, block in enumerate(blocks):
+            if i > 0 and block.prev_hash != blocks[i - 1].hash:
+                return i, f"哈希链接验证失败: {block.prev_hash} != {blocks[i - 1].hash}"
+            if block.hash != block.calculate_hash():
+                return i, f"区块哈希验证失败: {block.hash}"
+        return None, None
+    
+    @staticmethod
+    def _verify_blocks_parallel(blocks: List[Block], workers: Optional[int],
+                                timings: Dict) -> Tuple[Optional[int], Optional[str]]:
+        """把区块头切成若干段，在进程池中重新计算哈希"""
+        phase_start = time.perf_counter()
+        workers = workers or multiprocessing.cpu_count()
+        items = [(block.hash, block.header.to_bytes()) for block in blocks]
+        segment_size = max(1, -(-len(items) // (workers * 4)))
+        segments = []
+        for start in range(0, len(items), segment_size):
+            prev_hash = items[start - 1][0] if start > 0 else None
+            segments.append((start, prev_hash, items[start:start + segment_size]))
+        timings["prepare"] = time.perf_counter() - phase_start
+        
+        with multiprocessing.Pool(workers) as pool:
+            for failed_index, reason in pool.imap(_verify_header_segment, segments):
+                if failed_index is not None:
+                    return failed_index, reason
+        return None, None
         
     def get_chain_info(self) -> Dict:
         """获取区块链信息"""
@@ -119,112 +870,232 @@ class Blockchain:
             "height": self.height,
             "head_hash": self.head.hash,
             "total_blocks": len(self.blocks),
-            "genesis_hash": self.genesis.hash
+            "verified_height": self.verified_height,
+            "genesis_hash": self.genesis.hash,
+            "chain_work": self.active_chain[-1].chain_work,
+            "stale_blocks": len(self.index) - len(self.active_chain),
+            "reorgs": len(self.reorgs),
+            "max_reorg_depth": max((reorg["depth"] for reorg in self.reorgs), default=0)
         }
 
 
 class MerkleNode:
     """默克尔树节点"""
     
-    def __init__(self, data: str = None, left=None, right=None):
+    def __init__(self, data: str = None, left=None, right=None, node_hash: bytes = None):
         self.data = data
         self.left = left
         self.right = right
-        self.hash = self.calculate_hash()
+        # 已知哈希时直接使用（例如从扁平数组中取出的根节点）
+        self.hash = node_hash.hex() if node_hash is not None else self.calculate_hash()
         
     def calculate_hash(self) -> str:
-        """计算节点哈希"""
+        """计算节点哈希（比特币规则：对原始字节做双重SHA256）"""
         if self.data:  # 叶子节点
-            return hashlib.sha256(self.data.encode()).hexdigest()
+            return double_sha256(self.data.encode()).hex()
         else:  # 内部节点
-            left_hash = self.left.hash if self.left else ""
-            right_hash = self.right.hash if self.right else ""
-            combined = left_hash + right_hash
-            return hashlib.sha256(combined.encode()).hexdigest()
+            left_hash = bytes.fromhex(self.left.hash) if self.left else b""
+            right_hash = bytes.fromhex(self.right.hash) if self.right else b""
+            return double_sha256(left_hash + right_hash).hex()
             
     def is_leaf(self) -> bool:
         """判断是否为叶子节点"""
         return self.data is not None
 
 
+def build_merkle_levels(leaf_hashes: List[bytes]) -> List[bytearray]:
+    """自底向上逐层构建默克尔树，返回每一层的扁平哈希数组
+    
+    第k层是一个预分配的bytearray，第i个节点的哈希位于[32*i, 32*i+32)。
+    父节点 = double_sha256(左子 || 右子)，节点数为奇数时最后一个节点与自身配对。
+    整个过程只有循环，没有递归，也不为每个节点创建对象。
+    """
+    count = len(leaf_hashes)
+    level = bytearray(32 * count)
+    for i, leaf_hash in enumerate(leaf_hashes):
+        level[32 * i:32 * i + 32] = leaf_hash
+    levels = [level]
+    
+    sha256 = hashlib.sha256
+    while count > 1:
+        parent_count = (count + 1) // 2
+        parent = bytearray(32 * parent_count)
+        view = memoryview(level)
+        for i in range(parent_count):
+            offset = 64 * i
+            if 2 * i + 1 < count:
+                pair = view[offset:offset + 64]  # 左右子节点在内存中相邻，直接切片不复制
+            else:
+                pair = bytes(view[offset:offset + 32]) * 2
+            parent[32 * i:32 * i + 32] = sha256(sha256(pair).digest()).digest()
+        levels.append(parent)
+        level = parent
+        count = parent_count
+    return levels
+
+
 class MerkleTree:
-    """默克尔树实现"""
+    """默克尔树实现（按层存储的扁平数组）
+    
+    叶子是交易数据的双重SHA256，每一层的哈希以原始32字节连续存放在bytearray中，
+    可以构建上百万叶子的树。
+    """
     
     def __init__(self, transactions: List[str]):
         """构建默克尔树"""
-        if not transactions:
+        self.transactions = list(transactions)
+        self._build([double_sha256(tx.encode()) for tx in self.transactions])
+    
+    @classmethod
+    def from_hashes(cls, leaf_hashes: List[bytes]) -> "MerkleTree":
+        """直接用32字节交易哈希(txid)构建，适用于区块和SPV场景"""
+        tree = cls.__new__(cls)
+        tree.transactions = []
+        tree._build(list(leaf_hashes))
+        return tree
+    
+    def _build(self, leaf_hashes: List[bytes]):
+        self.levels = build_merkle_levels(leaf_hashes) if leaf_hashes else []
+        self._refresh_root()
+    
+    def _refresh_root(self):
+        if not self.levels:
             self.root = None
-            self.leaves = []
             return
+        # 根节点只保存哈希；单叶子树的根就是该叶子
+        root_data = self.transactions[0] if self.leaf_count == 1 and self.transactions else None
+        self.root = MerkleNode(data=root_data, node_hash=self.root_hash)
+    
+    def append(self, tx: str):
+        """追加一笔交易，只重算新叶子到根的路径"""
+        self.transactions.append(tx)
+        self.append_hash(double_sha256(tx.encode()))
+    
+    def update(self, index: int, tx: str):
+        """替换第index笔交易（例如滚动extranonce后的coinbase），只重算一条路径"""
+        self._check_index(index)
+        if index < len(self.transactions):
+            self.transactions[index] = tx
+        self.update_hash(index, double_sha256(tx.encode()))
+    
+    def append_hash(self, leaf_hash: bytes):
+        """追加一个32字节叶子哈希"""
+        if not self.levels:
+            self.levels.append(bytearray())
+        self.levels[0] += leaf_hash
+        self._rehash_path(self.leaf_count - 1)
+    
+    def update_hash(self, index: int, leaf_hash: bytes):
+        """替换第index个叶子哈希"""
+        self._check_index(index)
+        self.levels[0][32 * index:32 * index + 32] = leaf_hash
+        self._rehash_path(index)
+    
+    def _rehash_path(self, leaf_index: int):
+        """沿叶子到根的路径逐层重算父节点，共O(log n)次哈希
+        
+        追加叶子时，新节点总是各层的最后一个节点：父节点不存在就在上一层末尾追加，
+        原来与自身配对的最后一个节点也会因此得到新的兄弟。
+        """
+        node_index = leaf_index
+        depth = 0
+        while len(self.levels[depth]) > 32:
+            level = self.levels[depth]
+            parent_index = node_index // 2
+            left = 2 * parent_index
+            right = min(left + 1, len(level) // 32 - 1)
+            parent_hash = double_sha256(level[32 * left:32 * left + 32] +
+                                        level[32 * right:32 * right + 32])
             
-        # 创建叶子节点
-        self.leaves = [MerkleNode(tx) for tx in transactions]
-        # 构建树
-        self.root = self.build_tree(self.leaves[:])  # 复制列表避免修改原始数据
-        
-    def build_tree(self, nodes: List[MerkleNode]) -> MerkleNode:
-        """递归构建默克尔树"""
-        if len(nodes) == 1:
-            return nodes[0]
-            
-        # 如果节点数为奇数，复制最后一个节点
-        if len(nodes) % 2 == 1:
-            nodes.append(nodes[-1])
-            
-        # 创建下一层节点
-        next_level = []
-        for i in range(0, len(nodes), 2):
-            left = nodes[i]
-            right = nodes[i + 1]
-            parent = MerkleNode(left=left, right=right)
-            next_level.append(parent)
+            if depth + 1 == len(self.levels):
+                self.levels.append(bytearray())
+            parent_level = self.levels[depth + 1]
+            if len(parent_level) == 32 * parent_index:
+                parent_level += parent_hash
+            else:
+                parent_level[32 * parent_index:32 * parent_index + 32] = parent_hash
             
-        return self.build_tree(next_level)
+            node_index = parent_index
+            depth += 1
+        self._refresh_root()
+    
+    @property
+    def root_hash(self) -> Optional[bytes]:
+        """32字节默克尔根"""
+        return bytes(self.levels[-1]) if self.levels else None
+    
+    @property
+    def leaf_count(self) -> int:
+        return len(self.levels[0]) // 32 if self.levels else 0
+    
+    @property
+    def leaves(self) -> List[bytes]:
+        """所有叶子哈希"""
+        return self.level_hashes(0)
+    
+    def level_hashes(self, depth: int) -> List[bytes]:
+        """取出第depth层（0为叶子层）的所有节点哈希"""
+        if not self.levels:
+            return []
+        level = self.levels[depth]
+        return [bytes(level[i:i + 32]) for i in range(0, len(level), 32)]
         
     def generate_proof(self, tx_index: int) -> List[Dict]:
-        """为指定交易生成默克尔证明路径"""
-        if tx_index >= len(self.leaves):
-            return []
-            
-        proof = []
-        current_nodes = self.leaves[:]
-        current_index = tx_index
-        
-        # 自底向上构建证明路径
-        while len(current_nodes) > 1:
-            # 如果节点数为奇数，复制最后一个节点
-            if len(current_nodes) % 2 == 1:
-                current_nodes.append(current_nodes[-1])
-                
-            # 找到兄弟节点
-            sibling_index = current_index + 1 if current_index % 2 == 0 else current_index - 1
-            sibling_hash = current_nodes[sibling_index].hash
-            is_left = current_index % 2 == 0
-            
-            proof.append({
-                "hash": sibling_hash,
-                "is_left": is_left
-            })
-            
-            # 准备下一层
-            next_level = []
-            for i in range(0, len(current_nodes), 2):
-                left = current_nodes[i]
-                right = current_nodes[i + 1]
-                parent = MerkleNode(left=left, right=right)
-                next_level.append(parent)
-                
-            current_nodes = next_level
-            current_index = current_index // 2
-            
-        return proof
+        """为指定交易生成默克尔证明路径（直接读取已存储的各层，O(log n)）"""
+        self._check_index(tx_index)
+        return [self._proof_step(depth, node_index)
+                for depth, node_index in self._path(tx_index)]
+    
+    def generate_proofs(self, tx_indices: List[int]) -> Dict[int, List[Dict]]:
+        """批量生成多笔交易的证明
+        
+        两笔交易在某一层经过同一个节点时，从这一层往上的证明步骤完全相同，
+        所以按(层, 节点位置)缓存证明步骤，每个兄弟哈希只读取和编码一次。
+        """
+        tx_indices = list(tx_indices)
+        for tx_index in tx_indices:
+            self._check_index(tx_index)
+        step_cache = {}
+        proofs = {}
+        for tx_index in tx_indices:
+            proof = []
+            for key in self._path(tx_index):
+                step = step_cache.get(key)
+                if step is None:
+                    step = step_cache[key] = self._proof_step(*key)
+                proof.append(step)
+            proofs[tx_index] = proof
+        return proofs
+    
+    def _check_index(self, tx_index: int):
+        """交易位置必须在 [0, 交易数) 内，负数索引会从列表末尾取到别的交易"""
+        if not 0 <= tx_index < self.leaf_count:
+            raise ValueError(f"交易位置 {tx_index} 超出范围 [0, {self.leaf_count})")
+    
+    def _path(self, tx_index: int):
+        """叶子到根路径上（不含根）每一层的 (层, 节点位置)"""
+        node_index = tx_index
+        for depth in range(len(self.levels) - 1):
+            yield depth, node_index
+            node_index //= 2
+    
+    def _proof_step(self, depth: int, node_index: int) -> Dict:
+        """读取某个节点的兄弟哈希（奇数个节点时最后一个节点的兄弟是它自己）"""
+        level = self.levels[depth]
+        sibling_index = node_index + 1 if node_index % 2 == 0 else node_index - 1
+        sibling_index = min(sibling_index, len(level) // 32 - 1)
+        return {
+            "hash": level[32 * sibling_index:32 * sibling_index + 32].hex(),
+            "is_left": node_index % 2 == 0
+        }
         
-    def verify_proof(self, tx_hash: str, proof: List[Dict], root_hash: str) -> bool:
-        """验证默克尔证明"""
-        current_hash = hashlib.sha256(tx_hash.encode()).hexdigest()
+    @staticmethod
+    def verify_proof(tx_hash: str, proof: List[Dict], root_hash: str) -> bool:
+        """验证默克尔证明（不依赖树本身，SPV节点可以直接调用）"""
+        current_hash = double_sha256(tx_hash.encode())
         
         for step in proof:
-            sibling_hash = step["hash"]
+            sibling_hash = bytes.fromhex(step["hash"])
             is_left = step["is_left"]
             
             if is_left:
@@ -232,18 +1103,616 @@ class MerkleTree:
             else:
                 combined = sibling_hash + current_hash
                 
-            current_hash = hashlib.sha256(combined.encode()).hexdigest()
+            current_hash = double_sha256(combined)
             
-        return current_hash == root_hash
+        return current_hash.hex() == root_hash
+
+
+def encode_varint(n: int) -> bytes:
+    """比特币变长整数(CompactSize)编码"""
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b'\xfd' + n.to_bytes(2, 'little')
+    if n <= 0xffffffff:
+        return b'\xfe' + n.to_bytes(4, 'little')
+    return b'\xff' + n.to_bytes(8, 'little')
+
+
+def decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """解码变长整数，返回 (数值, 新偏移)"""
+    prefix = data[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[prefix]
+    return int.from_bytes(data[offset + 1:offset + 1 + size], 'little'), offset + 1 + size
+
+
+class PartialMerkleTree:
+    """部分默克尔树（BIP37 merkleblock 格式的多交易证明）
+    
+    一个结构同时证明K笔交易的包含性：深度优先遍历整棵树，每个节点记一个标志位，
+    只有"子树里包含目标交易"的节点才继续向下展开，其余子树只给出一个哈希。
+    多笔交易共享的内部节点只出现一次，验证时一次自底向上的遍历就能检查全部K笔交易。
+    """
+    
+    MAX_TRANSACTIONS = 4_000_000 // 240  # 区块最大权重 / 最小交易权重
+    
+    def __init__(self, tx_count: int, hashes: List[bytes], flags: List[bool]):
+        self.tx_count = tx_count
+        self.hashes = hashes
+        self.flags = flags
+    
+    def _tree_width(self, height: int) -> int:
+        """第height层（0为叶子层）的节点数"""
+        return (self.tx_count + (1 << height) - 1) >> height
+    
+    def _tree_height(self) -> int:
+        height = 0
+        while self._tree_width(height) > 1:
+            height += 1
+        return height
+    
+    @classmethod
+    def from_tree(cls, tree: MerkleTree, match_indices: List[int]) -> "PartialMerkleTree":
+        """从完整的默克尔树中为指定交易构建部分默克尔树"""
+        partial = cls(tree.leaf_count, [], [])
+        matched = sorted(set(match_indices))
+        
+        def traverse(height: int, pos: int):
+            # 该节点覆盖的叶子范围里是否有目标交易
+            first, last = pos << height, min((pos + 1) << height, partial.tx_count)
+            k = bisect.bisect_left(matched, first)
+            parent_of_match = k < len(matched) and matched[k] < last
+            partial.flags.append(parent_of_match)
+            if height == 0 or not parent_of_match:
+                level = tree.levels[height]
+                partial.hashes.append(bytes(level[32 * pos:32 * pos + 32]))
+                return
+            traverse(height - 1, pos * 2)
+            if pos * 2 + 1 < partial._tree_width(height - 1):
+                traverse(height - 1, pos * 2 + 1)
+        
+        if partial.tx_count:
+            traverse(partial._tree_height(), 0)
+        return partial
+    
+    def extract_matches(self) -> Tuple[Optional[bytes], List[Tuple[int, bytes]]]:
+        """一次遍历计算默克尔根并取出被证明的交易，返回 (根哈希, [(位置, 交易哈希)])
+        
+        结构不合法（标志位/哈希数量不符、左右子节点相同）时根哈希为None。
+        """
+        if not 0 < self.tx_count <= self.MAX_TRANSACTIONS:
+            return None, []
+        # 每个哈希至少对应一个标志位，哈希数不能超过交易数
+        if not self.hashes or len(self.hashes) > self.tx_count or len(self.flags) < len(self.hashes):
+            return None, []
+        
+        matches = []
+        cursor = {"bit": 0, "hash": 0}
+        
+        def traverse(height: int, pos: int) -> bytes:
+            if cursor["bit"] >= len(self.flags):
+                raise ValueError("标志位不足")
+            parent_of_match = self.flags[cursor["bit"]]
+            cursor["bit"] += 1
+            if height == 0 or not parent_of_match:
+                if cursor["hash"] >= len(self.hashes):
+                    raise ValueError("哈希数量不足")
+                node_hash = self.hashes[cursor["hash"]]
+                cursor["hash"] += 1
+                if height == 0 and parent_of_match:
+                    matches.append((pos, node_hash))
+                return node_hash
+            left = traverse(height - 1, pos * 2)
+            if pos * 2 + 1 < self._tree_width(height - 1):
+                right = traverse(height - 1, pos * 2 + 1)
+                # 左右相同说明有人在伪造重复交易（CVE-2012-2459）
+                if right == left:
+                    raise ValueError("左右子节点哈希相同")
+            else:
+                right = left
+            return double_sha256(left + right)
+        
+        try:
+            root = traverse(self._tree_height(), 0)
+        except ValueError:
+            return None, []
+        
+        # 所有哈希必须用完，标志位只允许补齐到整字节
+        if cursor["hash"] != len(self.hashes) or (cursor["bit"] + 7) // 8 != (len(self.flags) + 7) // 8:
+            return None, []
+        return root, matches
+    
+    def to_bytes(self) -> bytes:
+        """序列化：交易数 + 哈希列表 + 按字节打包的标志位（低位在前）"""
+        flag_bytes = bytearray((len(self.flags) + 7) // 8)
+        for i, flag in enumerate(self.flags):
+            if flag:
+                flag_bytes[i // 8] |= 1 << (i % 8)
+        return (self.tx_count.to_bytes(4, 'little') +
+                encode_varint(len(self.hashes)) + b''.join(self.hashes) +
+                encode_varint(len(flag_bytes)) + bytes(flag_bytes))
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PartialMerkleTree":
+        """反序列化，格式或结构不合法时抛出ValueError
+        
+        除长度检查外还做一次完整遍历（BIP37）：所有哈希都必须用到，
+        标志位只允许补齐到整字节，数据末尾不能有多余字节。
+        """
+        if len(data) < 5:
+            raise ValueError("部分默克尔树数据太短")
+        tx_count = int.from_bytes(data[0:4], 'little')
+        hash_count, offset = decode_varint(data, 4)
+        if offset + 32 * hash_count >= len(data):
+            raise ValueError("哈希列表超出数据长度")
+        hashes = [bytes(data[offset + 32 * i:offset + 32 * i + 32]) for i in range(hash_count)]
+        offset += 32 * hash_count
+        flag_len, offset = decode_varint(data, offset)
+        if offset + flag_len != len(data):
+            raise ValueError("标志位长度与数据长度不符")
+        flag_bytes = data[offset:offset + flag_len]
+        flags = [bool(flag_bytes[i // 8] >> (i % 8) & 1) for i in range(8 * flag_len)]
+        
+        partial = cls(tx_count, hashes, flags)
+        if partial.extract_matches()[0] is None:
+            raise ValueError("部分默克尔树结构不合法")
+        return partial
+
+
+MAINNET_POW_LIMIT = 0xFFFF << 208  # 主网最低难度（难度位0x1d00ffff）对应的目标值
+REGTEST_POW_LIMIT = 0x7FFFFF << 232  # regtest（难度位0x207fffff）
+
+
+class HeaderChain:
+    """区块头链同步引擎（SPV节点使用）
+    
+    区块头到达时立即检查哈希链接、难度位和工作量证明。难度位只能在每2016个区块的调整高度改变，
+    并且新目标值在旧目标值的 1/4 ~ 4 倍之间、不超过pow_limit，否则对端可以用任意低的难度伪造长链。
+    （这里检查的是允许的调整范围，不按时间戳精确重算难度。）
+    
+    原始区块头按高度连续存放在一个bytearray中，
+    另有 高度→哈希 的数组和 哈希→高度 的dict，所以按高度、按哈希查找和取链尾都是O(1)。
+    这里只跟随一条链：不连接到链尾的区块头会被拒绝（分叉选择见Blockchain）。
+    """
+    
+    RETARGET_INTERVAL = 2016
+    
+    def __init__(self, pow_limit: int = MAINNET_POW_LIMIT):
+        self.pow_limit = pow_limit
+        self._raw = bytearray()  # 高度h的区块头位于 [h*80, h*80+80)
+        self.hashes: List[bytes] = []  # 高度 -> 区块哈希（内部字节序）
+        self.height_of: Dict[bytes, int] = {}
+        self.chain_work = 0
+        self._targets: Dict[int, Tuple[int, int]] = {}  # bits -> (目标值, 工作量)
+    
+    @property
+    def height(self) -> int:
+        """链尾高度，空链为-1"""
+        return len(self.hashes) - 1
+    
+    @property
+    def tip_hash(self) -> Optional[bytes]:
+        return self.hashes[-1] if self.hashes else None
+    
+    def _target_and_work(self, bits: int) -> Tuple[int, int]:
+        cached = self._targets.get(bits)
+        if cached is None:
+            header = BlockHeader(bits=bits)
+            target = header.target()
+            if target > self.pow_limit:
+                raise ValueError(f"难度位 {bits:#010x} 的目标值超过了工作量证明上限")
+            cached = self._targets[bits] = (target, header.work())
+        return cached
+    
+    def _retarget_allowed(self, old_bits: int, new_bits: int) -> bool:
+        """调整高度上新难度位是否在允许的范围内（边界按紧凑编码舍入，与Bitcoin Core相同）"""
+        old_target = self._target_and_work(old_bits)[0]
+        new_target = self._target_and_work(new_bits)[0]
+        largest = BlockHeader(bits=BlockHeader.bits_for_target(
+            min(old_target * 4, self.pow_limit))).target()
+        smallest = BlockHeader(bits=BlockHeader.bits_for_target(old_target // 4)).target()
+        return smallest <= new_target <= largest
+    
+    def add_headers(self, data) -> int:
+        """追加连续的80字节区块头（bytes/bytearray/memoryview），返回接受的数量
+        
+        遇到无效区块头时抛出ValueError，它之前的区块头仍然保留。
+        """
+        view = memoryview(data)
+        if len(view) % BlockHeader.SIZE:
+            raise ValueError("数据长度不是80字节的整数倍")
+        
+        sha256 = hashlib.sha256
+        from_bytes = int.from_bytes
+        hashes = self.hashes
+        height_of = self.height_of
+        tip = hashes[-1] if hashes else bytes(32)
+        tip_bits = from_bytes(self._raw[-8:-4], "little") if hashes else None
+        interval = self.RETARGET_INTERVAL
+        accepted = 0
+        work = 0
+        try:
+            for offset in range(0, len(view), BlockHeader.SIZE):
+                header = view[offset:offset + BlockHeader.SIZE]
+                height = len(hashes)
+                if header[4:36] != tip:
+                    raise ValueError(f"高度 {height} 的区块头没有连接到链尾")
+                bits = from_bytes(header[72:76], "little")
+                if tip_bits is not None and bits != tip_bits and (
+                        height % interval or not self._retarget_allowed(tip_bits, bits)):
+                    raise ValueError(f"高度 {height} 的难度位 {bits:#010x} 不符合难度调整规则")
+                block_hash = sha256(sha256(header).digest()).digest()
+                target, header_work = self._target_and_work(bits)
+                if from_bytes(block_hash, "little") > target:
+                    raise ValueError(f"高度 {height} 的区块头工作量证明无效")
+                height_of[block_hash] = height
+                hashes.append(block_hash)
+                tip = block_hash
+                tip_bits = bits
+                work += header_work
+                accepted += 1
+        finally:
+            self._raw += view[:accepted * BlockHeader.SIZE]
+            self.chain_work += work
+        return accepted
+    
+    def add_header(self, header: BlockHeader) -> int:
+        """追加一个区块头，返回它的高度"""
+        self.add_headers(header.to_bytes())
+        return self.height
+    
+    def load_file(self, path: str, chunk_headers: int = 100000) -> int:
+        """从文件导入连续存放的80字节区块头，返回导入数量"""
+        total = 0
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_headers * BlockHeader.SIZE)
+                if not chunk:
+                    break
+                total += self.add_headers(chunk)
+        return total
+    
+    def get_header(self, height: int) -> Optional[BlockHeader]:
+        if not 0 <= height < len(self.hashes):
+            return None
+        offset = height * BlockHeader.SIZE
+        # 复制一份：bytearray被memoryview引用时无法再追加
+        return BlockHeader.from_bytes(bytes(self._raw[offset:offset + BlockHeader.SIZE]))
+    
+    def get_header_by_hash(self, block_hash: bytes) -> Optional[BlockHeader]:
+        height = self.height_of.get(block_hash)
+        return None if height is None else self.get_header(height)
+    
+    def get_locator(self) -> List[bytes]:
+        """生成getheaders用的区块定位器：最近10个区块逐个列出，之后步长翻倍，最后是创世区块"""
+        locator = []
+        height = self.height
+        step = 1
+        while height > 0:
+            locator.append(self.hashes[height])
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        if self.hashes:
+            locator.append(self.hashes[0])
+        return locator
+    
+    def find_fork(self, locator: List[bytes]) -> int:
+        """对端定位器中第一个我们也有的区块的高度（都没有时返回-1）"""
+        for block_hash in locator:
+            height = self.height_of.get(block_hash)
+            if height is not None:
+                return height
+        return -1
+    
+    def headers_after(self, locator: List[bytes], max_count: int = 2000) -> bytes:
+        """响应getheaders：返回分叉点之后最多max_count个原始区块头"""
+        start = self.find_fork(locator) + 1
+        end = min(len(self.hashes), start + max_count)
+        return bytes(self._raw[start * BlockHeader.SIZE:end * BlockHeader.SIZE])
+
+
+def generate_regtest_headers(count: int, prev_hash: bytes = bytes(32), start_height: int = 0,
+                             bits: int = 0x207fffff) -> bytes:
+    """生成一段满足工作量证明的测试区块头（regtest难度，平均两次哈希就能找到nonce）"""
+    header = BlockHeader(prev_hash=prev_hash, bits=bits)
+    target = header.target()
+    chunks = []
+    for height in range(start_height, start_height + count):
+        header.merkle_root = double_sha256(height.to_bytes(4, "little"))
+        header.timestamp = 1231006505 + height * 600
+        header.nonce = 0
+        while int.from_bytes(header.hash, "little") > target:
+            header.nonce += 1
+        chunks.append(header.to_bytes())
+        header.prev_hash = header.hash
+    return b''.join(chunks)
+
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def siphash24(key: bytes, data: bytes) -> int:
+    """SipHash-2-4（BIP158用它把元素映射成64位整数），key为16字节"""
+    k0 = int.from_bytes(key[:8], "little")
+    k1 = int.from_bytes(key[8:16], "little")
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+    
+    def sip_rounds(v0, v1, v2, v3, rounds):
+        for _ in range(rounds):
+            v0 = (v0 + v1) & _MASK64
+            v1 = ((v1 << 13) | (v1 >> 51)) & _MASK64 ^ v0
+            v0 = ((v0 << 32) | (v0 >> 32)) & _MASK64
+            v2 = (v2 + v3) & _MASK64
+            v3 = ((v3 << 16) | (v3 >> 48)) & _MASK64 ^ v2
+            v0 = (v0 + v3) & _MASK64
+            v3 = ((v3 << 21) | (v3 >> 43)) & _MASK64 ^ v0
+            v2 = (v2 + v1) & _MASK64
+            v1 = ((v1 << 17) | (v1 >> 47)) & _MASK64 ^ v2
+            v2 = ((v2 << 32) | (v2 >> 32)) & _MASK64
+        return v0, v1, v2, v3
+    
+    full = len(data) - len(data) % 8
+    for i in range(0, full, 8):
+        m = int.from_bytes(data[i:i + 8], "little")
+        v3 ^= m
+        v0, v1, v2, v3 = sip_rounds(v0, v1, v2, v3, 2)
+        v0 ^= m
+    # 最后一块：剩余字节 + 长度放在最高字节
+    m = int.from_bytes(data[full:], "little") | ((len(data) & 0xff) << 56)
+    v3 ^= m
+    v0, v1, v2, v3 = sip_rounds(v0, v1, v2, v3, 2)
+    v0 ^= m
+    v2 ^= 0xff
+    v0, v1, v2, v3 = sip_rounds(v0, v1, v2, v3, 4)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+def siphash24_batch(key: bytes, items: List[bytes]) -> List[int]:
+    """用NumPy的uint64数组同时计算多个元素的SipHash-2-4（结果与siphash24相同）
+    
+    长度相同的元素分块数相同，按长度分组后每组一起做SipHash轮函数，加法自然按2^64取模。
+    """
+    k0 = int.from_bytes(key[:8], "little")
+    k1 = int.from_bytes(key[8:16], "little")
+    groups: Dict[int, List[int]] = {}
+    for i, item in enumerate(items):
+        groups.setdefault(len(item), []).append(i)
+    
+    result = [0] * len(items)
+    for length, indices in groups.items():
+        # 最后一块：剩余字节补0，长度放在最高字节
+        padding = bytes(7 - length % 8) + bytes([length & 0xff])
+        blocks = np.frombuffer(b''.join(bytes(items[i]) + padding for i in indices),
+                               dtype='<u8').reshape(len(indices), -1)
+        v0 = np.full(len(indices), k0 ^ 0x736f6d6570736575, dtype=np.uint64)
+        v1 = np.full(len(indices), k1 ^ 0x646f72616e646f6d, dtype=np.uint64)
+        v2 = np.full(len(indices), k0 ^ 0x6c7967656e657261, dtype=np.uint64)
+        v3 = np.full(len(indices), k1 ^ 0x7465646279746573, dtype=np.uint64)
+        
+        for column in range(blocks.shape[1] + 1):
+            if column < blocks.shape[1]:
+                m = blocks[:, column]
+                v3 ^= m
+                rounds = 2
+            else:
+                v2 ^= np.uint64(0xff)
+                rounds = 4
+            for _ in range(rounds):
+                v0 += v1
+                v1 = (v1 << 13) | (v1 >> 51)
+                v1 ^= v0
+                v0 = (v0 << 32) | (v0 >> 32)
+                v2 += v3
+                v3 = (v3 << 16) | (v3 >> 48)
+                v3 ^= v2
+                v0 += v3
+                v3 = (v3 << 21) | (v3 >> 43)
+                v3 ^= v0
+                v2 += v1
+                v1 = (v1 << 17) | (v1 >> 47)
+                v1 ^= v2
+                v2 = (v2 << 32) | (v2 >> 32)
+            if column < blocks.shape[1]:
+                v0 ^= m
+        
+        for i, value in zip(indices, (v0 ^ v1 ^ v2 ^ v3).tolist()):
+            result[i] = value
+    return result
+
+
+class GCSFilter:
+    """BIP158 基础区块过滤器（Golomb编码集合）
+    
+    把区块中的每个脚本用SipHash映射到 [0, N*M) 区间，排序后对相邻差值做Golomb-Rice编码
+    （商用一元编码，余数固定P位）。轻节点只要下载几KB的过滤器，就能判断区块里有没有自己关心的脚本；
+    误报率约为 1/M，没有漏报。
+    
+    第一次匹配时把整个集合解码成有序的64位整数数组并缓存（约为压缩数据的3倍大小），
+    之后每次匹配只需计算查询元素的哈希，再在有序数组里二分查找。
+    """
+    
+    P = 19
+    M = 784931
+    
+    def __init__(self, block_hash: bytes, n: int, data: bytes):
+        self.key = bytes(block_hash[:16])  # 区块哈希（内部字节序）的前16字节
+        self.n = n
+        self.data = data  # Golomb-Rice编码后的比特流
+        self._values = None  # 解码后的有序集合
+    
+    def _hash_items(self, items) -> List[int]:
+        f = self.n * self.M
+        items = list(items)
+        if np is not None and len(items) > 4:
+            hashes = siphash24_batch(self.key, items)
+        else:
+            hashes = [siphash24(self.key, item) for item in items]
+        return sorted((h * f) >> 64 for h in hashes)
+    
+    @classmethod
+    def build(cls, block_hash: bytes, items) -> "GCSFilter":
+        """由区块中的脚本（bytes）构建过滤器，重复元素只保留一个"""
+        items = set(items)
+        gcs = cls(block_hash, len(items), b'')
+        bits = []
+        previous = 0
+        remainder_format = f"0{cls.P}b"
+        mask = (1 << cls.P) - 1
+        for value in gcs._hash_items(items):
+            delta = value - previous
+            previous = value
+            bits.append("1" * (delta >> cls.P) + "0" + format(delta & mask, remainder_format))
+        
+        bitstream = "".join(bits)
+        if bitstream:
+            bitstream += "0" * (-len(bitstream) % 8)
+            gcs.data = int(bitstream, 2).to_bytes(len(bitstream) // 8, "big")
+        gcs._values = gcs._to_array(gcs._hash_items(items))
+        return gcs
+    
+    @classmethod
+    def from_bytes(cls, block_hash: bytes, raw: bytes) -> "GCSFilter":
+        """解析cfilter消息中的过滤器：CompactSize N + 比特流"""
+        n, offset = decode_varint(raw, 0)
+        return cls(block_hash, n, bytes(raw[offset:]))
+    
+    def to_bytes(self) -> bytes:
+        return encode_varint(self.n) + self.data
+    
+    def filter_hash(self) -> bytes:
+        return double_sha256(self.to_bytes())
+    
+    def header(self, prev_header: bytes) -> bytes:
+        """过滤器头 = dSHA256(过滤器哈希 || 前一个过滤器头)，创世区块的前一个过滤器头为32个0"""
+        return double_sha256(self.filter_hash() + prev_header)
+    
+    @staticmethod
+    def _to_array(values: List[int]):
+        return np.array(values, dtype=np.uint64) if np is not None else array("Q", values)
+    
+    def _decoded_values(self):
+        """集合中的值（升序），第一次调用时解码并缓存"""
+        if self._values is None:
+            if self.n == 0:
+                values = []
+            elif np is not None:
+                values = self._decode_numpy()
+            else:
+                values = self._decode()
+            self._values = self._to_array(values)
+        return self._values
+    
+    def _decode(self) -> List[int]:
+        """逐个解码：一元编码的商用str.find定位终止的0，余数取其后的P位"""
+        p = self.P
+        bits = format(int.from_bytes(self.data, "big"), f"0{len(self.data) * 8}b")
+        find = bits.find
+        values = [0] * self.n
+        pos = 0
+        value = 0
+        for k in range(self.n):
+            zero = find("0", pos)
+            if zero < 0 or zero + p >= len(bits):
+                raise ValueError("过滤器数据不完整")
+            value += ((zero - pos) << p) | int(bits[zero + 1:zero + 1 + p], 2)
+            values[k] = value
+            pos = zero + 1 + p
+        return values
+    
+    def _decode_numpy(self):
+        """向量化解码
+        
+        码字 = 商个1 + 终止的0 + P位余数，每个码字的终止符都是比特流里的某个0。
+        先向量化算出"以第i个0为终止符时，下一个码字的终止符是其后第几个0"（1..P+1，存成bytes），
+        逐个跳转只剩一次bytes下标访问；最后一次性取出所有余数并求前缀和。
+        """
+        p = self.P
+        size = len(self.data) * 8
+        raw = np.frombuffer(self.data + bytes(4), dtype=np.uint8)  # 补4字节，读取余数窗口时不越界
+        is_zero = np.unpackbits(raw[:len(self.data)]) == 0
+        zeros = np.flatnonzero(is_zero)
+        # 只需要相距不超过P+1个0的差值，按uint8累加溢出也不影响结果
+        zeros_before = np.zeros(size + 1, dtype=np.uint8)
+        np.cumsum(is_zero, dtype=np.uint8, out=zeros_before[1:])
+        steps = (zeros_before[np.minimum(zeros + 1 + p, size)] - zeros_before[zeros]).tobytes()
+        
+        terminators = array("q", bytes(8 * self.n))
+        t = 0
+        try:
+            for k in range(self.n):
+                terminators[k] = t
+                t += steps[t]
+        except IndexError:
+            raise ValueError("过滤器数据不完整")
+        ends = zeros[np.frombuffer(terminators, dtype=np.int64)]
+        if ends[-1] + p >= size:
+            raise ValueError("过滤器数据不完整")
+        
+        starts = np.zeros_like(ends)
+        starts[1:] = ends[:-1] + 1 + p
+        # 余数从终止符的下一位开始，按大端读取所在的4个字节再移位
+        first_bit = ends + 1
+        index = first_bit >> 3
+        window = np.zeros(self.n, dtype=np.int64)
+        for offset in range(4):
+            window = (window << 8) | raw[index + offset]
+        remainders = (window >> (32 - p - (first_bit & 7))) & ((1 << p) - 1)
+        return np.cumsum(((ends - starts) << p) | remainders)
+    
+    def match_any(self, items) -> bool:
+        """集合中是否包含items里的任意一个（可能误报，不会漏报）"""
+        if self.n == 0:
+            return False
+        targets = self._hash_items(set(items))
+        if not targets:
+            return False
+        
+        values = self._decoded_values()
+        if np is not None:
+            targets = np.array(targets, dtype=np.uint64)
+            positions = np.searchsorted(values, targets)
+            found = positions < len(values)
+            return bool(np.any(values[positions[found]] == targets[found]))
+        for target in targets:
+            i = bisect.bisect_left(values, target)
+            if i < len(values) and values[i] == target:
+                return True
+        return False
+    
+    def match(self, item: bytes) -> bool:
+        return self.match_any([item])
+
+
+def build_basic_filter(block_hash: bytes, output_scripts: List[bytes],
+                       spent_scripts: List[bytes] = ()) -> GCSFilter:
+    """按BIP158基础过滤器规则取元素：所有输出脚本（跳过空脚本和OP_RETURN）+ 被花费的输出脚本"""
+    items = [script for script in output_scripts if script and script[0] != 0x6a]
+    items.extend(script for script in spent_scripts if script)
+    return GCSFilter.build(block_hash, items)
 
 
 class SPVNode:
-    """SPV（简化支付验证）节点"""
+    """SPV（简化支付验证）节点
     
-    def __init__(self):
+    二进制区块头由 header_chain（HeaderChain）验证和保存；
+    add_block_header 保留了按字典手动登记区块头的简单方式，方便演示。
+    """
+    
+    def __init__(self, pow_limit: int = MAINNET_POW_LIMIT):
         """初始化SPV节点"""
-        self.block_headers = {}  # 存储区块头
+        self.block_headers = {}  # 手动登记的区块头
         self.merkle_proofs = {}  # 存储默克尔证明
+        self.header_chain = HeaderChain(pow_limit)
+        self._best_height = -1
+        # BIP157/158：按高度保存的过滤器头和过滤器
+        self.filter_headers: List[bytes] = []
+        self.block_filters: List[GCSFilter] = []
         
     def add_block_header(self, block_hash: str, prev_hash: str, merkle_root: str, 
                         timestamp: int, height: int):
@@ -254,29 +1723,95 @@ class SPVNode:
             "timestamp": timestamp,
             "height": height
         }
+        self._best_height = max(self._best_height, height)
+    
+    def add_header(self, header: BlockHeader) -> int:
+        """添加二进制区块头（例如从P2P消息中用BlockHeader.from_bytes解析得到的），返回高度"""
+        return self.header_chain.add_header(header)
+    
+    def sync_headers(self, data) -> int:
+        """处理headers消息中连续的80字节区块头，返回接受的数量"""
+        return self.header_chain.add_headers(data)
+    
+    def load_headers_file(self, path: str) -> int:
+        """从文件导入区块头"""
+        return self.header_chain.load_file(path)
+    
+    def get_locator(self) -> List[bytes]:
+        """生成发送getheaders请求用的区块定位器"""
+        return self.header_chain.get_locator()
+    
+    def add_block_filter(self, raw_filter: bytes, expected_header: bytes = None) -> bytes:
+        """按高度顺序添加下一个区块的过滤器，返回计算出的过滤器头
+        
+        过滤器头把每个过滤器和前一个过滤器头链接起来；传入从多个节点获得的expected_header
+        （cfheaders/cfcheckpt）时会检查是否一致，防止节点提供伪造的过滤器。
+        """
+        height = len(self.filter_headers)
+        if height > self.header_chain.height:
+            raise ValueError(f"高度 {height} 的区块头还没有同步")
+        
+        block_filter = GCSFilter.from_bytes(self.header_chain.hashes[height], raw_filter)
+        prev_header = self.filter_headers[-1] if self.filter_headers else bytes(32)
+        filter_header = block_filter.header(prev_header)
+        if expected_header is not None and filter_header != expected_header:
+            raise ValueError(f"高度 {height} 的过滤器头不一致")
+        
+        self.filter_headers.append(filter_header)
+        self.block_filters.append(block_filter)
+        return filter_header
+    
+    def find_relevant_blocks(self, watch_scripts: List[bytes], start_height: int = 0) -> List[int]:
+        """用钱包关注的脚本逐个匹配过滤器，返回需要下载完整区块的高度"""
+        return [height for height in range(start_height, len(self.block_filters))
+                if self.block_filters[height].match_any(watch_scripts)]
+    
+    def _merkle_root(self, block_hash: str) -> Optional[str]:
+        """查找区块的默克尔根（十六进制，内部字节序）"""
+        if block_hash in self.block_headers:
+            return self.block_headers[block_hash]["merkle_root"]
+        try:
+            header = self.header_chain.get_header_by_hash(bytes.fromhex(block_hash))
+        except ValueError:
+            return None
+        return header.merkle_root.hex() if header else None
         
     def verify_transaction_inclusion(self, tx_hash: str, block_hash: str, 
                                    merkle_proof: List[Dict]) -> bool:
         """验证交易是否包含在指定区块中"""
-        if block_hash not in self.block_headers:
+        merkle_root = self._merkle_root(block_hash)
+        if merkle_root is None:
             return False
-            
-        block_header = self.block_headers[block_hash]
-        merkle_root = block_header["merkle_root"]
         
         # 使用默克尔证明验证交易
-        merkle_tree = MerkleTree([])  # 创建空树用于验证
-        return merkle_tree.verify_proof(tx_hash, merkle_proof, merkle_root)
+        return MerkleTree.verify_proof(tx_hash, merkle_proof, merkle_root)
+    
+    def verify_transactions_inclusion(self, tx_hashes: List[bytes], block_hash: str,
+                                      partial_tree: PartialMerkleTree) -> bool:
+        """用一个部分默克尔树同时验证多笔交易（32字节txid）是否包含在指定区块中"""
+        if not tx_hashes:
+            return False
+        merkle_root = self._merkle_root(block_hash)
+        if merkle_root is None:
+            return False
+        
+        root, matches = partial_tree.extract_matches()
+        if root is None or root.hex() != merkle_root:
+            return False
+        
+        matched_hashes = {tx_hash for _, tx_hash in matches}
+        return all(tx_hash in matched_hashes for tx_hash in tx_hashes)
         
     def get_block_chain_info(self) -> Dict:
-        """获取轻节点的区块链信息"""
-        if not self.block_headers:
+        """获取轻节点的区块链信息（最高高度是随区块头到达时维护的，O(1)）"""
+        block_count = len(self.block_headers) + len(self.header_chain.hashes)
+        if not block_count:
             return {"height": 0, "blocks": 0}
             
-        max_height = max(header["height"] for header in self.block_headers.values())
         return {
-            "height": max_height,
-            "blocks": len(self.block_headers),
+            "height": max(self._best_height, self.header_chain.height),
+            "blocks": block_count,
+            "chain_work": self.header_chain.chain_work,
             "storage": "headers_only"  # 只存储区块头
         }
 
@@ -321,6 +1856,62 @@ def demonstrate_blockchain():
     # 验证区块链
     is_valid = blockchain.verify_chain()
     print(f"区块链验证: {'✅ 有效' if is_valid else '❌ 无效'}")
+    
+    # 再添加一个区块，增量验证只检查检查点之后的新区块
+    blockchain.add_block(["交易7"])
+    report = blockchain.verify_chain_report()
+    print(f"增量验证: 检查了 {report['checked_blocks']} 个区块, 耗时 {report['timings']['verify'] * 1000:.3f}ms")
+    print()
+
+
+def demonstrate_fork_choice():
+    """演示分叉、按累计工作量选链和重组"""
+    print("=== 分叉与重组演示 ===")
+    
+    blockchain = Blockchain()
+    rng = random.Random(8)
+    competing = None
+    for i in range(5000):
+        if competing and rng.random() < 0.5:
+            # 一半的矿工先收到了竞争区块，在它上面继续挖
+            parent = competing
+            competing = None
+        elif rng.random() < 0.05:
+            # 传播延迟：新区块和当前最高区块接在同一个父区块上
+            parent = blockchain.head.prev_hash
+        else:
+            parent = blockchain.head.hash
+            competing = None
+        block = blockchain.add_block([f"交易{i}"], parent)
+        if block is not blockchain.head:
+            competing = block.hash
+    
+    info = blockchain.get_chain_info()
+    print(f"收到区块数: {info['total_blocks']}")
+    print(f"主链高度: {info['height']}")
+    print(f"孤块率: {info['stale_blocks'] / info['total_blocks']:.2%}")
+    print(f"重组次数: {info['reorgs']}, 最大重组深度: {info['max_reorg_depth']}")
+    print()
+
+
+def demonstrate_block_store():
+    """演示区块的磁盘存储和重启恢复"""
+    print("=== 区块磁盘存储演示 ===")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory) as store:
+            blockchain = Blockchain(store)
+            for i in range(100):
+                blockchain.add_block([f"交易{i}-a", f"交易{i}-b"])
+            head_hash = blockchain.head.hash
+        print(f"写入区块数: {blockchain.height + 1}")
+        
+        # 重新打开存储，模拟节点重启
+        with BlockStore(directory) as store:
+            restored = Blockchain(store)
+            print(f"重启后高度: {restored.height}")
+            print(f"最高区块一致: {'✅' if restored.head.hash == head_hash else '❌'}")
+            print(f"按高度读取区块50: {store.get_block_at_height(50).transactions}")
     print()
 
 
@@ -369,6 +1960,33 @@ def demonstrate_spv():
     print(f"SPV节点高度: {info['height']}")
     print(f"存储的区块头数量: {info['blocks']}")
     print(f"存储模式: {info['storage']}")
+    
+    # 同步一段真实格式的区块头：逐个检查哈希链接和工作量证明
+    headers = generate_regtest_headers(20000)
+    light_node = SPVNode(pow_limit=REGTEST_POW_LIMIT)
+    start_time = time.perf_counter()
+    light_node.sync_headers(headers)
+    elapsed = time.perf_counter() - start_time
+    print(f"同步 {len(headers) // BlockHeader.SIZE} 个区块头耗时: {elapsed:.3f}s")
+    locator = light_node.get_locator()
+    print(f"区块定位器长度: {len(locator)} (最近的区块: {locator[0][::-1].hex()[:16]}...)")
+    
+    # BIP158过滤器：每个区块放入一些模拟的P2WPKH输出脚本，钱包关注其中两个
+    rng = random.Random(158)
+    watch_scripts = []
+    filter_count = 2000
+    for height in range(filter_count):
+        scripts = [b"\x00\x14" + rng.randbytes(20) for _ in range(50)]
+        if height in (500, 1500):
+            watch_scripts.append(scripts[0])
+        block_filter = build_basic_filter(light_node.header_chain.hashes[height], scripts)
+        light_node.add_block_filter(block_filter.to_bytes())
+    
+    start_time = time.perf_counter()
+    relevant = light_node.find_relevant_blocks(watch_scripts)
+    elapsed = time.perf_counter() - start_time
+    print(f"匹配 {filter_count} 个区块过滤器耗时: {elapsed:.3f}s "
+          f"({filter_count / elapsed:,.0f} 个/秒)，需要下载的区块: {relevant}")
     print()
 
 
@@ -377,7 +1995,7 @@ def performance_comparison():
     print("=== 性能对比演示 ===")
     
     # 不同规模的交易测试
-    test_sizes = [10, 100, 1000]
+    test_sizes = [10, 100, 1000, 100000]
     
     for size in test_sizes:
         transactions = [f"tx{i}" for i in range(size)]
@@ -390,10 +2008,15 @@ def performance_comparison():
         proof = merkle_tree.generate_proof(0)
         proof_time = time.time() - start_time
         
+        start_time = time.time()
+        merkle_tree.generate_proofs(range(size))
+        batch_time = time.time() - start_time
+        
         print(f"交易数量: {size}")
         print(f"  构建时间: {build_time:.4f}s")
         print(f"  证明生成: {proof_time:.4f}s") 
         print(f"  证明长度: {len(proof)} 步")
+        print(f"  全部交易的批量证明: {batch_time:.4f}s")
 
 
 if __name__ == "__main__":
@@ -403,6 +2026,8 @@ if __name__ == "__main__":
     
     demonstrate_hash_pointer()
     demonstrate_blockchain()
+    demonstrate_fork_choice()
+    demonstrate_block_store()
     demonstrate_merkle_tree()
     demonstrate_spv()
     performance_comparison()
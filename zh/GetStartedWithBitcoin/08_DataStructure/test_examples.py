@@ -44,6 +44,159 @@ def test_blockchain():
     print("✅ 区块链测试通过")
 
 
+def test_block_header():
+    """测试80字节区块头的序列化和哈希"""
+    print("测试区块头...")
+    
+    # 比特币创世区块头
+    genesis_hex = ("01000000" + "00" * 32 +
+                   "3ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a"
+                   "29ab5f49ffff001d1dac2b7c")
+    raw = bytearray(b"\x00" * 8 + bytes.fromhex(genesis_hex))
+    header = BlockHeader.from_bytes(memoryview(raw), offset=8)
+    
+    assert header.version == 1 and header.timestamp == 1231006505, "区块头字段解析错误"
+    assert header.bits == 0x1d00ffff and header.nonce == 2083236893, "区块头字段解析错误"
+    assert header.hash_hex == "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f", "创世区块哈希错误"
+    assert header.check_proof_of_work(), "创世区块工作量证明验证失败"
+    assert header.to_bytes() == bytes.fromhex(genesis_hex), "区块头序列化错误"
+    
+    # 修改字段后缓存的哈希失效
+    rebuilt = BlockHeader(header.version, bytes(header.prev_hash), bytes(header.merkle_root),
+                          header.timestamp, header.bits, header.nonce)
+    assert rebuilt.hash == header.hash, "重新构造的区块头哈希不一致"
+    rebuilt.nonce += 1
+    assert rebuilt.hash != header.hash, "修改nonce后哈希应该改变"
+    assert not rebuilt.check_proof_of_work(), "修改nonce后工作量证明应该失效"
+    
+    # 区块哈希来自区块头，篡改字段会被链验证发现
+    blockchain = Blockchain()
+    block = blockchain.add_block(["tx1"])
+    assert block.hash == block.header.hash.hex(), "区块哈希应由80字节区块头计算"
+    block.nonce = 42
+    assert blockchain.verify_chain() == False, "篡改区块头后验证应该失败"
+    
+    print("✅ 区块头测试通过")
+
+
+def test_block_store():
+    """测试区块磁盘存储和崩溃恢复"""
+    print("测试区块存储...")
+    
+    import os
+    import tempfile
+    
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(directory, max_file_size=400)
+        blockchain = Blockchain(store)
+        for i in range(5):
+            blockchain.add_block([f"tx{i}", f"tx{i}b"])
+        head_hash = blockchain.head.hash
+        store.close()
+        
+        # 模拟崩溃：最后一条索引只写了一半，数据文件尾部有残缺记录
+        index_path = os.path.join(directory, "index.dat")
+        with open(index_path, "r+b") as f:
+            f.truncate(os.path.getsize(index_path) - 10)
+        last_file = sorted(name for name in os.listdir(directory) if name.startswith("blk"))[-1]
+        with open(os.path.join(directory, last_file), "ab") as f:
+            f.write(BlockStore.MAGIC + b"\xff\x00\x00\x00partial")
+        
+        with BlockStore(directory, max_file_size=400) as store:
+            restored = Blockchain(store)
+            assert restored.head.hash == head_hash, "重启后最高区块错误"
+            assert restored.height == 5, "重启后高度错误"
+            assert restored.verify_chain() == True, "恢复后的链验证失败"
+            assert store.get_block_at_height(2).transactions == ["tx1", "tx1b"], "按高度读取区块错误"
+            
+            block = restored.add_block(["tx5"])
+            assert restored.get_block(block.hash).transactions == ["tx5"], "恢复后追加区块失败"
+            
+            # 最后写入的是较短的分支，重启后仍按累计工作量选择最高区块
+            restored.add_block(["side"], store.get_block_at_height(3).hash)
+            head_hash = restored.head.hash
+            assert store.tip_hash == head_hash and store.tip_height == 6, "分叉区块不应移动存储的主链"
+            assert store.get_block_at_height(4).transactions == ["tx3", "tx3b"], "分叉区块覆盖了主链高度索引"
+
+            # 分叉分支超过主链后，存储的主链跟随重组
+            side = store.get_block_at_height(4)
+            for i in range(3):
+                side = restored.add_block([f"side{i}"], side.hash)
+            assert store.tip_hash == restored.head.hash == side.hash, "重组后存储的主链未更新"
+            assert store.get_block_at_height(5).transactions == ["side0"], "重组后高度索引错误"
+            head_hash = restored.head.hash
+        
+        with BlockStore(directory, max_file_size=400) as store:
+            assert Blockchain(store).head.hash == head_hash, "重启后应选择工作量最大的分支"
+    
+    print("✅ 区块存储测试通过")
+
+
+def test_incremental_verification():
+    """测试基于检查点的增量验证和并行全量验证"""
+    print("测试增量验证...")
+    
+    blockchain = Blockchain()
+    blocks = [blockchain.add_block([f"tx{i}"]) for i in range(20)]
+    
+    report = blockchain.verify_chain_report()
+    assert report["valid"] and report["checked_blocks"] == 21, "首次验证应检查全部区块"
+    
+    for i in range(3):
+        blockchain.add_block([f"new_tx{i}"])
+    report = blockchain.verify_chain_report()
+    assert report["valid"] and report["checked_blocks"] == 3, "增量验证应只检查新区块"
+    assert blockchain.verified_height == 23, "检查点未更新"
+    
+    # 篡改检查点之前的区块：增量验证不会重新检查，全量验证能找出失败的区块
+    blocks[4].nonce = 99
+    assert blockchain.verify_chain_report()["checked_blocks"] == 0, "没有新区块时不应重复验证"
+    report = blockchain.verify_chain_report(full=True)
+    assert not report["valid"] and report["failed_height"] == 5, "全量验证未找到被篡改的区块"
+    assert report["failed_block"] == blocks[4].hash, "失败区块哈希错误"
+    
+    report = blockchain.verify_chain_report(parallel=True, workers=2)
+    assert not report["valid"] and report["failed_height"] == 5, "并行验证未找到被篡改的区块"
+    assert "collect" in report["timings"] and "verify" in report["timings"], "缺少阶段耗时"
+    
+    print("✅ 增量验证测试通过")
+
+
+def test_fork_choice_and_reorg():
+    """测试分叉、按累计工作量选链和重组"""
+    print("测试分叉与重组...")
+    
+    blockchain = Blockchain()
+    main_blocks = [blockchain.add_block([f"tx{i}"]) for i in range(200)]
+    tip_entry = blockchain.index[blockchain.head.hash]
+    for height in (0, 1, 63, 128, 199, 200):
+        assert tip_entry.get_ancestor(height) is blockchain.active_chain[height], "跳跃指针查找祖先错误"
+    
+    # 在高度195分叉：分支较短时不切换
+    fork_base = main_blocks[194]
+    side = blockchain.add_block(["side0"], fork_base.hash)
+    assert blockchain.head == main_blocks[-1], "工作量较少的分支不应成为主链"
+    assert not blockchain.is_in_main_chain(side.hash), "分支区块不应在主链上"
+    
+    # 分支超过主链后发生重组
+    prev_hash = side.hash
+    for i in range(1, 7):
+        prev_hash = blockchain.add_block([f"side{i}"], prev_hash).hash
+    assert blockchain.head.hash == prev_hash and blockchain.height == 202, "重组后最高区块错误"
+    reorg = blockchain.reorgs[-1]
+    assert reorg["fork_height"] == 195 and reorg["depth"] == 5, "重组分叉点或深度错误"
+    fork = find_fork_point(blockchain.index[main_blocks[-1].hash], blockchain.index[prev_hash])
+    assert fork.hash == fork_base.hash, "分叉点计算错误"
+    assert blockchain.is_in_main_chain(side.hash), "重组后分支应成为主链"
+    assert blockchain.verify_chain() == True, "重组后区块链验证失败"
+    
+    info = blockchain.get_chain_info()
+    assert info["stale_blocks"] == 5 and info["max_reorg_depth"] == 5, "分叉统计错误"
+    assert len(blockchain.get_chain_tips()) == 2, "链末端数量错误"
+    
+    print("✅ 分叉与重组测试通过")
+
+
 def test_merkle_tree():
     """测试默克尔树功能"""
     print("测试默克尔树...")
@@ -70,6 +223,130 @@ def test_merkle_tree():
     print("✅ 默克尔树测试通过")
 
 
+def test_merkle_tree_bitcoin_block():
+    """用真实区块验证默克尔根计算（区块100000）"""
+    print("测试真实区块默克尔根...")
+    
+    # 浏览器显示的txid和默克尔根是字节逆序的
+    txids = [
+        "8c14f0db3df150123e6f3dbbf30f8b955a8249b62ac1d1ff16284aefa3d06d87",
+        "fff2525b8931402dd09222c50775608f75787bd2b87e56995a7bdd30f79702c4",
+        "6359f0868171b1d194cbee1af2f16ea598ae8fad666d9b012c8ed2b79a236ec4",
+        "e9a66845e05d5abc0ad04ec80f774a7e585c6e8db975962d069a522137b80c1d",
+    ]
+    tree = MerkleTree.from_hashes([bytes.fromhex(txid)[::-1] for txid in txids])
+    expected_root = "f3e94742aca4b5ef85488dc37c06c3282295ffec960994b2c0d5ac2a25a95766"
+    assert tree.root_hash[::-1].hex() == expected_root, "区块100000默克尔根不匹配"
+    assert len(tree.levels) == 3, "4个叶子的树应有3层"
+    
+    print("✅ 真实区块默克尔根测试通过")
+
+
+def test_merkle_batch_proofs():
+    """测试批量证明与单个证明一致"""
+    print("测试批量默克尔证明...")
+    
+    transactions = [f"tx{i}" for i in range(11)]
+    tree = MerkleTree(transactions)
+    proofs = tree.generate_proofs(range(len(transactions)))
+    
+    for i, tx in enumerate(transactions):
+        assert proofs[i] == tree.generate_proof(i), f"交易{i}的批量证明与单个证明不一致"
+        assert tree.verify_proof(tx, proofs[i], tree.root.hash), f"交易{i}的批量证明验证失败"
+    
+    # 相邻交易共享父节点以上的证明步骤
+    assert proofs[0][1] is proofs[1][1], "共享的证明步骤应该只生成一次"
+    
+    print("✅ 批量默克尔证明测试通过")
+
+
+def test_incremental_merkle_tree():
+    """测试增量追加/更新与整树重建结果一致"""
+    print("测试增量默克尔树...")
+    
+    transactions = []
+    tree = MerkleTree([])
+    for i in range(13):
+        tx = f"tx{i}"
+        transactions.append(tx)
+        tree.append(tx)
+        assert tree.root.hash == MerkleTree(transactions).root.hash, f"追加第{i}笔交易后默克尔根错误"
+    
+    transactions[0] = "coinbase-extranonce-1"
+    tree.update(0, transactions[0])
+    assert tree.root.hash == MerkleTree(transactions).root.hash, "更新交易后默克尔根错误"
+    assert tree.verify_proof(transactions[0], tree.generate_proof(0), tree.root.hash), "更新后的证明验证失败"
+    
+    # 候选区块追加交易后区块头随之更新
+    block = Block(["coinbase"], "0" * 64, timestamp=1234567890)
+    old_hash = block.hash
+    block.add_transaction("tx1")
+    assert block.merkle_root == MerkleTree(["coinbase", "tx1"]).root.hash, "区块默克尔根未更新"
+    assert block.hash != old_hash, "区块哈希未更新"
+
+    # 越界或负数的位置被拒绝，树和区块都保持不变
+    old_root = tree.root.hash
+    old_hash = block.hash
+    for bad_index in (-1, 13):
+        for replace in (tree.update, lambda i, tx: tree.update_hash(i, bytes(32))):
+            try:
+                replace(bad_index, "z")
+                assert False, f"位置{bad_index}应该被拒绝"
+            except ValueError:
+                pass
+    assert tree.transactions == transactions and tree.root.hash == old_root, "拒绝更新后树不应改变"
+    for bad_index in (-1, 2):
+        try:
+            block.replace_transaction(bad_index, "z")
+            assert False, f"位置{bad_index}应该被拒绝"
+        except ValueError:
+            pass
+    assert block.transactions == ["coinbase", "tx1"] and block.hash == old_hash, "拒绝替换后区块不应改变"
+
+    print("✅ 增量默克尔树测试通过")
+
+
+def test_partial_merkle_tree():
+    """测试多交易的部分默克尔树证明"""
+    print("测试部分默克尔树...")
+    
+    txids = [double_sha256(f"tx{i}".encode()) for i in range(13)]
+    tree = MerkleTree.from_hashes(txids)
+    watched = [2, 3, 11]
+    
+    partial = PartialMerkleTree.from_tree(tree, watched)
+    restored = PartialMerkleTree.from_bytes(partial.to_bytes())
+    root, matches = restored.extract_matches()
+    assert root == tree.root_hash, "部分默克尔树计算的根不正确"
+    assert matches == [(i, txids[i]) for i in watched], "提取的交易不正确"
+    
+    spv = SPVNode()
+    spv.add_block_header("block1", "block0", tree.root_hash.hex(), 1234567890, 1)
+    assert spv.verify_transactions_inclusion([txids[i] for i in watched], "block1", restored), \
+        "多交易包含性验证失败"
+    assert not spv.verify_transactions_inclusion([txids[5]], "block1", restored), \
+        "未被证明的交易不应通过验证"
+    
+    # 篡改任意一个哈希都会导致根不匹配
+    tampered = PartialMerkleTree(partial.tx_count, [bytes(32)] + partial.hashes[1:], partial.flags)
+    assert tampered.extract_matches()[0] != tree.root_hash, "篡改后的证明应该失败"
+    assert not spv.verify_transactions_inclusion([], "block1", restored), "空交易列表不应通过验证"
+
+    # 截断、多余字节、多余哈希或标志位不足的数据在反序列化时被拒绝
+    raw = partial.to_bytes()
+    extra_hash = PartialMerkleTree(partial.tx_count, partial.hashes + [bytes(32)], partial.flags)
+    short_flags = PartialMerkleTree(partial.tx_count, partial.hashes, partial.flags[:-8])
+    for bad in (raw[:-1], raw + b"\x00", raw[:40], b"\x00" * 4,
+                extra_hash.to_bytes(), short_flags.to_bytes(), raw[:4] + b"\xff" + raw[5:]):
+        try:
+            PartialMerkleTree.from_bytes(bad)
+            assert False, "不合法的部分默克尔树应该被拒绝"
+        except ValueError:
+            pass
+
+    print("✅ 部分默克尔树测试通过")
+
+
 def test_spv_node():
     """测试SPV节点功能"""
     print("测试SPV节点...")
@@ -87,6 +364,138 @@ def test_spv_node():
     print("✅ SPV节点测试通过")
 
 
+def test_header_chain_sync():
+    """测试SPV节点的区块头链同步"""
+    print("测试区块头同步...")
+    
+    import os
+    import tempfile
+    
+    headers = generate_regtest_headers(500)
+    spv = SPVNode(pow_limit=REGTEST_POW_LIMIT)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "headers.dat")
+        with open(path, "wb") as f:
+            f.write(headers)
+        assert spv.load_headers_file(path) == 500, "导入区块头数量错误"
+    
+    chain = spv.header_chain
+    assert chain.height == 499 and spv.get_block_chain_info()["height"] == 499, "区块头链高度错误"
+    assert chain.get_header(123).hash == chain.hashes[123], "按高度读取区块头错误"
+    assert chain.height_of[chain.tip_hash] == 499, "哈希到高度的映射错误"
+    
+    # 定位器：最近10个区块连续，之后步长翻倍，最后是创世区块
+    locator = spv.get_locator()
+    assert locator[:10] == chain.hashes[499:489:-1], "定位器前10项错误"
+    assert locator[-1] == chain.hashes[0] and len(locator) < 25, "定位器结构错误"
+    
+    # 对端只同步到高度100时，应返回之后的区块头
+    peer = HeaderChain(REGTEST_POW_LIMIT)
+    peer.add_headers(headers[:101 * 80])
+    missing = chain.headers_after(peer.get_locator())
+    assert peer.add_headers(missing) == 399 and peer.tip_hash == chain.tip_hash, "增量同步失败"
+    
+    # 链接错误或工作量不足的区块头会被拒绝，之前的区块头保留
+    more = bytearray(generate_regtest_headers(3, chain.tip_hash, 500))
+    more[2 * 80 + 72:2 * 80 + 76] = (0x1d00ffff).to_bytes(4, "little")  # 第3个区块头不在调整高度却改了难度
+    try:
+        spv.sync_headers(more)
+        assert False, "无效区块头应该被拒绝"
+    except ValueError:
+        pass
+    assert chain.height == 501, "无效区块头之前的区块头应该保留"
+
+    # 默认使用主网难度上限，regtest难度的区块头会被拒绝
+    try:
+        HeaderChain().add_headers(headers[:80])
+        assert False, "主网难度上限下regtest区块头应该被拒绝"
+    except ValueError:
+        pass
+
+    # 只有在2016的整数倍高度才能调整难度，且幅度不超过4倍
+    retarget = HeaderChain(REGTEST_POW_LIMIT)
+    retarget.add_headers(generate_regtest_headers(HeaderChain.RETARGET_INTERVAL))
+    for bits in (0x200fffff, 0x203fffff):
+        boundary = generate_regtest_headers(1, retarget.tip_hash, HeaderChain.RETARGET_INTERVAL, bits=bits)
+        try:
+            retarget.add_headers(boundary)
+            assert bits == 0x203fffff, "难度提高8倍应该被拒绝"
+        except ValueError:
+            assert bits == 0x200fffff, "难度提高2倍应该被接受"
+    assert retarget.height == HeaderChain.RETARGET_INTERVAL, "调整高度的区块头未被接受"
+    try:
+        retarget.add_headers(generate_regtest_headers(1, retarget.tip_hash, retarget.height + 1))
+        assert False, "非调整高度改变难度应该被拒绝"
+    except ValueError:
+        pass
+
+    # 用区块头链中的默克尔根验证交易
+    transactions = ["tx1", "tx2", "tx3"]
+    tree = MerkleTree(transactions)
+    header = BlockHeader(prev_hash=chain.tip_hash, merkle_root=tree.root_hash)
+    while not header.check_proof_of_work():
+        header.nonce += 1
+    assert spv.add_header(header) == 502, "添加区块头失败"
+    assert spv.verify_transaction_inclusion("tx2", header.hash.hex(), tree.generate_proof(1)), "SPV验证失败"
+    
+    print("✅ 区块头同步测试通过")
+
+
+def test_compact_block_filters():
+    """测试BIP158区块过滤器"""
+    print("测试区块过滤器...")
+    
+    # BIP158测试向量：测试网创世区块
+    block_hash = bytes.fromhex("000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943")[::-1]
+    coinbase_script = bytes.fromhex(
+        "4104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6"
+        "bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac")
+    genesis_filter = build_basic_filter(block_hash, [coinbase_script])
+    assert genesis_filter.to_bytes().hex() == "019dfca8", "创世区块过滤器错误"
+    assert genesis_filter.header(bytes(32))[::-1].hex() == \
+        "21584579b7eb08997773e5aeff3a7f932700042d0ed2a6129012b7d7ae81b750", "过滤器头错误"
+    assert genesis_filter.match(coinbase_script), "过滤器应匹配区块中的脚本"
+    
+    # 集合中的元素都能匹配，OP_RETURN输出不进入过滤器
+    scripts = [bytes([0x00, 0x14]) + bytes([i]) * 20 for i in range(200)]
+    block_filter = build_basic_filter(block_hash, scripts + [b"\x6a\x04test"])
+    decoded = GCSFilter.from_bytes(block_hash, block_filter.to_bytes())
+    assert decoded.n == 200, "过滤器元素数量错误"
+    assert all(decoded.match(script) for script in scripts), "过滤器出现漏报"
+    assert not decoded.match(b"\x6a\x04test"), "OP_RETURN输出不应进入过滤器"
+
+    # 逐个解码和向量化解码、批量SipHash和逐个SipHash的结果一致
+    expected_values = list(block_filter._decoded_values())
+    assert decoded._decode() == expected_values, "过滤器解码错误"
+    if np is not None:
+        assert decoded._decode_numpy().tolist() == expected_values, "向量化解码错误"
+        assert siphash24_batch(decoded.key, scripts) == [siphash24(decoded.key, s) for s in scripts], \
+            "批量SipHash错误"
+    try:
+        GCSFilter.from_bytes(block_hash, block_filter.to_bytes()[:-8])._decoded_values()
+        assert False, "截断的过滤器应该解码失败"
+    except ValueError:
+        pass
+
+    # SPV节点：过滤器头链接和相关区块查找
+    spv = SPVNode(pow_limit=REGTEST_POW_LIMIT)
+    spv.sync_headers(generate_regtest_headers(5))
+    filters = [build_basic_filter(spv.header_chain.hashes[h], [bytes([0x51, h])]) for h in range(5)]
+    expected = filters[0].header(bytes(32))
+    assert spv.add_block_filter(filters[0].to_bytes(), expected_header=expected) == expected, "过滤器头错误"
+    try:
+        spv.add_block_filter(filters[1].to_bytes(), expected_header=expected)
+        assert False, "过滤器头不一致时应该拒绝"
+    except ValueError:
+        pass
+    for block_filter in filters[1:]:
+        spv.add_block_filter(block_filter.to_bytes())
+    assert spv.filter_headers[1] == filters[1].header(expected), "过滤器头没有正确链接"
+    assert spv.find_relevant_blocks([bytes([0x51, 3])]) == [3], "相关区块查找错误"
+    
+    print("✅ 区块过滤器测试通过")
+
+
 def test_edge_cases():
     """测试边界情况"""
     print("测试边界情况...")
@@ -105,7 +514,21 @@ def test_edge_cases():
     proof = odd_tree.generate_proof(0)
     is_valid = odd_tree.verify_proof("tx1", proof, odd_tree.root.hash)
     assert is_valid == True, "奇数交易默克尔树验证失败"
-    
+
+    # 越界或负数的交易位置不能生成证明
+    for bad_index in (-1, 3):
+        for build in (odd_tree.generate_proof, lambda i: odd_tree.generate_proofs([0, i])):
+            try:
+                build(bad_index)
+                assert False, f"交易位置{bad_index}应该被拒绝"
+            except ValueError:
+                pass
+    try:
+        empty_tree.generate_proof(0)
+        assert False, "空默克尔树不能生成证明"
+    except ValueError:
+        pass
+
     print("✅ 边界情况测试通过")
 
 
@@ -117,8 +540,18 @@ def run_all_tests():
     try:
         test_hash_pointer()
         test_blockchain()
+        test_block_header()
+        test_block_store()
+        test_incremental_verification()
+        test_fork_choice_and_reorg()
         test_merkle_tree()
+        test_merkle_tree_bitcoin_block()
+        test_merkle_batch_proofs()
+        test_incremental_merkle_tree()
+        test_partial_merkle_tree()
         test_spv_node()
+        test_header_chain_sync()
+        test_compact_block_filters()
         test_edge_cases()
         
         print("\n🎉 所有测试通过！")
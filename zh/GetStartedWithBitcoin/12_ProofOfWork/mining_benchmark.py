@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+挖矿哈希策略基准测试
+
+对 mining_examples.BitcoinMiner 的各种哈希策略（naive / midstate / batched / multiprocess）
+在不同难度和进程数下重复测量，取中位数，并输出JSON/CSV结果。
+速度按实际计算的哈希数计算（批量策略算到批次末尾），多进程策略的耗时不含进程池创建，
+创建耗时单独记录；难度默认取到足以摊薄每次运行的固定开销。
+可以和上一次的结果对比，速度下降超过阈值时以非零状态码退出，便于发现性能回退。
+
+使用方法:
+python3 mining_benchmark.py                                   # 默认参数运行并打印结果
+python3 mining_benchmark.py --json results.json --csv results.csv
+python3 mining_benchmark.py --compare baseline.json --threshold 0.15
+"""
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+
+from mining_examples import BitcoinMiner, np
+
+STRATEGIES = ["naive", "midstate", "batched", "multiprocess"]
+
+
+def zero_bits_to_difficulty_bits(zero_bits):
+    """把"哈希前导0比特数"换算成区块头里的紧凑难度位(nBits)"""
+    target = 1 << (256 - zero_bits)
+    size = (target.bit_length() + 7) // 8
+    mantissa = target >> (8 * (size - 3)) if size > 3 else target << (8 * (3 - size))
+    # 最高位是符号位，需要让出来
+    if mantissa & 0x800000:
+        mantissa >>= 8
+        size += 1
+    return (size << 24) | mantissa
+
+
+def benchmark_header(repeat):
+    """每次重复使用固定的区块头，保证不同运行之间可比较"""
+    seed = hashlib.sha256(f"mining-benchmark-{repeat}".encode()).digest()
+    return (seed * 3)[:76]
+
+
+def run_once(strategy, zero_bits, workers, repeat):
+    """运行一次挖矿，返回 (实际哈希数, 哈希耗时, 准备耗时)"""
+    miner = BitcoinMiner()
+    miner.difficulty_bits = zero_bits_to_difficulty_bits(zero_bits)
+    header = benchmark_header(repeat)
+
+    # 屏蔽挖矿过程中的打印
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        if strategy == "multiprocess":
+            result = miner.mine_block_parallel(header, workers=workers)
+        else:
+            result = miner.mine_block(header, strategy=strategy)
+        elapsed = time.perf_counter() - start_time
+
+    # 多进程策略从进程池就绪开始计时，创建进程池的耗时单独返回
+    hash_time = result.get('hash_time', elapsed)
+    return result['hashes'], hash_time, elapsed - hash_time
+
+
+def run_benchmarks(strategies, difficulty_levels, worker_counts, repeats):
+    """按 策略 × 难度 × 进程数 运行并汇总中位数"""
+    results = []
+    for strategy in strategies:
+        if strategy == "batched" and np is None:
+            print("未安装NumPy，跳过batched策略（pip install numpy）")
+            continue
+        # 只有多进程策略与进程数有关
+        workers_list = worker_counts if strategy == "multiprocess" else [1]
+        for zero_bits in difficulty_levels:
+            for workers in workers_list:
+                hashrates = []
+                times = []
+                setup_times = []
+                for repeat in range(repeats):
+                    hashes, elapsed, setup_time = run_once(strategy, zero_bits, workers, repeat)
+                    hashrates.append(hashes / elapsed if elapsed > 0 else 0)
+                    times.append(elapsed)
+                    setup_times.append(setup_time)
+
+                record = {
+                    'strategy': strategy,
+                    'zero_bits': zero_bits,
+                    'workers': workers,
+                    'repeats': repeats,
+                    'median_hashrate': statistics.median(hashrates),
+                    'median_time': statistics.median(times),
+                    'median_setup_time': statistics.median(setup_times),
+                    'hashrates': hashrates
+                }
+                results.append(record)
+                print(f"{strategy:<13}{zero_bits:>6}{workers:>8}"
+                      f"{record['median_hashrate']:>16,.0f}{record['median_time']:>12.3f}")
+    return results
+
+
+def write_json(path, results):
+    report = {
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'results': results
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def write_csv(path, results):
+    fields = ['strategy', 'zero_bits', 'workers', 'repeats', 'median_hashrate', 'median_time',
+              'median_setup_time']
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def compare_with_baseline(results, baseline_path, threshold):
+    """与基线结果比较，返回速度下降超过阈值的条目"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(record):
+        return (record['strategy'], record['zero_bits'], record['workers'])
+
+    baseline_rates = {key(record): record['median_hashrate'] for record in baseline['results']}
+    regressions = []
+
+    print(f"\n=== 与基线对比 ({baseline_path}) ===")
+    for record in results:
+        old_rate = baseline_rates.get(key(record))
+        if not old_rate:
+            continue
+        ratio = record['median_hashrate'] / old_rate
+        flag = "❌ 回退" if ratio < 1 - threshold else "✅"
+        print(f"{record['strategy']:<13}{record['zero_bits']:>6}{record['workers']:>8}"
+              f"{ratio:>10.2f}x  {flag}")
+        if ratio < 1 - threshold:
+            regressions.append({**record, 'baseline_hashrate': old_rate, 'ratio': ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="挖矿哈希策略基准测试")
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=STRATEGIES)
+    parser.add_argument("--difficulties", nargs="+", type=int, default=[16, 20],
+                        help="难度级别（哈希前导0比特数），太低时结果主要是固定开销")
+    parser.add_argument("--workers", nargs="+", type=int,
+                        default=sorted({1, multiprocessing.cpu_count()}),
+                        help="多进程策略测试的进程数")
+    parser.add_argument("--repeats", type=int, default=5, help="每组重复次数（取中位数）")
+    parser.add_argument("--json", help="结果输出为JSON文件")
+    parser.add_argument("--csv", help="结果输出为CSV文件")
+    parser.add_argument("--compare", help="与之前的JSON结果比较")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="速度下降超过该比例视为回退（默认0.10）")
+    args = parser.parse_args()
+
+    print(f"{'策略':<11}{'难度':>4}{'进程数':>5}{'中位速度(H/s)':>12}{'中位耗时(s)':>8}")
+    print("-" * 58)
+    results = run_benchmarks(args.strategies, args.difficulties, args.workers, args.repeats)
+
+    if args.json:
+        write_json(args.json, results)
+        print(f"\nJSON结果已写入 {args.json}")
+    if args.csv:
+        write_csv(args.csv, results)
+        print(f"CSV结果已写入 {args.csv}")
+
+    if args.compare:
+        regressions = compare_with_baseline(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能回退")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
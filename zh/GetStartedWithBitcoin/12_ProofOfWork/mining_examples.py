@@ -11,10 +11,47 @@ import hashlib
 import struct
 import time
 import random
-import threading
+import heapq
+import multiprocessing
+from collections import deque
 from datetime import datetime
 from typing import Dict, List, Optional
 
+try:
+    import numpy as np  # 可选依赖：批量挖矿策略和蒙特卡洛模拟使用
+except ImportError:
+    np = None
+
+class HeaderHasher:
+    """区块头哈希引擎：复用前64字节的SHA-256中间状态(midstate)
+    
+    80字节区块头中，前64字节（版本、前块哈希、Merkle根前28字节）在遍历nonce时不变，
+    SHA-256按64字节分块处理，所以第一块只需压缩一次，之后每个nonce只喂入最后16字节。
+    """
+    NONCE_OFFSET = 12  # nonce在尾部16字节中的偏移
+    _NONCE_STRUCT = struct.Struct("<I")
+    
+    def __init__(self, block_header):
+        """block_header: 不含nonce的76字节区块头，或完整的80字节区块头"""
+        if len(block_header) not in (76, 80):
+            raise ValueError(f"区块头长度应为76或80字节，实际为{len(block_header)}")
+        self.header_prefix = bytes(block_header[:76])
+        self._midstate = hashlib.sha256(self.header_prefix[:64])
+        # 预分配尾部缓冲区，每次只原地改写nonce
+        self._tail = bytearray(self.header_prefix[64:76] + b'\x00' * 4)
+    
+    def hash_nonce(self, nonce):
+        """计算带指定nonce的区块头双重SHA256"""
+        tail = self._tail
+        self._NONCE_STRUCT.pack_into(tail, self.NONCE_OFFSET, nonce)
+        first = self._midstate.copy()
+        first.update(tail)
+        return hashlib.sha256(first.digest()).digest()
+    
+    def header_with_nonce(self, nonce):
+        """返回带nonce的完整80字节区块头"""
+        return self.header_prefix + struct.pack("<I", nonce)
+
 class BitcoinMiner:
     """比特币挖矿器核心实现"""
     def __init__(self):
@@ -40,8 +77,23 @@ class BitcoinMiner:
         first_hash = hashlib.sha256(data).digest()
         return hashlib.sha256(first_hash).digest()
     
-    def mine_block(self, block_header):
-        """挖矿主算法"""
+    def mine_block(self, block_header, strategy="midstate", batch_size=4096):
+        """挖矿主算法
+        
+        strategy可选：
+        - "naive": 每次拼接完整区块头并重新哈希
+        - "midstate": 复用前64字节的中间状态（默认）
+        - "batched": 每批哈希batch_size个nonce，用NumPy向量化比较目标值
+        """
+        if strategy == "batched":
+            return self._mine_block_batched(block_header, batch_size)
+        if strategy == "midstate":
+            hash_nonce = HeaderHasher(block_header).hash_nonce
+        elif strategy == "naive":
+            hash_nonce = lambda n: self.double_sha256(block_header + struct.pack("<I", n))
+        else:
+            raise ValueError(f"未知的挖矿策略: {strategy}")
+        
         target = self.calculate_target(self.difficulty_bits)
         nonce = 0
         start_time = time.time()
@@ -49,38 +101,336 @@ class BitcoinMiner:
         print(f"开始挖矿，目标值: {hex(target)}")
         
         while nonce < 0xFFFFFFFF:  # 32位nonce空间
-            # 构建完整区块头（nonce在末尾4字节）
-            header_with_nonce = block_header + struct.pack("<I", nonce)
-            
-            # 计算区块哈希
-            block_hash = self.double_sha256(header_with_nonce)
+            # 计算区块哈希（nonce在末尾4字节）
+            block_hash = hash_nonce(nonce)
             hash_int = int.from_bytes(block_hash, 'big')
             
             # 检查是否小于目标值
             if hash_int < target:
-                end_time = time.time()
-                print(f"✅ 挖矿成功！")
-                print(f"Nonce: {nonce}")
-                print(f"区块哈希: {block_hash.hex()}")
-                print(f"挖矿时间: {end_time - start_time:.2f}秒")
-                print(f"尝试次数: {nonce + 1}")
-                return {
-                    'nonce': nonce,
-                    'hash': block_hash.hex(),
-                    'time': end_time - start_time,
-                    'attempts': nonce + 1
-                }
+                return self._report_success(nonce, block_hash, start_time, nonce + 1)
             
             nonce += 1
             
             # 每100万次尝试显示进度
             if nonce % 1000000 == 0:
-                elapsed = time.time() - start_time
-                rate = nonce / elapsed if elapsed > 0 else 0
-                print(f"进度: {nonce:,} 次尝试, 速度: {rate:,.0f} H/s")
+                self._report_progress(nonce, start_time)
         
         print("❌ 挖矿失败，nonce空间已耗尽")
         return None
+    
+    def _mine_block_batched(self, block_header, batch_size):
+        """批量挖矿：一次哈希一批nonce，先向量化比较最高64位，只对候选做精确比较"""
+        if np is None:
+            raise ImportError("批量校验需要NumPy，请安装: pip install numpy")
+        
+        target = self.calculate_target(self.difficulty_bits)
+        target_high = target >> 192  # 目标值的最高64位
+        hash_nonce = HeaderHasher(block_header).hash_nonce
+        start_time = time.time()
+        
+        print(f"开始批量挖矿，批大小: {batch_size}，目标值: {hex(target)}")
+        
+        for batch_start in range(0, 0xFFFFFFFF, batch_size):
+            batch_end = min(batch_start + batch_size, 0xFFFFFFFF)
+            digests = b''.join(map(hash_nonce, range(batch_start, batch_end)))
+            
+            # 每个哈希看作4个大端uint64，最高字严格大于target_high的一定不满足
+            words = np.frombuffer(digests, dtype='>u8').reshape(-1, 4)
+            for index in np.flatnonzero(words[:, 0] <= target_high):
+                block_hash = digests[index * 32:(index + 1) * 32]
+                if int.from_bytes(block_hash, 'big') < target:
+                    nonce = batch_start + int(index)
+                    # 整批都已哈希，实际计算量按批次边界计
+                    return self._report_success(nonce, block_hash, start_time, nonce + 1,
+                                                hashes=batch_end)
+            
+            if batch_end // 1000000 != batch_start // 1000000:
+                self._report_progress(batch_end, start_time)
+        
+        print("❌ 挖矿失败，nonce空间已耗尽")
+        return None
+    
+    def _report_success(self, nonce, block_hash, start_time, attempts, hashes=None):
+        """打印并返回挖矿结果
+        
+        attempts为到找到解为止的nonce个数，hashes为实际计算的哈希数（批量策略会多算到批次末尾）
+        """
+        end_time = time.time()
+        print(f"✅ 挖矿成功！")
+        print(f"Nonce: {nonce}")
+        print(f"区块哈希: {block_hash.hex()}")
+        print(f"挖矿时间: {end_time - start_time:.2f}秒")
+        print(f"尝试次数: {attempts}")
+        return {
+            'nonce': nonce,
+            'hash': block_hash.hex(),
+            'time': end_time - start_time,
+            'attempts': attempts,
+            'hashes': hashes or attempts
+        }
+    
+    def _report_progress(self, attempts, start_time):
+        """打印挖矿进度"""
+        elapsed = time.time() - start_time
+        rate = attempts / elapsed if elapsed > 0 else 0
+        print(f"进度: {attempts:,} 次尝试, 速度: {rate:,.0f} H/s")
+    
+    def build_coinbase_merkle_branch(self, txids):
+        """计算coinbase（第0笔交易）到Merkle根的兄弟哈希路径
+        
+        txids为除coinbase外其余交易的32字节哈希。滚动extranonce只会改变coinbase，
+        其余交易的哈希不变，所以这条路径只需计算一次。
+        """
+        branch = []
+        level = [None] + list(txids)  # None占位coinbase
+        while len(level) > 1:
+            branch.append(level[1])
+            # 如果节点数为奇数，复制最后一个节点
+            if len(level) % 2 == 1:
+                level.append(level[-1])
+            level = [None] + [self.double_sha256(level[i] + level[i + 1])
+                              for i in range(2, len(level), 2)]
+        return branch
+    
+    def merkle_root_from_branch(self, leaf_hash, branch):
+        """沿兄弟路径向上折叠，得到Merkle根（只重算受影响的一条分支）"""
+        current = leaf_hash
+        for sibling in branch:
+            current = self.double_sha256(current + sibling)
+        return current
+    
+    def mine_block_extended(self, version, prev_block_hash, timestamp, txids,
+                            coinbase_prefix=b'', max_extranonce=0xFFFFFFFF,
+                            nonce_limit=0xFFFFFFFF):
+        """扩展挖矿：nonce空间耗尽后滚动coinbase中的extranonce并继续搜索
+        
+        每次滚动只重算coinbase哈希和它到根的一条分支（O(log n)），
+        然后重建区块头的中间状态；nonce循环本身复用预分配的缓冲区。
+        """
+        target = self.calculate_target(self.difficulty_bits)
+        branch = self.build_coinbase_merkle_branch(txids)
+        
+        # coinbase末尾8字节为extranonce，原地改写
+        coinbase = bytearray(coinbase_prefix + b'\x00' * 8)
+        extranonce_offset = len(coinbase_prefix)
+        
+        # 76字节区块头模板，Merkle根位于[36:68]
+        header = bytearray(struct.pack("<I", version) + prev_block_hash + b'\x00' * 32 +
+                           struct.pack("<II", timestamp, self.difficulty_bits))
+        
+        start_time = time.time()
+        attempts = 0
+        
+        print(f"开始扩展挖矿，目标值: {hex(target)}，其他交易数: {len(txids)}")
+        
+        for extranonce in range(max_extranonce):
+            struct.pack_into("<Q", coinbase, extranonce_offset, extranonce)
+            merkle_root = self.merkle_root_from_branch(self.double_sha256(coinbase), branch)
+            header[36:68] = merkle_root
+            hasher = HeaderHasher(header)
+            
+            for nonce in range(nonce_limit):
+                block_hash = hasher.hash_nonce(nonce)
+                if int.from_bytes(block_hash, 'big') < target:
+                    attempts += nonce + 1
+                    end_time = time.time()
+                    print(f"✅ 挖矿成功！extranonce滚动次数: {extranonce}")
+                    print(f"Nonce: {nonce}")
+                    print(f"区块哈希: {block_hash.hex()}")
+                    print(f"挖矿时间: {end_time - start_time:.2f}秒")
+                    print(f"尝试次数: {attempts}")
+                    return {
+                        'nonce': nonce,
+                        'hash': block_hash.hex(),
+                        'time': end_time - start_time,
+                        'attempts': attempts,
+                        'extranonce_rolls': extranonce,
+                        'merkle_root': merkle_root.hex(),
+                        'header': hasher.header_with_nonce(nonce).hex()
+                    }
+            
+            attempts += nonce_limit
+        
+        print("❌ 挖矿失败，extranonce空间已耗尽")
+        return None
+    
+    def mine_block_parallel(self, block_header, workers=None):
+        """多进程挖矿：按步长把nonce空间分给多个工作进程"""
+        workers = workers or multiprocessing.cpu_count()
+        target = self.calculate_target(self.difficulty_bits)
+        start_time = time.time()
+        
+        print(f"开始并行挖矿，进程数: {workers}，目标值: {hex(target)}")
+        
+        # 进程 i 负责 nonce = i, i + workers, i + 2*workers, ...
+        stop_event = multiprocessing.Event()
+        jobs = [(worker_id, block_header, target, worker_id, workers)
+                for worker_id in range(workers)]
+        
+        found = None
+        reports = []
+        with multiprocessing.Pool(workers, initializer=_init_mining_worker,
+                                  initargs=(stop_event,)) as pool:
+            pool_ready = time.time()  # 进程池创建耗时不计入哈希时间
+            # 收集全部进程的报告；一旦有进程找到解就通知其余进程提前退出
+            for report in pool.imap_unordered(_mine_nonce_stride, jobs):
+                reports.append(report)
+                if report['nonce'] is not None and found is None:
+                    found = report
+                    stop_event.set()
+        
+        end_time = time.time()
+        total_attempts = sum(report['attempts'] for report in reports)
+        worker_hashrates = {
+            report['worker_id']: report['attempts'] / report['elapsed'] if report['elapsed'] > 0 else 0
+            for report in sorted(reports, key=lambda r: r['worker_id'])
+        }
+        
+        if found is None:
+            print("❌ 挖矿失败，nonce空间已耗尽")
+            return None
+        
+        print(f"✅ 挖矿成功！（进程 {found['worker_id']}）")
+        print(f"Nonce: {found['nonce']}")
+        print(f"区块哈希: {found['hash']}")
+        print(f"挖矿时间: {end_time - start_time:.2f}秒")
+        print(f"尝试次数: {total_attempts}")
+        return {
+            'nonce': found['nonce'],
+            'hash': found['hash'],
+            'time': end_time - start_time,
+            'hash_time': end_time - pool_ready,
+            'attempts': total_attempts,
+            'hashes': total_attempts,
+            'worker_hashrates': worker_hashrates
+        }
+
+# 并行挖矿的工作进程状态（由进程池initializer设置）
+_mining_stop_event = None
+
+# 每扫描这么多个nonce检查一次停止信号，避免频繁访问共享事件
+STOP_CHECK_INTERVAL = 4096
+
+def _init_mining_worker(stop_event):
+    """进程池初始化：保存共享的停止信号"""
+    global _mining_stop_event
+    _mining_stop_event = stop_event
+
+def _mine_nonce_stride(job):
+    """工作进程：扫描 start, start+stride, ... 这一组nonce"""
+    worker_id, block_header, target, start, stride = job
+    hasher = HeaderHasher(block_header)
+    start_time = time.time()
+    attempts = 0
+    
+    for nonce in range(start, 0xFFFFFFFF, stride):
+        if attempts % STOP_CHECK_INTERVAL == 0 and _mining_stop_event.is_set():
+            break
+        
+        block_hash = hasher.hash_nonce(nonce)
+        attempts += 1
+        
+        if int.from_bytes(block_hash, 'big') < target:
+            return {
+                'worker_id': worker_id,
+                'nonce': nonce,
+                'hash': block_hash.hex(),
+                'attempts': attempts,
+                'elapsed': time.time() - start_time
+            }
+    
+    return {
+        'worker_id': worker_id,
+        'nonce': None,
+        'hash': None,
+        'attempts': attempts,
+        'elapsed': time.time() - start_time
+    }
+
+def parallel_mining_demo():
+    """多进程挖矿演示"""
+    print("=== 多进程挖矿演示 ===")
+    
+    miner = BitcoinMiner()
+    miner.difficulty_bits = 0x1f0fffff  # 教学用低难度
+    header = create_block_header()
+    
+    result = miner.mine_block_parallel(header)
+    if result:
+        print("\n各进程算力:")
+        for worker_id, hashrate in result['worker_hashrates'].items():
+            print(f"  进程 {worker_id}: {hashrate:,.0f} H/s")
+
+def batch_strategy_benchmark(nonce_count=200000):
+    """逐个比较 vs 批量向量化比较的速度对比
+    
+    两种方式都要在Python里逐个nonce调用hashlib计算双重SHA256，这部分无法用NumPy向量化，
+    而且占了每个nonce的大部分时间；批量策略只把目标值比较向量化了。
+    所以分别给出"仅比较"的加速比和包含哈希的整体加速比，后者只有一成到几成。
+    """
+    print("=== 挖矿策略速度对比 ===")
+    
+    miner = BitcoinMiner()
+    miner.difficulty_bits = 0x03000001  # 极高难度：保证扫完nonce_count个nonce也找不到解
+    header = b'\x00' * 76
+    hasher = HeaderHasher(header)
+    target = miner.calculate_target(miner.difficulty_bits)
+    batch_size = 4096
+    
+    # 逐个比较：每个哈希都转换成Python大整数
+    start_time = time.perf_counter()
+    for nonce in range(nonce_count):
+        int.from_bytes(hasher.hash_nonce(nonce), 'big') < target
+    serial_rate = nonce_count / (time.perf_counter() - start_time)
+    print(f"逐个比较: {serial_rate:,.0f} H/s")
+    
+    if np is None:
+        print("未安装NumPy，跳过批量策略（pip install numpy）")
+        return
+    
+    # 批量比较：一批哈希拼成连续缓冲区后向量化比较最高64位
+    target_high = target >> 192
+    start_time = time.perf_counter()
+    for batch_start in range(0, nonce_count, batch_size):
+        batch = range(batch_start, min(batch_start + batch_size, nonce_count))
+        digests = b''.join(map(hasher.hash_nonce, batch))
+        words = np.frombuffer(digests, dtype='>u8').reshape(-1, 4)
+        np.flatnonzero(words[:, 0] <= target_high)
+    batched_rate = nonce_count / (time.perf_counter() - start_time)
+    print(f"批量比较: {batched_rate:,.0f} H/s (整体 {batched_rate / serial_rate:.2f}x)")
+    
+    # 单独测量被向量化的部分：哈希预先算好，只计比较目标值的时间
+    digests = b''.join(map(hasher.hash_nonce, range(nonce_count)))
+    start_time = time.perf_counter()
+    for offset in range(0, len(digests), 32):
+        int.from_bytes(digests[offset:offset + 32], 'big') < target
+    serial_compare = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    words = np.frombuffer(digests, dtype='>u8').reshape(-1, 4)
+    np.flatnonzero(words[:, 0] <= target_high)
+    batched_compare = time.perf_counter() - start_time
+    print(f"仅比较目标值: 逐个 {serial_compare * 1000:.1f}ms, 向量化 {batched_compare * 1000:.1f}ms "
+          f"({serial_compare / batched_compare:.0f}x)")
+
+def extranonce_mining_demo():
+    """extranonce滚动挖矿演示"""
+    print("=== extranonce滚动演示 ===")
+    
+    miner = BitcoinMiner()
+    miner.difficulty_bits = 0x1f00ffff  # 教学用低难度
+    txids = [miner.double_sha256(f"tx{i}".encode()) for i in range(7)]
+    
+    # 人为把nonce空间限制为4096，模拟nonce耗尽后的extranonce滚动
+    result = miner.mine_block_extended(
+        version=0x20000000,
+        prev_block_hash=b'\x00' * 32,
+        timestamp=int(time.time()),
+        txids=txids,
+        coinbase_prefix=b'/Get-Started-with-Web3/',
+        nonce_limit=4096
+    )
+    if result:
+        print(f"Merkle根: {result['merkle_root']}")
 
 def proof_of_work_concept():
     """工作量证明基本概念演示"""
@@ -318,16 +668,198 @@ def solo_mining_vs_pool_mining():
     print(f"  收益方差: 低（稳定的小额收益）")
     print(f"  矿池手续费: {pool_fee*100}%")
 
+# 难度1份额对应的目标值
+SHARE_TARGET_DIFF1 = 0x00000000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+def difficulty_to_share_target(difficulty):
+    """份额难度对应的目标值（支持小于1的教学用低难度）"""
+    if isinstance(difficulty, int):
+        return SHARE_TARGET_DIFF1 // difficulty
+    return int(SHARE_TARGET_DIFF1 / difficulty)
+
+class ShareLedger:
+    """份额账本：增量维护各矿工的份额权重
+    
+    - 比例模式(pplns_window=None)：统计本轮（上一个区块之后）的份额，结算后清零
+    - PPLNS模式：用环形缓冲区保存最近N个份额，新份额进入时把最旧的份额移出
+    
+    两种模式都维护运行总数，结算只遍历有贡献的矿工，而不是全部矿工。
+    vardiff难度是浮点数，加减后不一定恰好归零，所以另外记录每个矿工仍在账本中的份额数，
+    份额数为0时删除该矿工，不会因为浮点残差分到零头收益。
+    """
+    def __init__(self, pplns_window=None):
+        self.pplns_window = pplns_window
+        self.window = deque()  # PPLNS窗口：(矿工ID, 权重)
+        self.weights = {}  # 有贡献矿工的当前权重
+        self.share_counts = {}  # 有贡献矿工仍在账本中的份额数
+        self.total_weight = 0
+    
+    def record(self, miner_id, weight=1):
+        """记录一个有效份额，权重通常为份额难度"""
+        if self.pplns_window is not None:
+            if len(self.window) == self.pplns_window:
+                old_miner, old_weight = self.window.popleft()
+                self._remove(old_miner, old_weight)
+            self.window.append((miner_id, weight))
+        self.weights[miner_id] = self.weights.get(miner_id, 0) + weight
+        self.share_counts[miner_id] = self.share_counts.get(miner_id, 0) + 1
+        self.total_weight += weight
+    
+    def _remove(self, miner_id, weight):
+        """移出一个份额，矿工的最后一个份额移出时连同残差一起删除"""
+        count = self.share_counts[miner_id] - 1
+        if count:
+            self.share_counts[miner_id] = count
+            self.weights[miner_id] -= weight
+        else:
+            del self.share_counts[miner_id]
+            del self.weights[miner_id]
+        self.total_weight -= weight
+        if not self.share_counts:
+            self.total_weight = 0
+    
+    def settle(self, amount):
+        """按权重分配amount，返回 {矿工ID: 金额}"""
+        if self.total_weight <= 0:
+            return {}
+        payouts = {miner_id: amount * weight / self.total_weight
+                   for miner_id, weight in self.weights.items()}
+        
+        # 比例模式每个区块结算一轮；PPLNS窗口跨区块保留
+        if self.pplns_window is None:
+            self.weights.clear()
+            self.share_counts.clear()
+            self.total_weight = 0
+        return payouts
+
+class VardiffController:
+    """单个矿工的可变难度(vardiff)控制器
+    
+    用指数加权移动平均(EWMA)估计矿工的"工作速率"（每分钟份额数 × 份额难度，
+    与算力成正比），每隔retarget_interval秒把难度调整到 工作速率 / 目标份额速率，
+    使每个矿工都以接近target_shares_per_minute的速率提交份额。
+    """
+    def __init__(self, initial_difficulty=1, target_shares_per_minute=20, retarget_interval=30,
+                 alpha=0.3, max_step=4.0, tolerance=0.25,
+                 min_difficulty=2 ** -32, max_difficulty=2 ** 32):
+        self.difficulty = initial_difficulty
+        self.previous_difficulty = initial_difficulty
+        self.target_shares_per_minute = target_shares_per_minute
+        self.retarget_interval = retarget_interval
+        self.alpha = alpha  # EWMA平滑系数
+        self.max_step = max_step  # 单次调整的最大倍数
+        self.tolerance = tolerance  # 偏差在此范围内不调整
+        self.min_difficulty = min_difficulty
+        self.max_difficulty = max_difficulty
+        
+        self.ewma_work_rate = None
+        self.window_start = time.time()
+        self.window_work = 0
+        self.window_shares = 0
+        self.shares_per_minute = None  # 最近一个窗口实测的份额速率
+        self.changed_at = 0.0
+        self.retarget_count = 0
+    
+    def share_difficulty(self, now, grace_seconds=2.0):
+        """难度刚调整时矿工可能还在按旧难度挖，宽限期内按较低的难度计"""
+        if now - self.changed_at < grace_seconds:
+            return min(self.difficulty, self.previous_difficulty)
+        return self.difficulty
+    
+    def record_share(self, difficulty, now):
+        """记录一个有效份额；到达调整时间时顺便重新计算难度"""
+        self.window_work += difficulty
+        self.window_shares += 1
+        return self.retarget(now)
+    
+    def retarget(self, now):
+        """到达调整时间则更新难度，返回新难度；未调整返回None"""
+        elapsed = now - self.window_start
+        if elapsed < self.retarget_interval:
+            return None
+        
+        work_rate = self.window_work / elapsed * 60
+        self.shares_per_minute = self.window_shares / elapsed * 60
+        if self.ewma_work_rate is None:
+            self.ewma_work_rate = work_rate
+        else:
+            self.ewma_work_rate = self.alpha * work_rate + (1 - self.alpha) * self.ewma_work_rate
+        self.window_start = now
+        self.window_work = 0
+        self.window_shares = 0
+        
+        desired = self.ewma_work_rate / self.target_shares_per_minute
+        factor = max(1 / self.max_step, min(self.max_step, desired / self.difficulty))
+        if abs(factor - 1) <= self.tolerance:
+            return None
+        
+        new_difficulty = max(self.min_difficulty, min(self.max_difficulty, self.difficulty * factor))
+        if new_difficulty == self.difficulty:
+            return None
+        
+        self.previous_difficulty = self.difficulty
+        self.difficulty = new_difficulty
+        self.changed_at = now
+        self.retarget_count += 1
+        return new_difficulty
+    
+    def get_state(self):
+        """控制器状态"""
+        return {
+            'difficulty': self.difficulty,
+            'shares_per_minute': self.shares_per_minute,
+            'target_shares_per_minute': self.target_shares_per_minute,
+            'ewma_work_rate': self.ewma_work_rate,  # 每分钟的难度1等效份额数
+            'retarget_count': self.retarget_count
+        }
+
 class MiningPool:
     """矿池实现模拟"""
-    def __init__(self, pool_name="Bitcoin Pool"):
+    def __init__(self, pool_name="Bitcoin Pool", pplns_window=None, verbose=True):
         self.pool_name = pool_name
+        self.verbose = verbose
         self.miners = {}  # 矿工信息
         self.shares_submitted = {}  # 提交的份额
+        self.share_ledger = ShareLedger(pplns_window)  # 用于奖励分配的份额账本
         self.total_hashrate = 0
         self.blocks_found = 0
         self.total_rewards = 0
         self.pool_fee = 0.02  # 2%手续费
+        self._hasher = None  # 当前任务区块头的哈希引擎
+        self._share_targets = {}  # 难度 -> 份额目标值缓存
+        self.vardiff_config = None  # 启用vardiff后为控制器参数
+        self.vardiff = {}  # 矿工ID -> VardiffController
+    
+    def enable_vardiff(self, initial_difficulty=1, target_shares_per_minute=20,
+                       retarget_interval=30, **options):
+        """为所有矿工启用可变难度，此后submit_share可以不传difficulty"""
+        self.vardiff_config = dict(initial_difficulty=initial_difficulty,
+                                   target_shares_per_minute=target_shares_per_minute,
+                                   retarget_interval=retarget_interval, **options)
+        for miner_id in self.miners:
+            self.vardiff[miner_id] = VardiffController(**self.vardiff_config)
+    
+    def get_miner_difficulty(self, miner_id):
+        """矿工当前的份额难度（未启用vardiff时返回None）"""
+        controller = self.vardiff.get(miner_id)
+        return controller.difficulty if controller else None
+    
+    def record_vardiff_share(self, miner_id, difficulty, now=None):
+        """把difficulty的工作量计入矿工的vardiff控制器（未启用vardiff时忽略）"""
+        controller = self.vardiff.get(miner_id)
+        if controller is not None:
+            controller.record_share(difficulty, time.time() if now is None else now)
+    
+    def retarget_vardiff(self, now=None):
+        """定时调用：为所有矿工（包括长时间没有提交的慢矿工）检查难度，返回有变化的矿工"""
+        if now is None:
+            now = time.time()
+        changes = {}
+        for miner_id, controller in self.vardiff.items():
+            new_difficulty = controller.retarget(now)
+            if new_difficulty is not None:
+                changes[miner_id] = new_difficulty
+        return changes
     
     def add_miner(self, miner_id, hashrate):
         """添加矿工"""
@@ -337,30 +869,74 @@ class MiningPool:
             'rewards': 0
         }
         self.shares_submitted[miner_id] = 0
+        if self.vardiff_config is not None:
+            self.vardiff[miner_id] = VardiffController(**self.vardiff_config)
         self.total_hashrate += hashrate
-        print(f"矿工 {miner_id} 加入矿池，算力: {hashrate} TH/s")
+        if self.verbose:
+            print(f"矿工 {miner_id} 加入矿池，算力: {hashrate} TH/s")
+    
+    def share_target(self, difficulty):
+        """份额难度对应的目标值（带缓存）"""
+        target = self._share_targets.get(difficulty)
+        if target is None:
+            # vardiff会产生大量不同的难度值，缓存过大时清空
+            if len(self._share_targets) >= 4096:
+                self._share_targets.clear()
+            target = self._share_targets[difficulty] = difficulty_to_share_target(difficulty)
+        return target
     
-    def submit_share(self, miner_id, share_hash, difficulty):
-        """提交工作份额"""
+    def submit_share(self, miner_id, share_hash, difficulty=None, header=None, nonce=None):
+        """提交工作份额，找到区块时返回True"""
+        return self.accept_share(miner_id, share_hash, difficulty, header, nonce)[1]
+    
+    def accept_share(self, miner_id, share_hash, difficulty=None, header=None, nonce=None,
+                     record_vardiff=True):
+        """校验并记录份额，返回 (份额是否有效, 是否找到区块)
+        
+        share_hash可以是原始32字节摘要（大端），也可以是十六进制字符串。
+        如果同时提供区块头和nonce，矿池自行重算哈希，而不是信任矿工上报的share_hash。
+        启用vardiff且未指定difficulty时，使用矿池为该矿工分配的难度。
+        record_vardiff=False时不计入vardiff控制器，由调用方用record_vardiff_share分配工作量。
+        """
         if miner_id not in self.miners:
-            return False
+            return False, False
+        
+        controller = self.vardiff.get(miner_id)
+        now = time.time()
+        if difficulty is None:
+            if controller is None:
+                raise ValueError("未启用vardiff时必须指定份额难度")
+            difficulty = controller.share_difficulty(now)
+        
+        if header is not None and nonce is not None:
+            # 同一任务的份额共享区块头，只在区块头变化时重建中间状态
+            if self._hasher is None or self._hasher.header_prefix != bytes(header[:76]):
+                self._hasher = HeaderHasher(header)
+            share_hash = self._hasher.hash_nonce(nonce)
         
         # 验证份额有效性（简化）
-        hash_int = int(share_hash, 16)
-        target = 0x00000000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF // difficulty
+        if isinstance(share_hash, str):
+            hash_int = int(share_hash, 16)
+        else:
+            hash_int = int.from_bytes(share_hash, 'big')
+        target = self.share_target(difficulty)
         
         if hash_int < target:
             self.shares_submitted[miner_id] += 1
             self.miners[miner_id]['shares'] += 1
+            self.share_ledger.record(miner_id, difficulty)
+            if controller is not None and record_vardiff:
+                controller.record_share(difficulty, now)
             
             # 检查是否找到有效区块
             block_target = target // 1000  # 假设区块难度更高
             if hash_int < block_target:
                 self.blocks_found += 1
                 self.distribute_block_reward(miner_id)
-                return True
+                return True, True
+            return True, False
         
-        return False
+        return False, False
     
     def distribute_block_reward(self, finder_miner_id):
         """分配区块奖励"""
@@ -368,19 +944,17 @@ class MiningPool:
         pool_reward = block_reward * (1 - self.pool_fee)
         self.total_rewards += pool_reward
         
-        print(f"\n🎉 矿工 {finder_miner_id} 找到新区块！")
-        print(f"区块奖励: {block_reward} BTC")
-        print(f"矿池手续费: {block_reward * self.pool_fee:.6f} BTC")
-        print(f"矿工分配: {pool_reward:.6f} BTC")
+        if self.verbose:
+            print(f"\n🎉 矿工 {finder_miner_id} 找到新区块！")
+            print(f"区块奖励: {block_reward} BTC")
+            print(f"矿池手续费: {block_reward * self.pool_fee:.6f} BTC")
+            print(f"矿工分配: {pool_reward:.6f} BTC")
         
-        # 按份额分配（PPS模式简化）
-        total_shares = sum(self.shares_submitted.values())
-        if total_shares > 0:
-            for miner_id in self.miners:
-                miner_shares = self.shares_submitted[miner_id]
-                miner_reward = pool_reward * (miner_shares / total_shares)
-                self.miners[miner_id]['rewards'] += miner_reward
-                print(f"  {miner_id}: {miner_reward:.8f} BTC (份额: {miner_shares})")
+        # 按份额难度加权分配（比例模式或PPLNS），只遍历有贡献的矿工
+        for miner_id, miner_reward in self.share_ledger.settle(pool_reward).items():
+            self.miners[miner_id]['rewards'] += miner_reward
+            if self.verbose:
+                print(f"  {miner_id}: {miner_reward:.8f} BTC (份额: {self.shares_submitted[miner_id]})")
     
     def get_pool_stats(self):
         """获取矿池统计"""
@@ -390,7 +964,9 @@ class MiningPool:
             'total_hashrate': self.total_hashrate,
             'blocks_found': self.blocks_found,
             'total_rewards': self.total_rewards,
-            'miners': self.miners
+            'miners': self.miners,
+            'vardiff': {miner_id: controller.get_state()
+                        for miner_id, controller in self.vardiff.items()}
         }
 
 def mining_profitability_analysis():
@@ -454,18 +1030,33 @@ def difficulty_revenue_relationship():
               f"{daily_btc:.8f}\t${daily_revenue:.0f}")
 
 class BitcoinMiningSimulator:
-    """比特币挖矿完整模拟器"""
-    def __init__(self):
+    """比特币挖矿完整模拟器（离散事件驱动）
+    
+    每个矿工找到下一个区块的时间服从指数分布，速率与其算力占比成正比。
+    所有"下一个区块"事件放在按模拟时间排序的优先队列里，模拟器直接跳到最近的事件，
+    不需要真实等待，几天的模拟可以在毫秒级完成；给定seed时结果可复现。
+    """
+    TARGET_BLOCK_TIME = 600  # 目标出块时间（秒）
+    
+    def __init__(self, seed=None, verbose=True):
         self.miners = {}
         self.blockchain = []
+        self.clock = 0.0  # 模拟时钟（秒）
         self.current_block = {
             'height': len(self.blockchain),
             'difficulty': 0x207fffff,
             'reward': 3.125,
-            'timestamp': time.time()
+            'timestamp': self.clock
         }
+        self.initial_difficulty = self.current_block['difficulty']
         self.network_hashrate = 0
-        self.running = False
+        self.reference_hashrate = None  # 初始难度对应的全网算力（模拟开始时确定）
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.events = []  # 优先队列: (时间, 序号, 矿工ID, 难度纪元)
+        self._event_seq = 0
+        self._difficulty_epoch = 0  # 难度变化后旧事件作废
+        self._simulating = False  # 仅在事件驱动模拟运行期间维护事件队列
         
     def add_miner(self, miner_id, hashrate_th):
         """添加矿工到网络"""
@@ -476,29 +1067,42 @@ class BitcoinMiningSimulator:
             'active': True
         }
         self.network_hashrate += hashrate_th
-        print(f"矿工 {miner_id} 加入网络，算力: {hashrate_th} TH/s")
-    
-    def simulate_mining_attempt(self, miner):
-        """模拟单次挖矿尝试"""
-        miner_id = miner['id']
-        hashrate = self.miners[miner_id]['hashrate_th']
-        
-        # 基于算力计算成功概率
-        success_prob = hashrate / self.network_hashrate
-        
-        # 模拟挖矿时间（泊松分布）
-        time.sleep(random.exponential(10.0))  # 平均10秒一次尝试
-        
-        if random.random() < success_prob:
-            return self.mine_block(miner_id)
+        if self.verbose:
+            print(f"矿工 {miner_id} 加入网络，算力: {hashrate_th} TH/s")
+    
+    def expected_block_time(self, miner_id):
+        """某矿工单独找到下一个区块的期望时间（秒）"""
+        relative_difficulty = self.current_block['difficulty'] / self.initial_difficulty
+        # 直接调用mine_block时模拟尚未确定参考算力，退回当前全网算力
+        reference_hashrate = self.reference_hashrate or self.network_hashrate
+        hashrate_share = self.miners[miner_id]['hashrate_th'] / reference_hashrate
+        return self.TARGET_BLOCK_TIME * relative_difficulty / hashrate_share
+    
+    def schedule_next_block(self, miner_id):
+        """为矿工抽取下一个出块事件并放入事件队列"""
+        miner = self.miners[miner_id]
+        if not miner['active'] or miner['hashrate_th'] <= 0:
+            return
         
-        return False
+        delay = self.rng.expovariate(1.0 / self.expected_block_time(miner_id))
+        heapq.heappush(self.events, (self.clock + delay, self._event_seq,
+                                     miner_id, self._difficulty_epoch))
+        self._event_seq += 1
+    
+    def reschedule_all(self):
+        """难度变化后作废旧事件，按新难度为所有矿工重新抽取"""
+        if not self._simulating:
+            return  # 没有运行中的事件驱动模拟，无需维护事件队列
+        self._difficulty_epoch += 1
+        self.events.clear()
+        for miner_id in self.miners:
+            self.schedule_next_block(miner_id)
     
     def mine_block(self, winning_miner):
         """挖到新区块"""
         self.current_block['height'] = len(self.blockchain)
         self.current_block['miner'] = winning_miner
-        self.current_block['timestamp'] = time.time()
+        self.current_block['timestamp'] = self.clock
         
         # 添加到区块链
         self.blockchain.append(self.current_block.copy())
@@ -507,9 +1111,10 @@ class BitcoinMiningSimulator:
         self.miners[winning_miner]['blocks_found'] += 1
         self.miners[winning_miner]['total_rewards'] += self.current_block['reward']
         
-        print(f"\n🎉 矿工 {winning_miner} 挖到第 {self.current_block['height']} 号区块！")
-        print(f"区块奖励: {self.current_block['reward']} BTC")
-        print(f"总区块数: {len(self.blockchain)}")
+        if self.verbose:
+            print(f"\n🎉 矿工 {winning_miner} 挖到第 {self.current_block['height']} 号区块！")
+            print(f"区块奖励: {self.current_block['reward']} BTC")
+            print(f"总区块数: {len(self.blockchain)}")
         
         # 模拟难度调整（简化）
         if len(self.blockchain) % 10 == 0:
@@ -528,8 +1133,8 @@ class BitcoinMiningSimulator:
         avg_block_time = total_time / 9  # 9个间隔
         
         # 目标时间10分钟 = 600秒
-        target_time = 600
-        adjustment_factor = target_time / avg_block_time
+        target_time = self.TARGET_BLOCK_TIME
+        adjustment_factor = target_time / avg_block_time if avg_block_time > 0 else 1.25
         
         # 限制调整幅度（±25%）
         adjustment_factor = max(0.75, min(1.25, adjustment_factor))
@@ -537,48 +1142,141 @@ class BitcoinMiningSimulator:
         old_difficulty = self.current_block['difficulty']
         self.current_block['difficulty'] = int(old_difficulty * adjustment_factor)
         
-        print(f"难度调整: {adjustment_factor:.2f}x")
-        print(f"平均出块时间: {avg_block_time:.0f}秒")
+        # 出块速率随难度改变，队列里按旧难度抽取的事件需要重抽
+        self.reschedule_all()
+        
+        if self.verbose:
+            print(f"难度调整: {adjustment_factor:.2f}x")
+            print(f"平均出块时间: {avg_block_time:.0f}秒")
     
     def run_mining_simulation(self, duration_minutes=60):
-        """运行挖矿模拟"""
-        print(f"\n=== 开始 {duration_minutes} 分钟挖矿模拟 ===")
-        print(f"参与矿工: {len(self.miners)}")
-        print(f"总算力: {self.network_hashrate} TH/s")
+        """运行挖矿模拟（模拟时间，而非真实等待）"""
+        if self.verbose:
+            print(f"\n=== 开始 {duration_minutes} 分钟挖矿模拟 ===")
+            print(f"参与矿工: {len(self.miners)}")
+            print(f"总算力: {self.network_hashrate} TH/s")
         
-        self.running = True
-        start_time = time.time()
-        threads = []
+        if self.reference_hashrate is None:
+            self.reference_hashrate = self.network_hashrate
         
-        # 为每个矿工启动挖矿线程
-        def mining_worker(miner):
-            miner_id = miner['id']
-            while self.running and time.time() - start_time < duration_minutes * 60:
-                if self.miners[miner_id]['active']:
-                    self.simulate_mining_attempt(miner)
+        end_time = self.clock + duration_minutes * 60
+        self._simulating = True
+        try:
+            self.reschedule_all()
+            
+            # 不断弹出最早的事件，直到超过模拟时长
+            while self.events and self.events[0][0] <= end_time:
+                event_time, _, miner_id, epoch = heapq.heappop(self.events)
+                if epoch != self._difficulty_epoch:
+                    continue
+                
+                self.clock = event_time
+                self.schedule_next_block(miner_id)  # 指数分布无记忆，只需为赢家重抽
+                self.mine_block(miner_id)
+        finally:
+            self._simulating = False
+            self.events.clear()
         
-        for miner_id in self.miners:
-            miner_data = {'id': miner_id}
-            thread = threading.Thread(target=mining_worker, args=(miner_data,))
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
+        self.clock = end_time
+        self.print_simulation_results(duration_minutes)
+    
+    def run_monte_carlo(self, runs=10000, duration_minutes=24 * 60, chunk_size=1000):
+        """蒙特卡洛批量模拟：用NumPy一次模拟大量相互独立的挖矿网络
         
-        # 等待模拟完成
-        time.sleep(duration_minutes * 60)
-        self.running = False
+        每次运行中，全网出块间隔服从指数分布，每个区块的赢家按算力占比抽取
+        （等价于按区块总数做多项分布抽样）。批量模式在当前难度下进行，不做难度调整，
+        也不模拟孤块（出块间隔即为无孤块的区块间隔）。
+        """
+        if np is None:
+            raise ImportError("蒙特卡洛模拟需要NumPy，请安装: pip install numpy")
         
-        # 等待所有线程结束
-        for thread in threads:
-            thread.join(timeout=1)
+        miner_ids = [miner_id for miner_id, miner in self.miners.items()
+                     if miner['active'] and miner['hashrate_th'] > 0]
+        if not miner_ids:
+            raise ValueError("没有可参与模拟的矿工")
+        if self.reference_hashrate is None:
+            self.reference_hashrate = self.network_hashrate
         
-        self.print_simulation_results(duration_minutes)
+        hashrates = np.array([self.miners[miner_id]['hashrate_th'] for miner_id in miner_ids], dtype=float)
+        shares = hashrates / hashrates.sum()
+        relative_difficulty = self.current_block['difficulty'] / self.initial_difficulty
+        mean_interval = (self.TARGET_BLOCK_TIME * relative_difficulty *
+                         self.reference_hashrate / hashrates.sum())
+        duration = duration_minutes * 60
+        
+        # 每次运行预留的区块槽位：期望值 + 10倍标准差，不够时加倍重抽
+        expected_blocks = duration / mean_interval
+        max_blocks = int(expected_blocks + 10 * expected_blocks ** 0.5) + 20
+        
+        # 未指定时从模拟器自己的随机源派生种子，保证给定seed时可复现
+        np_rng = np.random.default_rng(self.rng.randrange(2 ** 32))
+        
+        blocks_found = []
+        network_intervals = []
+        miner_intervals = [[] for _ in miner_ids]
+        
+        for chunk_start in range(0, runs, chunk_size):
+            chunk_runs = min(chunk_size, runs - chunk_start)
+            while True:
+                intervals = np_rng.exponential(mean_interval, size=(chunk_runs, max_blocks))
+                block_times = np.cumsum(intervals, axis=1)
+                in_window = block_times <= duration
+                if not in_window[:, -1].any():
+                    break
+                max_blocks *= 2
+            
+            winners = np_rng.choice(len(miner_ids), size=(chunk_runs, max_blocks), p=shares)
+            network_intervals.append(intervals[in_window])
+            
+            counts = np.empty((chunk_runs, len(miner_ids)), dtype=np.int64)
+            for i in range(len(miner_ids)):
+                won = in_window & (winners == i)
+                counts[:, i] = won.sum(axis=1)
+                # 每行只保留该矿工的出块时间，排序后相邻差即为该矿工的出块间隔
+                own_times = np.sort(np.where(won, block_times, np.nan), axis=1)
+                own_intervals = np.diff(own_times, axis=1)
+                miner_intervals[i].append(own_intervals[~np.isnan(own_intervals)])
+            blocks_found.append(counts)
+        
+        blocks_found = np.concatenate(blocks_found)
+        return {
+            'runs': runs,
+            'duration_minutes': duration_minutes,
+            'miner_ids': miner_ids,
+            'blocks_found': blocks_found,
+            'rewards': blocks_found * self.current_block['reward'],
+            'block_intervals': np.concatenate(network_intervals),
+            'miner_block_intervals': {
+                miner_id: np.concatenate(miner_intervals[i])
+                for i, miner_id in enumerate(miner_ids)
+            }
+        }
+    
+    def print_monte_carlo_results(self, results):
+        """打印蒙特卡洛模拟的分布统计"""
+        print(f"\n=== 蒙特卡洛模拟: {results['runs']:,} 次 × {results['duration_minutes']} 分钟 ===")
+        intervals = results['block_intervals']
+        print(f"全网出块间隔: 均值 {intervals.mean():.1f}秒, "
+              f"P95 {np.percentile(intervals, 95):.1f}秒")
+        
+        print("\n矿工ID\t\t出块均值\t标准差\tP5-P95\t\t零出块概率\t奖励均值(BTC)")
+        print("-" * 80)
+        for i, miner_id in enumerate(results['miner_ids']):
+            blocks = results['blocks_found'][:, i]
+            p5, p95 = np.percentile(blocks, [5, 95])
+            print(f"{miner_id}\t{blocks.mean():.2f}\t\t{blocks.std():.2f}\t"
+                  f"{p5:.0f}-{p95:.0f}\t\t{(blocks == 0).mean()*100:.2f}%\t\t"
+                  f"{results['rewards'][:, i].mean():.3f}")
     
     def print_simulation_results(self, duration_minutes):
         """打印模拟结果"""
+        if not self.verbose:
+            return
+        
         print(f"\n=== {duration_minutes}分钟模拟结果 ===")
         print(f"总区块数: {len(self.blockchain)}")
-        print(f"平均出块时间: {duration_minutes*60/len(self.blockchain):.1f}秒")
+        if self.blockchain:
+            print(f"平均出块时间: {duration_minutes*60/len(self.blockchain):.1f}秒")
         
         print("\n矿工统计:")
         print("矿工ID\t\t算力(TH/s)\t出块数\t总奖励(BTC)")
@@ -597,6 +1295,37 @@ class BitcoinMiningSimulator:
         print(f"实际区块数: {len(self.blockchain)}")
         print(f"总奖励分配: {total_rewards:.3f} BTC")
 
+def mining_simulation_demo():
+    """一天挖矿网络的离散事件模拟"""
+    simulator = BitcoinMiningSimulator(seed=42, verbose=False)
+    for miner_id, hashrate_th in [("Foundry", 320), ("AntPool", 260), ("F2Pool", 210), ("Solo", 10)]:
+        simulator.add_miner(miner_id, hashrate_th)
+    
+    start_time = time.time()
+    simulator.run_mining_simulation(duration_minutes=24 * 60)
+    elapsed = time.time() - start_time
+    
+    simulator.verbose = True
+    simulator.print_simulation_results(24 * 60)
+    print(f"\n模拟耗时: {elapsed * 1000:.1f} 毫秒")
+
+def mining_variance_demo():
+    """蒙特卡洛挖矿收益方差分析"""
+    if np is None:
+        print("未安装NumPy，跳过蒙特卡洛模拟（pip install numpy）")
+        return
+    
+    simulator = BitcoinMiningSimulator(seed=42, verbose=False)
+    for miner_id, hashrate_th in [("大型矿池", 300), ("中型矿池", 150), ("小型矿场", 40), ("个人矿工", 10)]:
+        simulator.add_miner(miner_id, hashrate_th)
+    
+    start_time = time.time()
+    results = simulator.run_monte_carlo(runs=10000, duration_minutes=24 * 60)
+    elapsed = time.time() - start_time
+    
+    simulator.print_monte_carlo_results(results)
+    print(f"\n模拟耗时: {elapsed:.2f}秒")
+
 def run_mining_demo():
     """运行挖矿演示"""
     print("=== 比特币挖矿完整演示 ===")
@@ -762,6 +1491,11 @@ if __name__ == "__main__":
     # 选择要运行的演示
     demos = [
         ("基础概念演示", proof_of_work_concept),
+        ("多进程挖矿", parallel_mining_demo),
+        ("extranonce滚动", extranonce_mining_demo),
+        ("挖矿策略对比", batch_strategy_benchmark),
+        ("挖矿网络模拟", mining_simulation_demo),
+        ("挖矿收益方差", mining_variance_demo),
         ("完整挖矿演示", run_mining_demo),  
         ("能耗分析", bitcoin_energy_consumption_2025),
         ("价值评估", mining_value_assessment),
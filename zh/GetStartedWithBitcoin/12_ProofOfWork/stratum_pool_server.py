@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stratum矿池服务器示例（asyncio）
+
+实现Stratum协议的一个子集（按行分隔的JSON-RPC）：
+mining.subscribe / mining.authorize / mining.notify / mining.set_difficulty / mining.submit
+份额校验和奖励分配复用 mining_examples.MiningPool，并附带一个本地客户端群作为压测工具。
+
+使用方法:
+python3 stratum_pool_server.py                          # 同一进程内启动服务器和客户端群，输出压测结果
+python3 stratum_pool_server.py --mode server            # 只启动服务器
+python3 stratum_pool_server.py --mode swarm --clients 50  # 连接已运行的服务器进行压测
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import struct
+import time
+
+from mining_examples import (BitcoinMiner, HeaderHasher, MiningPool,
+                             difficulty_to_share_target)
+
+# Stratum错误码
+ERROR_OTHER = 20
+ERROR_JOB_NOT_FOUND = 21
+ERROR_DUPLICATE_SHARE = 22
+ERROR_LOW_DIFFICULTY = 23
+ERROR_UNAUTHORIZED = 24
+
+EXTRANONCE1_SIZE = 4
+EXTRANONCE2_SIZE = 4
+
+
+def double_sha256(data):
+    """双重SHA256哈希"""
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def build_job_header(job, extranonce1, extranonce2, ntime):
+    """按任务参数拼出76字节区块头（不含nonce），服务器和客户端共用"""
+    coinbase = job['coinb1'] + extranonce1 + extranonce2 + job['coinb2']
+    merkle_root = double_sha256(coinbase)
+    for sibling in job['merkle_branch']:
+        merkle_root = double_sha256(merkle_root + sibling)
+    return (struct.pack("<I", job['version']) + job['prevhash'] + merkle_root +
+            struct.pack("<II", ntime, job['nbits']))
+
+
+def parse_hex_field(value, size):
+    """解析定长十六进制字段，格式不合法时返回None"""
+    if not isinstance(value, str) or len(value) != size * 2:
+        return None
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return None
+
+
+def job_from_notify(params):
+    """把mining.notify参数还原成任务字典"""
+    job_id, prevhash, coinb1, coinb2, branch, version, nbits, ntime, clean_jobs = params
+    return {
+        'job_id': job_id,
+        'prevhash': bytes.fromhex(prevhash),
+        'coinb1': bytes.fromhex(coinb1),
+        'coinb2': bytes.fromhex(coinb2),
+        'merkle_branch': [bytes.fromhex(h) for h in branch],
+        'version': int(version, 16),
+        'nbits': int(nbits, 16),
+        'ntime': int(ntime, 16),
+        'clean_jobs': clean_jobs
+    }
+
+
+class StratumConnection:
+    """单个矿工连接的状态
+    
+    mining.set_difficulty作用于整个连接，所以难度按连接记录：
+    份额按最近一次下发给这个连接的难度校验，刚调整时的宽限期内按新旧难度中较低的计。
+    """
+    GRACE_SECONDS = 2.0
+
+    def __init__(self, writer, extranonce1):
+        self.writer = writer
+        self.extranonce1 = extranonce1
+        self.workers = set()  # 已授权的矿工名
+        self.difficulty = None  # 最近一次下发的难度
+        self.previous_difficulty = None
+        self.difficulty_changed_at = 0.0
+        self.subscribed = False
+
+    def set_difficulty(self, difficulty, now):
+        self.previous_difficulty = self.difficulty if self.difficulty is not None else difficulty
+        self.difficulty = difficulty
+        self.difficulty_changed_at = now
+
+    def share_difficulty(self, now):
+        """校验份额时使用的难度"""
+        if now - self.difficulty_changed_at < self.GRACE_SECONDS:
+            return min(self.difficulty, self.previous_difficulty)
+        return self.difficulty
+
+    def send(self, message):
+        """写入一行JSON（由调用方统一drain）"""
+        self.writer.write((json.dumps(message) + "\n").encode())
+
+
+class StratumPoolServer:
+    """Stratum矿池服务器：MiningPool的网络接口
+    
+    份额难度由矿池的vardiff控制器按矿工分配；如果矿池还没启用vardiff，
+    用initial_difficulty和默认参数启用。一个连接上授权了多个矿工时，
+    连接的难度取各矿工难度之和，使整个连接的份额速率接近vardiff的目标速率。
+    """
+    def __init__(self, pool, host="127.0.0.1", port=3333, initial_difficulty=2 ** -16,
+                 batch_size=256):
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        if pool.vardiff_config is None:
+            pool.enable_vardiff(initial_difficulty)
+
+        self.connections = set()
+        self.jobs = {}  # job_id -> 任务
+        self.current_job = None
+        self.seen_shares = set()  # 防止重复提交
+        self.submit_queue = asyncio.Queue()
+        self.server = None
+        self._validator_task = None
+        self._retarget_task = None
+        self._job_counter = 0
+        self._extranonce_counter = 0
+        self._miner = BitcoinMiner()
+        self.stats = {'accepted': 0, 'rejected': 0, 'blocks': 0, 'batches': 0}
+
+    async def start(self):
+        """启动监听和批量校验任务"""
+        self.new_job(clean_jobs=True)
+        self._validator_task = asyncio.create_task(self.validate_submissions())
+        self._retarget_task = asyncio.create_task(self.retarget_loop())
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Stratum服务器监听 {self.host}:{self.port}")
+
+    async def stop(self):
+        """关闭服务器"""
+        self.server.close()
+        await self.server.wait_closed()
+        self._validator_task.cancel()
+        self._retarget_task.cancel()
+        for conn in list(self.connections):
+            conn.writer.close()
+
+    def new_job(self, clean_jobs):
+        """生成新任务（模拟新区块模板）并广播给所有连接"""
+        self._job_counter += 1
+        height = self.pool.blocks_found
+        txids = [double_sha256(f"tx-{height}-{i}".encode()) for i in range(8)]
+        job = {
+            'job_id': f"{self._job_counter:x}",
+            'prevhash': double_sha256(f"block-{height}".encode()),
+            'coinb1': b'\x01' + struct.pack("<I", height),
+            'coinb2': b'/Get-Started-with-Web3/',
+            'merkle_branch': self._miner.build_coinbase_merkle_branch(txids),
+            'version': 0x20000000,
+            'nbits': 0x1d00ffff,
+            'ntime': int(time.time()),
+            'clean_jobs': clean_jobs
+        }
+        if clean_jobs:
+            # 旧任务作废，重复份额集合也随之清空
+            self.jobs.clear()
+            self.seen_shares.clear()
+        self.jobs[job['job_id']] = job
+        self.current_job = job
+
+        for conn in self.connections:
+            if conn.workers:
+                conn.send(self.notify_message(job))
+                asyncio.ensure_future(self._drain(conn))
+
+    def notify_message(self, job):
+        """构造mining.notify消息"""
+        return {
+            'id': None,
+            'method': 'mining.notify',
+            'params': [
+                job['job_id'], job['prevhash'].hex(), job['coinb1'].hex(), job['coinb2'].hex(),
+                [h.hex() for h in job['merkle_branch']],
+                f"{job['version']:08x}", f"{job['nbits']:08x}", f"{job['ntime']:08x}",
+                job['clean_jobs']
+            ]
+        }
+
+    async def handle_connection(self, reader, writer):
+        """处理一个矿工连接：按行读取JSON-RPC请求"""
+        self._extranonce_counter += 1
+        conn = StratumConnection(writer, self._extranonce_counter.to_bytes(EXTRANONCE1_SIZE, "big"))
+        self.connections.add(conn)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(request, dict):
+                    continue
+                self.handle_request(conn, request)
+                await self._drain(conn)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(conn)
+            writer.close()
+
+    def handle_request(self, conn, request):
+        """分发单个请求"""
+        msg_id = request.get('id')
+        method = request.get('method')
+        params = request.get('params') or []
+        if not isinstance(params, list):
+            conn.send({'id': msg_id, 'result': None, 'error': [ERROR_OTHER, "参数格式错误", None]})
+            return
+
+        if method == 'mining.subscribe':
+            conn.subscribed = True
+            conn.send({
+                'id': msg_id,
+                'result': [[["mining.set_difficulty", conn.extranonce1.hex()],
+                            ["mining.notify", conn.extranonce1.hex()]],
+                           conn.extranonce1.hex(), EXTRANONCE2_SIZE],
+                'error': None
+            })
+        elif method == 'mining.authorize':
+            worker = params[0] if params else None
+            if not worker or not isinstance(worker, str):
+                conn.send({'id': msg_id, 'result': False, 'error': [ERROR_UNAUTHORIZED, "缺少矿工名", None]})
+                return
+            if worker not in self.pool.miners:
+                self.pool.add_miner(worker, 0)
+            conn.workers.add(worker)
+            conn.send({'id': msg_id, 'result': True, 'error': None})
+            self._send_difficulty(conn)
+            conn.send(self.notify_message(self.current_job))
+        elif method == 'mining.submit':
+            # 交给批量校验任务，连接读循环不被哈希计算阻塞
+            self.submit_queue.put_nowait((conn, msg_id, params))
+        else:
+            conn.send({'id': msg_id, 'result': None, 'error': [ERROR_OTHER, f"不支持的方法: {method}", None]})
+
+    async def validate_submissions(self):
+        """批量校验份额：一次取出队列中积压的提交，按区块头分组复用中间状态"""
+        while True:
+            batch = [await self.submit_queue.get()]
+            while len(batch) < self.batch_size and not self.submit_queue.empty():
+                batch.append(self.submit_queue.get_nowait())
+            self.stats['batches'] += 1
+
+            groups = {}
+            touched = set()
+            for conn, msg_id, params in batch:
+                touched.add(conn)
+                error, share = self._precheck(conn, params)
+                if error:
+                    self._reject(conn, msg_id, error)
+                    continue
+                worker, job_id, extranonce2, ntime, nonce = share
+                groups.setdefault((job_id, conn.extranonce1, extranonce2, ntime), []).append(
+                    (conn, msg_id, worker, nonce))
+
+            found_block = False
+            now = time.time()
+            for (job_id, extranonce1, extranonce2, ntime), submissions in groups.items():
+                header = build_job_header(self.jobs[job_id], extranonce1, extranonce2, ntime)
+                for conn, msg_id, worker, nonce in submissions:
+                    # 按连接的难度校验和计入收益；单个份额出错不能终止校验任务
+                    difficulty = conn.share_difficulty(now)
+                    try:
+                        accepted, is_block = self.pool.accept_share(
+                            worker, None, difficulty=difficulty,
+                            header=header, nonce=nonce, record_vardiff=False)
+                    except Exception as e:
+                        self._reject(conn, msg_id, [ERROR_OTHER, f"份额校验失败: {e}", None])
+                        continue
+                    if not accepted:
+                        self._reject(conn, msg_id, [ERROR_LOW_DIFFICULTY, "份额难度不足", None])
+                        continue
+                    self.stats['accepted'] += 1
+                    self._credit_vardiff(conn, difficulty, now)
+                    conn.send({'id': msg_id, 'result': True, 'error': None})
+                    self._send_difficulty(conn)
+                    if is_block:
+                        self.stats['blocks'] += 1
+                        found_block = True
+
+            if found_block:
+                self.new_job(clean_jobs=True)
+            for conn in touched:
+                await self._drain(conn)
+
+    def _precheck(self, conn, params):
+        """校验提交格式、授权、任务和重复
+        
+        返回 (错误, 解析后的份额)：份额为 (矿工名, 任务ID, extranonce2字节, ntime整数, nonce整数)，
+        重复检测基于解析后的值，大小写不同的十六进制不会被重复计入。
+        """
+        if not isinstance(params, list) or len(params) != 5:
+            return [ERROR_OTHER, "参数格式错误", None], None
+        worker, job_id, extranonce2, ntime, nonce = params
+        if not isinstance(worker, str) or worker not in conn.workers:
+            return [ERROR_UNAUTHORIZED, "矿工未授权", None], None
+        if not isinstance(job_id, str) or job_id not in self.jobs:
+            return [ERROR_JOB_NOT_FOUND, "任务不存在（已过期）", None], None
+        extranonce2 = parse_hex_field(extranonce2, EXTRANONCE2_SIZE)
+        ntime = parse_hex_field(ntime, 4)
+        nonce = parse_hex_field(nonce, 4)
+        if extranonce2 is None or ntime is None or nonce is None:
+            return [ERROR_OTHER, "extranonce2、ntime或nonce格式错误", None], None
+        ntime = int.from_bytes(ntime, "big")
+        nonce = int.from_bytes(nonce, "big")
+        share_key = (job_id, conn.extranonce1, extranonce2, ntime, nonce)
+        if share_key in self.seen_shares:
+            return [ERROR_DUPLICATE_SHARE, "重复份额", None], None
+        self.seen_shares.add(share_key)
+        return None, (worker, job_id, extranonce2, ntime, nonce)
+
+    def _reject(self, conn, msg_id, error):
+        self.stats['rejected'] += 1
+        conn.send({'id': msg_id, 'result': False, 'error': error})
+
+    def connection_difficulty(self, conn):
+        """连接的份额难度：该连接上所有矿工的vardiff难度之和"""
+        return sum(self.pool.get_miner_difficulty(worker) for worker in conn.workers)
+
+    def _credit_vardiff(self, conn, difficulty, now):
+        """把一个份额的工作量按各矿工难度的占比分给连接上的vardiff控制器
+        
+        连接上的所有矿工共用一个目标，份额难度是各矿工难度之和；如果每个控制器都按
+        这个总难度记录，每个矿工都会多算工作量，难度调高后总难度又随之变大，不断自我放大。
+        按占比分配后，各控制器记录的工作量之和等于连接实际完成的工作量。
+        """
+        difficulties = {worker: self.pool.get_miner_difficulty(worker) for worker in conn.workers}
+        total = sum(difficulties.values())
+        for worker, worker_difficulty in difficulties.items():
+            self.pool.record_vardiff_share(worker, difficulty * worker_difficulty / total, now)
+
+    def _send_difficulty(self, conn):
+        """连接的难度有变化时下发mining.set_difficulty，返回是否下发"""
+        difficulty = self.connection_difficulty(conn)
+        if difficulty == conn.difficulty:
+            return False
+        conn.set_difficulty(difficulty, time.time())
+        conn.send({'id': None, 'method': 'mining.set_difficulty', 'params': [difficulty]})
+        return True
+
+    async def retarget_loop(self):
+        """定时重算难度：提交很少的慢矿工也能被及时调低难度"""
+        interval = self.pool.vardiff_config['retarget_interval'] / 2
+        while True:
+            await asyncio.sleep(interval)
+            changes = self.pool.retarget_vardiff()
+            if not changes:
+                continue
+            # 复制一份：drain期间其他协程可能增删连接或授权新矿工
+            for conn in list(self.connections):
+                if not changes.keys().isdisjoint(list(conn.workers)) and self._send_difficulty(conn):
+                    await self._drain(conn)
+
+    async def _drain(self, conn):
+        try:
+            await conn.writer.drain()
+        except ConnectionError:
+            self.connections.discard(conn)
+
+
+class StratumClient:
+    """压测用的Stratum客户端：真实地挖低难度份额并提交"""
+    def __init__(self, name, stats):
+        self.name = name
+        self.stats = stats
+        self.job = None
+        self.difficulty = None
+        self.extranonce1 = None
+        self.pending = {}  # 请求ID -> (方法, 发送时间)
+        self._next_id = 1
+        self._job_changed = asyncio.Event()
+
+    async def run(self, host, port, duration):
+        """连接服务器并在duration秒内持续挖矿提交"""
+        reader, writer = await asyncio.open_connection(host, port)
+        self.writer = writer
+        listener = asyncio.create_task(self.listen(reader))
+        self.request('mining.subscribe', ['stratum-swarm/1.0'])
+        self.request('mining.authorize', [self.name, 'x'])
+        await writer.drain()
+
+        deadline = time.time() + duration
+        try:
+            await asyncio.wait_for(self._job_changed.wait(), timeout=duration)
+            await self.mine(deadline)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # 等待在途请求的响应，再关闭连接
+            for _ in range(50):
+                if not self.pending:
+                    break
+                await asyncio.sleep(0.01)
+            listener.cancel()
+            writer.close()
+
+    def request(self, method, params):
+        msg_id = self._next_id
+        self._next_id += 1
+        self.pending[msg_id] = (method, time.perf_counter())
+        self.writer.write((json.dumps({'id': msg_id, 'method': method, 'params': params}) + "\n").encode())
+        return msg_id
+
+    async def listen(self, reader):
+        """处理响应和服务器推送"""
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            method = message.get('method')
+            if method == 'mining.notify':
+                self.job = job_from_notify(message['params'])
+                self._job_changed.set()
+            elif method == 'mining.set_difficulty':
+                self.difficulty = message['params'][0]
+            elif message.get('id') in self.pending:
+                request_method, sent_at = self.pending.pop(message['id'])
+                result = message.get('result')
+                if request_method == 'mining.subscribe':
+                    self.extranonce1 = bytes.fromhex(result[1])
+                elif request_method == 'mining.submit':
+                    self.stats['latencies'].append(time.perf_counter() - sent_at)
+                    self.stats['accepted' if result is True else 'rejected'] += 1
+
+    async def mine(self, deadline):
+        """扫描nonce，找到满足当前份额难度的哈希就提交"""
+        extranonce2 = 0
+        while time.time() < deadline:
+            job = self.job
+            self._job_changed.clear()
+            extranonce2 += 1
+            en2 = struct.pack(">I", extranonce2)
+            ntime = job['ntime']
+            hasher = HeaderHasher(build_job_header(job, self.extranonce1, en2, ntime))
+
+            nonce = 0
+            while nonce < 0xFFFFFFFF and not self._job_changed.is_set() and time.time() < deadline:
+                target = difficulty_to_share_target(self.difficulty)
+                # 每扫描一小段就让出事件循环，及时处理服务器推送
+                for nonce in range(nonce, nonce + 256):
+                    if int.from_bytes(hasher.hash_nonce(nonce), 'big') < target:
+                        self.request('mining.submit', [self.name, job['job_id'], en2.hex(),
+                                                       f"{ntime:08x}", f"{nonce:08x}"])
+                nonce += 1
+                await self.writer.drain()
+                await asyncio.sleep(0)
+
+
+async def run_client_swarm(host, port, clients=20, duration=10.0):
+    """启动一群客户端并汇总已接受份额速率和延迟分布"""
+    stats = {'accepted': 0, 'rejected': 0, 'latencies': []}
+    swarm = [StratumClient(f"worker{i}", stats) for i in range(clients)]
+    start_time = time.perf_counter()
+    await asyncio.gather(*(client.run(host, port, duration) for client in swarm))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = sorted(stats['latencies'])
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    print(f"\n=== 压测结果: {clients} 个客户端, {elapsed:.1f} 秒 ===")
+    print(f"已接受份额: {stats['accepted']} ({stats['accepted'] / elapsed:,.1f} 份/秒)")
+    print(f"被拒份额: {stats['rejected']}")
+    print(f"提交延迟: P50 {percentile(0.50):.2f}ms, P95 {percentile(0.95):.2f}ms, "
+          f"P99 {percentile(0.99):.2f}ms")
+    return stats
+
+
+async def run_benchmark(clients, duration, port, difficulty):
+    """同一进程内启动服务器和客户端群"""
+    pool = MiningPool("Stratum Pool", pplns_window=10000, verbose=False)
+    # 压测时让vardiff目标速率足够高，避免难度被迅速拉升
+    pool.enable_vardiff(difficulty, target_shares_per_minute=6000, retarget_interval=5)
+    server = StratumPoolServer(pool, port=port)
+    await server.start()
+    await run_client_swarm(server.host, server.port, clients, duration)
+    await server.stop()
+
+    print(f"服务器端: 接受 {server.stats['accepted']}, 拒绝 {server.stats['rejected']}, "
+          f"找到区块 {server.stats['blocks']}, 校验批次 {server.stats['batches']}")
+
+
+async def run_server(port, difficulty):
+    pool = MiningPool("Stratum Pool", pplns_window=10000)
+    server = StratumPoolServer(pool, port=port, initial_difficulty=difficulty)
+    await server.start()
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stratum矿池服务器与压测客户端")
+    parser.add_argument("--mode", choices=["bench", "server", "swarm"], default="bench",
+                        help="bench: 同进程压测（默认）; server: 只启动服务器; swarm: 只启动客户端群")
+    parser.add_argument("--host", default="127.0.0.1", help="swarm模式连接的服务器地址")
+    parser.add_argument("--port", type=int, default=0, help="端口，0表示自动分配（bench模式）")
+    parser.add_argument("--clients", type=int, default=20, help="客户端数量")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长（秒）")
+    parser.add_argument("--difficulty", type=float, default=2 ** -24,
+                        help="初始份额难度（教学用低难度，小于1）")
+    args = parser.parse_args()
+
+    if args.mode == "server":
+        asyncio.run(run_server(args.port or 3333, args.difficulty))
+    elif args.mode == "swarm":
+        asyncio.run(run_client_swarm(args.host, args.port or 3333, args.clients, args.duration))
+    else:
+        asyncio.run(run_benchmark(args.clients, args.duration, args.port, args.difficulty))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+第12讲：Stratum矿池服务器测试脚本
+验证一个连接上授权多个矿工时vardiff工作量的计算
+"""
+
+import asyncio
+import json
+
+from stratum_pool_server import *
+
+
+class FakeWriter:
+    """记录服务器写出的消息，代替真实的网络连接"""
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data):
+        self.messages.append(json.loads(data))
+
+    async def drain(self):
+        pass
+
+
+def mine_shares(job, extranonce1, difficulty, count):
+    """按连接难度挖出count个份额（跳过会被当作区块的份额，避免任务被清空），
+    返回 (extranonce2, ntime, nonce) 十六进制参数"""
+    extranonce2 = bytes(EXTRANONCE2_SIZE)
+    hasher = HeaderHasher(build_job_header(job, extranonce1, extranonce2, job['ntime']))
+    target = difficulty_to_share_target(difficulty)
+    shares = []
+    nonce = 0
+    while len(shares) < count:
+        if target // 1000 <= int.from_bytes(hasher.hash_nonce(nonce), 'big') < target:
+            shares.append((extranonce2.hex(), f"{job['ntime']:08x}", f"{nonce:08x}"))
+        nonce += 1
+    return shares
+
+
+async def submit_and_validate(server, conn, worker, shares):
+    """把份额放入提交队列，等批量校验任务处理完"""
+    for i, (extranonce2, ntime, nonce) in enumerate(shares):
+        server.submit_queue.put_nowait((conn, i, [worker, server.current_job['job_id'],
+                                                  extranonce2, ntime, nonce]))
+    validator = asyncio.ensure_future(server.validate_submissions())
+    while not server.submit_queue.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    validator.cancel()
+
+
+def test_connection_with_two_workers():
+    """测试同一连接上两个矿工的份额按难度占比计入vardiff"""
+    print("测试多矿工连接...")
+
+    pool = MiningPool(verbose=False)
+    server = StratumPoolServer(pool)
+    server.new_job(clean_jobs=True)
+    conn = StratumConnection(FakeWriter(), (1).to_bytes(EXTRANONCE1_SIZE, "big"))
+    server.connections.add(conn)
+    server.handle_request(conn, {'id': 1, 'method': 'mining.subscribe', 'params': []})
+    for worker in ("rig.a", "rig.b"):
+        server.handle_request(conn, {'id': 2, 'method': 'mining.authorize', 'params': [worker, 'x']})
+    conn.difficulty_changed_at = 0.0  # 跳过调整难度后的宽限期
+
+    worker_difficulty = pool.get_miner_difficulty("rig.a")
+    assert conn.difficulty == 2 * worker_difficulty, "连接难度应为两个矿工难度之和"
+
+    # 所有份额都以rig.a的名义提交：连接的工作量按难度占比分给两个控制器
+    shares = mine_shares(server.current_job, conn.extranonce1, conn.difficulty, 20)
+    asyncio.run(submit_and_validate(server, conn, "rig.a", shares))
+    assert server.stats['accepted'] == 20, "份额应该全部被接受"
+
+    connection_work = 20 * conn.difficulty
+    work = {worker: pool.vardiff[worker].window_work for worker in ("rig.a", "rig.b")}
+    assert abs(sum(work.values()) - connection_work) < 1e-12, "各矿工记录的工作量之和应等于连接的工作量"
+    assert abs(work["rig.a"] - work["rig.b"]) < 1e-12, "难度相同的矿工应分到相同的工作量"
+    assert pool.share_ledger.weights == {"rig.a": connection_work}, "收益仍应记给提交份额的矿工"
+
+    print("✅ 多矿工连接测试通过")
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🧪 开始运行Stratum矿池测试套件")
+    print("=" * 40)
+
+    try:
+        test_connection_with_two_workers()
+
+        print("\n🎉 所有测试通过！")
+        print("✅ 第12讲Stratum矿池实现正确")
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n💥 测试出错: {e}")
+
+
+if __name__ == "__main__":
+    run_all_tests()
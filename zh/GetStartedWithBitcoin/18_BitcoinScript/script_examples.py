@@ -1,16 +1,35 @@
 # 比特币脚本系统核心代码示例
 
 import hashlib
+import multiprocessing
 import secrets
+import time
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
+try:
+    import numpy as np  # 可选依赖：整个区块的输出脚本批量分类
+except ImportError:
+    np = None
+
+try:
+    import ecdsa  # 可选依赖：签名验证使用（pip install ecdsa）
+    from ecdsa import SECP256k1, VerifyingKey, ellipticcurve
+    from ecdsa.util import sigdecode_der, sigencode_der
+except ImportError:
+    ecdsa = None
+
 # 1. 脚本操作码定义
 class OpCode(Enum):
     """比特币脚本操作码"""
     # 常量操作
     OP_0 = 0x00
+    OP_PUSHDATA1 = 0x4c
+    OP_PUSHDATA2 = 0x4d
+    OP_PUSHDATA4 = 0x4e
+    OP_1NEGATE = 0x4f
     OP_1 = 0x51
     OP_2 = 0x52
     OP_3 = 0x53
@@ -53,6 +72,7 @@ class OpCode(Enum):
     OP_CHECKSIG = 0xac
     OP_CHECKSIGVERIFY = 0xad
     OP_CHECKMULTISIG = 0xae
+    OP_CHECKMULTISIGVERIFY = 0xaf
     
     # 条件操作
     OP_IF = 0x63
@@ -76,18 +96,236 @@ class ScriptElement:
             return f"PUSH({self.data.hex()})"
         return "EMPTY"
 
+def parse_script(raw) -> List[Tuple[int, int, int]]:
+    """解析原始脚本字节（bytes或memoryview），返回 (操作码, 数据起始, 数据结束) 列表
+    
+    不复制压栈数据，只记录它在原始字节中的偏移：操作码 <= OP_PUSHDATA4 的是压栈操作，
+    数据为 raw[起始:结束]；其它操作码的起始和结束相同。
+    """
+    ops = []
+    pos = 0
+    size = len(raw)
+    while pos < size:
+        opcode = raw[pos]
+        pos += 1
+        if opcode <= 0x4b:
+            length = opcode
+        elif opcode == 0x4c:
+            length = raw[pos] if pos < size else -1
+            pos += 1
+        elif opcode == 0x4d:
+            length = int.from_bytes(raw[pos:pos + 2], 'little') if pos + 2 <= size else -1
+            pos += 2
+        elif opcode == 0x4e:
+            length = int.from_bytes(raw[pos:pos + 4], 'little') if pos + 4 <= size else -1
+            pos += 4
+        else:
+            ops.append((opcode, pos, pos))
+            continue
+        
+        if length < 0 or pos + length > size:
+            raise ValueError(f"脚本在偏移 {pos} 处的压栈数据不完整")
+        ops.append((opcode, pos, pos + length))
+        pos += length
+    return ops
+
+def push_data_bytes(data: bytes) -> bytes:
+    """按最短方式编码一次压栈：空数据和1..16用OP_0/OP_N，其余按长度选择直接压栈或OP_PUSHDATA1/2/4"""
+    length = len(data)
+    if length == 0:
+        return b'\x00'
+    if length == 1 and 1 <= data[0] <= 16:
+        return bytes([0x50 + data[0]])
+    if length == 1 and data[0] == 0x81:
+        return b'\x4f'  # OP_1NEGATE
+    if length <= 0x4b:
+        return bytes([length]) + data
+    if length <= 0xff:
+        return b'\x4c' + bytes([length]) + data
+    if length <= 0xffff:
+        return b'\x4d' + length.to_bytes(2, 'little') + data
+    return b'\x4e' + length.to_bytes(4, 'little') + data
+
+def serialize_script(script: List[ScriptElement]) -> bytes:
+    """把脚本元素序列化为标准的原始字节"""
+    parts = []
+    for element in script:
+        if element.data:
+            parts.append(push_data_bytes(bytes(element.data)))
+        elif element.op_code:
+            parts.append(bytes([element.op_code.value]))
+    return b''.join(parts)
+
+def script_from_bytes(raw) -> List[ScriptElement]:
+    """把原始脚本字节转换为脚本元素（会复制压栈数据，主要用于显示和分析）"""
+    elements = []
+    for opcode, start, end in parse_script(raw):
+        if opcode <= 0x4e and opcode != 0x00:
+            elements.append(ScriptElement(None, bytes(raw[start:end])))
+        else:
+            try:
+                elements.append(ScriptElement(OpCode(opcode), None))
+            except ValueError:
+                raise ValueError(f"未定义的操作码: {opcode:#04x}")
+    return elements
+
+def _require_ecdsa():
+    if ecdsa is None:
+        raise ImportError("签名验证需要ecdsa库，请安装: pip install ecdsa")
+
+def tagged_hash(tag: str, data: bytes) -> bytes:
+    """BIP340带标签的哈希: SHA256(SHA256(tag) || SHA256(tag) || data)"""
+    tag_hash = hashlib.sha256(tag.encode()).digest()
+    return hashlib.sha256(tag_hash + tag_hash + data).digest()
+
+def verify_ecdsa(pubkey: bytes, der_signature: bytes, sighash: bytes) -> bool:
+    """secp256k1 ECDSA验证：公钥为33字节压缩或65字节未压缩格式，签名为DER编码"""
+    _require_ecdsa()
+    try:
+        verifying_key = VerifyingKey.from_string(pubkey, curve=SECP256k1)
+        return verifying_key.verify_digest(der_signature, sighash, sigdecode=sigdecode_der)
+    except (ecdsa.BadSignatureError, ecdsa.MalformedPointError, ecdsa.UnexpectedDER, ValueError):
+        return False
+
+def _lift_x(x: int):
+    """BIP340：由x坐标恢复y为偶数的曲线点"""
+    p = SECP256k1.curve.p()
+    if x >= p:
+        return None
+    c = (pow(x, 3, p) + 7) % p
+    y = pow(c, (p + 1) // 4, p)
+    if y * y % p != c:
+        return None
+    return ellipticcurve.PointJacobi(SECP256k1.curve, x, y if y % 2 == 0 else p - y, 1,
+                                     SECP256k1.order)
+
+def verify_schnorr(pubkey: bytes, signature: bytes, message: bytes) -> bool:
+    """BIP340 Schnorr验证：32字节x-only公钥，64字节签名"""
+    _require_ecdsa()
+    n = SECP256k1.order
+    point = _lift_x(int.from_bytes(pubkey, 'big'))
+    r = int.from_bytes(signature[:32], 'big')
+    s = int.from_bytes(signature[32:], 'big')
+    if point is None or r >= SECP256k1.curve.p() or s >= n:
+        return False
+    e = int.from_bytes(tagged_hash("BIP0340/challenge", signature[:32] + pubkey + message), 'big') % n
+    # R = s*G - e*P
+    R = SECP256k1.generator.mul_add(s, point, n - e)
+    if R == ellipticcurve.INFINITY:
+        return False
+    return R.y() % 2 == 0 and R.x() == r
+
+def sign_schnorr(secret: int, message: bytes, aux_rand: bytes = bytes(32)) -> bytes:
+    """BIP340 Schnorr签名（演示和测试用）"""
+    _require_ecdsa()
+    n = SECP256k1.order
+    G = SECP256k1.generator
+    P = G * secret
+    d = secret if P.y() % 2 == 0 else n - secret
+    pubkey = P.x().to_bytes(32, 'big')
+    t = (d ^ int.from_bytes(tagged_hash("BIP0340/aux", aux_rand), 'big')).to_bytes(32, 'big')
+    k0 = int.from_bytes(tagged_hash("BIP0340/nonce", t + pubkey + message), 'big') % n
+    R = G * k0
+    k = k0 if R.y() % 2 == 0 else n - k0
+    r = R.x().to_bytes(32, 'big')
+    e = int.from_bytes(tagged_hash("BIP0340/challenge", r + pubkey + message), 'big') % n
+    return r + ((k + e * d) % n).to_bytes(32, 'big')
+
+class SignatureCache:
+    """签名验证缓存（有容量上限的LRU）
+    
+    只缓存验证通过的 (sighash, 公钥, 签名)：交易进入内存池时验证过一次，
+    打包进区块后再验证就能直接命中，省掉椭圆曲线运算。键是三者拼接后的SHA256，节省内存。
+    """
+    
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(sighash: bytes, pubkey: bytes, signature: bytes) -> bytes:
+        return hashlib.sha256(sighash + pubkey + signature).digest()
+    
+    def contains(self, key: bytes) -> bool:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+    
+    def add(self, key: bytes):
+        self._entries[key] = None
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+    
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+# 所有执行器默认共享的签名缓存
+SIGNATURE_CACHE = SignatureCache()
+
+def decode_script_num(data: bytes) -> int:
+    """脚本数字：小端序，最高字节的最高位是符号位"""
+    if not data:
+        return 0
+    value = int.from_bytes(data, 'little')
+    if data[-1] & 0x80:
+        return -(value & ~(0x80 << (8 * (len(data) - 1))))
+    return value
+
+def encode_script_num(value: int) -> bytes:
+    """编码为最短的脚本数字"""
+    if value == 0:
+        return b''
+    result = bytearray(abs(value).to_bytes((abs(value).bit_length() + 7) // 8, 'little'))
+    if result[-1] & 0x80:
+        result.append(0x80 if value < 0 else 0x00)
+    elif value < 0:
+        result[-1] |= 0x80
+    return bytes(result)
+
 class ScriptExecutor:
-    """比特币脚本执行器（简化版）"""
+    """比特币脚本执行器（简化版）
     
-    def __init__(self):
+    执行前先把 List[ScriptElement] 编译成 (处理函数, 操作数) 的元组序列：
+    处理函数从按操作码字节索引的256项分派表中取得，常量操作码在编译时就变成压栈操作。
+    编译结果可以反复执行，不必每次都走一遍if/elif分支。
+    """
+    
+    DISPATCH_TABLE: List = [None] * 256
+    
+    def __init__(self, sighash: bytes = None, signature_cache: SignatureCache = None):
+        """sighash 是签名所签的32字节交易摘要（由交易和输入计算，这里由调用方传入）"""
         self.stack = []
         self.alt_stack = []
+        self.sighash = sighash
+        self.signature_cache = signature_cache if signature_cache is not None else SIGNATURE_CACHE
         
     def execute_script(self, script_elements: List[ScriptElement]) -> bool:
         """执行脚本"""
+        return self.execute_compiled(self.compile(script_elements))
+    
+    def execute_compiled(self, program: Tuple) -> bool:
+        """执行 compile() 得到的程序"""
         try:
-            for element in script_elements:
-                if not self._execute_element(element):
+            for handler, operand in program:
+                if not handler(self, operand):
                     return False
             
             # 脚本成功执行的条件：栈顶为真值
@@ -97,98 +335,320 @@ class ScriptExecutor:
             print(f"脚本执行错误: {e}")
             return False
     
-    def _execute_element(self, element: ScriptElement) -> bool:
-        """执行单个脚本元素"""
-        if element.data:
-            # 数据压栈
-            self.stack.append(element.data)
-            return True
-        
-        if not element.op_code:
+    @classmethod
+    def compile(cls, script_elements: List[ScriptElement]) -> Tuple:
+        """把脚本元素编译成 (处理函数, 操作数) 序列"""
+        table = cls.DISPATCH_TABLE
+        program = []
+        for element in script_elements:
+            if element.data:
+                program.append((cls._op_push, element.data))
+            elif not element.op_code:
+                program.append((cls._op_invalid, None))
+            else:
+                value = element.op_code.value
+                if OpCode.OP_1.value <= value <= OpCode.OP_16.value:
+                    # OP_1..OP_16 直接编译成压入对应的数字
+                    program.append((cls._op_push, bytes([value - 0x50])))
+                else:
+                    program.append((table[value] or cls._op_unsupported, element.op_code))
+        return tuple(program)
+    
+    @classmethod
+    def compile_bytes(cls, raw) -> Tuple:
+        """直接从原始脚本字节编译，压栈数据是原始字节的memoryview切片，不复制"""
+        view = memoryview(raw)
+        table = cls.DISPATCH_TABLE
+        program = []
+        for opcode, start, end in parse_script(view):
+            if opcode <= 0x4e:
+                program.append((cls._op_push, view[start:end]) if opcode else (cls._op_0, None))
+            elif OpCode.OP_1.value <= opcode <= OpCode.OP_16.value:
+                program.append((cls._op_push, bytes([opcode - 0x50])))
+            else:
+                program.append((table[opcode] or cls._op_unsupported, opcode))
+        return tuple(program)
+    
+    def execute_raw(self, script_sig, script_pubkey) -> bool:
+        """依次执行解锁脚本和锁定脚本的原始字节（例如decoderawtransaction输出中的hex）"""
+        if isinstance(script_sig, str):
+            script_sig = bytes.fromhex(script_sig)
+        if isinstance(script_pubkey, str):
+            script_pubkey = bytes.fromhex(script_pubkey)
+        try:
+            program = self.compile_bytes(script_sig) + self.compile_bytes(script_pubkey)
+        except ValueError as e:
+            print(f"脚本解析错误: {e}")
             return False
+        return self.execute_compiled(program)
+    
+    # 分派表中的处理函数：operand 是压栈的数据或操作码本身，返回False表示脚本失败
+    def _op_push(self, data: bytes) -> bool:
+        self.stack.append(data)
+        return True
+    
+    def _op_invalid(self, _) -> bool:
+        return False
+    
+    def _op_unsupported(self, op: OpCode) -> bool:
+        print(f"不支持的操作码: {op}")
+        return False
+    
+    def _op_0(self, _) -> bool:
+        self.stack.append(b'')
+        return True
+    
+    def _op_1negate(self, _) -> bool:
+        self.stack.append(b'\x81')
+        return True
+    
+    # 栈操作
+    def _op_dup(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        self.stack.append(self.stack[-1])
+        return True
+    
+    def _op_drop(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        self.stack.pop()
+        return True
+    
+    def _op_swap(self, _) -> bool:
+        if len(self.stack) < 2:
+            return False
+        self.stack[-1], self.stack[-2] = self.stack[-2], self.stack[-1]
+        return True
+    
+    def _op_rot(self, _) -> bool:
+        if len(self.stack) < 3:
+            return False
+        self.stack.append(self.stack.pop(-3))
+        return True
+    
+    # 算术操作
+    def _op_add(self, _) -> bool:
+        if len(self.stack) < 2:
+            return False
+        b = decode_script_num(self.stack.pop())
+        a = decode_script_num(self.stack.pop())
+        self.stack.append(encode_script_num(a + b))
+        return True
+    
+    def _op_sub(self, _) -> bool:
+        if len(self.stack) < 2:
+            return False
+        b = decode_script_num(self.stack.pop())
+        a = decode_script_num(self.stack.pop())
+        self.stack.append(encode_script_num(a - b))
+        return True
+    
+    # 逻辑操作
+    def _op_equal(self, _) -> bool:
+        if len(self.stack) < 2:
+            return False
+        a = self.stack.pop()
+        b = self.stack.pop()
+        self.stack.append(b'\x01' if a == b else b'')
+        return True
+    
+    def _op_equalverify(self, _) -> bool:
+        if len(self.stack) < 2:
+            return False
+        return self.stack.pop() == self.stack.pop()
+    
+    def _op_not(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        self.stack.append(b'\x01' if decode_script_num(self.stack.pop()) == 0 else b'')
+        return True
+    
+    # 密码学操作
+    def _op_hash160(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        sha256_hash = hashlib.sha256(self.stack.pop()).digest()
+        self.stack.append(hashlib.new('ripemd160', sha256_hash).digest())
+        return True
+    
+    def _op_hash256(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        self.stack.append(hashlib.sha256(hashlib.sha256(self.stack.pop()).digest()).digest())
+        return True
+    
+    def _op_sha256(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        self.stack.append(hashlib.sha256(self.stack.pop()).digest())
+        return True
+    
+    def _op_ripemd160(self, _) -> bool:
+        if len(self.stack) < 1:
+            return False
+        self.stack.append(hashlib.new('ripemd160', self.stack.pop()).digest())
+        return True
+    
+    def check_signature(self, signature: bytes, pubkey: bytes) -> bool:
+        """验证签名，先查签名缓存
         
-        op = element.op_code
-        
-        # 常量操作
-        if op == OpCode.OP_0:
-            self.stack.append(b'')
-        elif op == OpCode.OP_1:
-            self.stack.append(b'\x01')
-        elif op in [OpCode.OP_2, OpCode.OP_3, OpCode.OP_4, OpCode.OP_5,
-                   OpCode.OP_6, OpCode.OP_7, OpCode.OP_8, OpCode.OP_9,
-                   OpCode.OP_10, OpCode.OP_11, OpCode.OP_12, OpCode.OP_13,
-                   OpCode.OP_14, OpCode.OP_15, OpCode.OP_16]:
-            value = op.value - 0x50
-            self.stack.append(bytes([value]))
-        
-        # 栈操作
-        elif op == OpCode.OP_DUP:
-            if len(self.stack) < 1:
-                return False
-            self.stack.append(self.stack[-1])
-        
-        elif op == OpCode.OP_DROP:
-            if len(self.stack) < 1:
-                return False
-            self.stack.pop()
-        
-        elif op == OpCode.OP_SWAP:
-            if len(self.stack) < 2:
-                return False
-            self.stack[-1], self.stack[-2] = self.stack[-2], self.stack[-1]
-        
-        # 逻辑操作
-        elif op == OpCode.OP_EQUAL:
-            if len(self.stack) < 2:
-                return False
-            a = self.stack.pop()
-            b = self.stack.pop()
-            self.stack.append(b'\x01' if a == b else b'')
-        
-        elif op == OpCode.OP_EQUALVERIFY:
-            if len(self.stack) < 2:
-                return False
-            a = self.stack.pop()
-            b = self.stack.pop()
-            if a != b:
-                return False
-        
-        # 密码学操作
-        elif op == OpCode.OP_HASH160:
-            if len(self.stack) < 1:
-                return False
-            data = self.stack.pop()
-            sha256_hash = hashlib.sha256(data).digest()
-            ripemd160_hash = hashlib.new('ripemd160', sha256_hash).digest()
-            self.stack.append(ripemd160_hash)
-        
-        elif op == OpCode.OP_SHA256:
-            if len(self.stack) < 1:
-                return False
-            data = self.stack.pop()
-            sha256_hash = hashlib.sha256(data).digest()
-            self.stack.append(sha256_hash)
-        
-        elif op == OpCode.OP_CHECKSIG:
-            # 简化版签名验证（实际需要椭圆曲线算法）
-            if len(self.stack) < 2:
-                return False
-            pubkey = self.stack.pop()
-            signature = self.stack.pop()
-            # 这里是简化的验证，实际需要ECDSA
-            is_valid = len(signature) == 64 and len(pubkey) == 33
-            self.stack.append(b'\x01' if is_valid else b'')
+        32字节x-only公钥按BIP340 Schnorr验证（签名64字节，或65字节带sighash类型）；
+        其它公钥按ECDSA验证，签名为DER编码加1字节sighash类型。
+        """
+        if not signature or self.sighash is None:
+            return False
+        signature = bytes(signature)
+        pubkey = bytes(pubkey)
+        key = SignatureCache.make_key(self.sighash, pubkey, signature)
+        if self.signature_cache.contains(key):
+            return True
         
+        if len(pubkey) == 32:
+            valid = len(signature) in (64, 65) and verify_schnorr(pubkey, signature[:64], self.sighash)
         else:
-            print(f"不支持的操作码: {op}")
+            valid = verify_ecdsa(pubkey, signature[:-1], self.sighash)
+        if valid:
+            self.signature_cache.add(key)
+        return valid
+    
+    def _op_checksig(self, _) -> bool:
+        if len(self.stack) < 2:
+            return False
+        pubkey = self.stack.pop()
+        signature = self.stack.pop()
+        self.stack.append(b'\x01' if self.check_signature(signature, pubkey) else b'')
+        return True
+    
+    def _op_checksigverify(self, op) -> bool:
+        return self._op_checksig(op) and self._is_true(self.stack.pop())
+    
+    def _op_checkmultisig(self, _) -> bool:
+        """m-of-n多重签名：签名必须按公钥的顺序排列"""
+        stack = self.stack
+        if len(stack) < 1:
+            return False
+        n = decode_script_num(stack.pop())
+        if not 0 <= n <= 20 or len(stack) < n + 1:
             return False
+        pubkeys = [stack.pop() for _ in range(n)][::-1]
+        m = decode_script_num(stack.pop())
+        if not 0 <= m <= n or len(stack) < m + 1:
+            return False
+        signatures = [stack.pop() for _ in range(m)][::-1]
+        stack.pop()  # 历史遗留的bug：会多弹出一个元素，所以解锁脚本要以OP_0开头
         
+        sig_index = 0
+        key_index = 0
+        success = True
+        while sig_index < m:
+            # 剩余公钥比剩余签名少时不可能成功
+            if m - sig_index > n - key_index:
+                success = False
+                break
+            if self.check_signature(signatures[sig_index], pubkeys[key_index]):
+                sig_index += 1
+            key_index += 1
+        stack.append(b'\x01' if success else b'')
         return True
     
+    def _op_checkmultisigverify(self, op) -> bool:
+        return self._op_checkmultisig(op) and self._is_true(self.stack.pop())
+    
     def _is_true(self, data: bytes) -> bool:
         """判断数据是否为真值"""
         return len(data) > 0 and data != b'\x00'
 
+for _op_code, _handler in [
+    (OpCode.OP_0, ScriptExecutor._op_0),
+    (OpCode.OP_1NEGATE, ScriptExecutor._op_1negate),
+    (OpCode.OP_DUP, ScriptExecutor._op_dup),
+    (OpCode.OP_DROP, ScriptExecutor._op_drop),
+    (OpCode.OP_SWAP, ScriptExecutor._op_swap),
+    (OpCode.OP_ROT, ScriptExecutor._op_rot),
+    (OpCode.OP_ADD, ScriptExecutor._op_add),
+    (OpCode.OP_SUB, ScriptExecutor._op_sub),
+    (OpCode.OP_EQUAL, ScriptExecutor._op_equal),
+    (OpCode.OP_EQUALVERIFY, ScriptExecutor._op_equalverify),
+    (OpCode.OP_NOT, ScriptExecutor._op_not),
+    (OpCode.OP_HASH160, ScriptExecutor._op_hash160),
+    (OpCode.OP_HASH256, ScriptExecutor._op_hash256),
+    (OpCode.OP_SHA256, ScriptExecutor._op_sha256),
+    (OpCode.OP_RIPEMD160, ScriptExecutor._op_ripemd160),
+    (OpCode.OP_CHECKSIG, ScriptExecutor._op_checksig),
+    (OpCode.OP_CHECKSIGVERIFY, ScriptExecutor._op_checksigverify),
+    (OpCode.OP_CHECKMULTISIG, ScriptExecutor._op_checkmultisig),
+    (OpCode.OP_CHECKMULTISIGVERIFY, ScriptExecutor._op_checkmultisigverify),
+]:
+    ScriptExecutor.DISPATCH_TABLE[_op_code.value] = _handler
+del _op_code, _handler
+
+def validate_script_pair(script_sig, script_pubkey, sighash: bytes = None) -> bool:
+    """无状态验证：每次用新的执行器执行一对原始脚本，可以安全地在多个进程中并行调用"""
+    return ScriptExecutor(sighash).execute_raw(script_sig, script_pubkey)
+
+def _validate_input_chunk(chunk: Tuple[int, List[Tuple]]) -> Tuple[int, List[bool], float]:
+    """进程池任务：验证一段连续的输入，返回 (起始位置, 各输入结果, 耗时)"""
+    start, inputs = chunk
+    start_time = time.perf_counter()
+    verdicts = [validate_script_pair(*script_input) for script_input in inputs]
+    return start, verdicts, time.perf_counter() - start_time
+
+class BatchScriptValidator:
+    """批量脚本验证器：把一笔交易或一个区块的所有输入分块交给进程池
+    
+    每个输入是 (scriptSig, scriptPubKey) 或 (scriptSig, scriptPubKey, sighash)，脚本为原始字节或hex。
+    每个任务都用新的执行器，进程之间不共享栈；签名缓存在每个进程内各自生效。
+    """
+    
+    def __init__(self, workers: int = None, chunk_size: int = None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self._pool = None
+    
+    def validate(self, inputs: List[Tuple]) -> Dict:
+        """验证所有输入，返回每个输入的结果和耗时统计"""
+        start_time = time.perf_counter()
+        inputs = list(inputs)
+        verdicts = [False] * len(inputs)
+        worker_time = 0.0
+        
+        if self.workers <= 1 or len(inputs) < 2:
+            _, verdicts, worker_time = _validate_input_chunk((0, inputs))
+        else:
+            # 每个进程分到几块，执行快慢不一时可以互相补位
+            chunk_size = self.chunk_size or max(1, -(-len(inputs) // (self.workers * 4)))
+            chunks = [(i, inputs[i:i + chunk_size]) for i in range(0, len(inputs), chunk_size)]
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.workers)
+            for start, chunk_verdicts, elapsed in self._pool.imap_unordered(_validate_input_chunk, chunks):
+                verdicts[start:start + len(chunk_verdicts)] = chunk_verdicts
+                worker_time += elapsed
+        
+        elapsed = time.perf_counter() - start_time
+        return {
+            'valid': all(verdicts),
+            'verdicts': verdicts,
+            'failed_inputs': [i for i, verdict in enumerate(verdicts) if not verdict],
+            'inputs': len(inputs),
+            'workers': self.workers,
+            'elapsed': elapsed,
+            'worker_time': worker_time,
+            'inputs_per_second': len(inputs) / elapsed if elapsed > 0 else 0
+        }
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 # 2. 标准脚本模式
 class StandardScripts:
     """标准脚本模式"""
@@ -252,46 +712,113 @@ class StandardScripts:
         return script
 
 # 3. 脚本分析器
+def _build_script_templates() -> Dict[int, List[Tuple[str, Tuple[Tuple[int, int], ...]]]]:
+    """预先计算标准锁定脚本的字节模板：按脚本长度分组，每个模板是需要检查的 (偏移, 字节值)
+    
+    模板由占位数据序列化得到，去掉数据部分后剩下的就是固定字节。
+    """
+    def fixed_bytes(raw: bytes, data_start: int, data_end: int) -> Tuple[Tuple[int, int], ...]:
+        return tuple((i, b) for i, b in enumerate(raw) if not data_start <= i < data_end)
+    
+    witness_v1 = lambda program: bytes([0x51, len(program)]) + program
+    samples = [
+        ("P2PKH", serialize_script(StandardScripts.p2pkh_scriptpubkey(bytes(20))), 3, 23),
+        ("P2SH", serialize_script(StandardScripts.p2sh_scriptpubkey(bytes(20))), 2, 22),
+        ("P2WPKH", b'\x00\x14' + bytes(20), 2, 22),
+        ("P2WSH", b'\x00\x20' + bytes(32), 2, 34),
+        ("P2TR", witness_v1(bytes(32)), 2, 34),
+        ("P2PK", b'\x21' + bytes(33) + b'\xac', 1, 34),  # 压缩公钥
+        ("P2PK", b'\x41' + bytes(65) + b'\xac', 1, 66),  # 未压缩公钥
+    ]
+    templates = {}
+    for name, raw, data_start, data_end in samples:
+        templates.setdefault(len(raw), []).append((name, fixed_bytes(raw, data_start, data_end)))
+    return templates
+
+SCRIPT_TYPES = ["Custom", "P2PK", "P2PKH", "P2SH", "P2WPKH", "P2WSH", "P2TR", "MultiSig", "OP_RETURN"]
+
+def _is_multisig(raw) -> bool:
+    """OP_m <公钥>... OP_n OP_CHECKMULTISIG，公钥为33或65字节"""
+    size = len(raw)
+    if size < 37 or raw[-1] != 0xae:
+        return False
+    m = raw[0] - 0x50
+    n = raw[-2] - 0x50
+    if not 1 <= m <= n <= 16:
+        return False
+    pos = 1
+    for _ in range(n):
+        if pos >= size or raw[pos] not in (0x21, 0x41):
+            return False
+        pos += 1 + raw[pos]
+    return pos == size - 2
+
+def classify_script(raw) -> str:
+    """按字节模板识别锁定脚本类型：只检查固定偏移上的字节，不解析、不创建中间对象"""
+    for name, checks in SCRIPT_TEMPLATES.get(len(raw), ()):
+        for offset, value in checks:
+            if raw[offset] != value:
+                break
+        else:
+            return name
+    if raw and raw[0] == 0x6a:
+        return "OP_RETURN"
+    if _is_multisig(raw):
+        return "MultiSig"
+    return "Custom"
+
+def classify_scripts(scripts: List[bytes]) -> List[str]:
+    """批量识别一个区块中所有输出脚本的类型
+    
+    安装了NumPy时把所有脚本拼接成一个数组，每个模板的检查都是对全部脚本的一次向量运算；
+    只有以OP_CHECKMULTISIG结尾的少数脚本再逐个检查。未安装NumPy时逐个调用classify_script。
+    """
+    if np is None:
+        return [classify_script(raw) for raw in scripts]
+    if not scripts:
+        return []
+    
+    lengths = np.fromiter(map(len, scripts), dtype=np.int64, count=len(scripts))
+    starts = np.zeros(len(scripts), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    # 末尾补零，读取短脚本之后的偏移不会越界（长度条件会排除这些结果）
+    data = np.frombuffer(b''.join(scripts) + bytes(80), dtype=np.uint8)
+    codes = np.zeros(len(scripts), dtype=np.int8)
+    
+    for length, templates in SCRIPT_TEMPLATES.items():
+        candidates = np.nonzero(lengths == length)[0]
+        for name, checks in templates:
+            candidate_starts = starts[candidates]
+            matched = np.ones(len(candidates), dtype=bool)
+            for offset, value in checks:
+                matched &= data[candidate_starts + offset] == value
+            codes[candidates[matched]] = SCRIPT_TYPES.index(name)
+            candidates = candidates[~matched]
+    
+    unmatched = codes == 0
+    codes[unmatched & (lengths > 0) & (data[starts] == 0x6a)] = SCRIPT_TYPES.index("OP_RETURN")
+    multisig_candidates = np.nonzero(unmatched & (lengths >= 37) & (data[starts + lengths - 1] == 0xae))[0]
+    for i in multisig_candidates:
+        if _is_multisig(scripts[i]):
+            codes[i] = SCRIPT_TYPES.index("MultiSig")
+    
+    names = np.array(SCRIPT_TYPES, dtype=object)
+    return names[codes].tolist()
+
 class ScriptAnalyzer:
     """脚本分析器"""
     
     @staticmethod
     def analyze_script_type(script: List[ScriptElement]) -> str:
         """分析脚本类型"""
-        if len(script) == 5:
-            ops = [elem.op_code for elem in script if elem.op_code]
-            if (ops == [OpCode.OP_DUP, OpCode.OP_HASH160, 
-                       OpCode.OP_EQUALVERIFY, OpCode.OP_CHECKSIG]):
-                return "P2PKH"
-        
-        if len(script) == 3:
-            ops = [elem.op_code for elem in script if elem.op_code]
-            if ops == [OpCode.OP_HASH160, OpCode.OP_EQUAL]:
-                return "P2SH"
-        
-        # 检查多重签名
-        if len(script) >= 4:
-            if (script[0].op_code and script[-1].op_code == OpCode.OP_CHECKMULTISIG):
-                return f"MultiSig"
-        
-        return "Custom"
+        return classify_script(serialize_script(script))
     
     @staticmethod
     def estimate_script_size(script: List[ScriptElement]) -> int:
-        """估算脚本大小（字节）"""
-        size = 0
-        for element in script:
-            if element.op_code:
-                size += 1  # 操作码占1字节
-            if element.data:
-                data_len = len(element.data)
-                if data_len <= 75:
-                    size += 1 + data_len  # 长度字节 + 数据
-                elif data_len <= 255:
-                    size += 2 + data_len  # OP_PUSHDATA1 + 长度字节 + 数据
-                else:
-                    size += 3 + data_len  # OP_PUSHDATA2 + 2字节长度 + 数据
-        return size
+        """脚本大小（字节），即标准序列化后的长度"""
+        return len(serialize_script(script))
+
+SCRIPT_TEMPLATES = _build_script_templates()
 
 # 4. 时间锁脚本
 class TimeLockScripts:
@@ -348,12 +875,13 @@ class ScriptBuilder:
         """添加数字"""
         if number == 0:
             self.elements.append(ScriptElement(OpCode.OP_0, None))
+        elif number == -1:
+            self.elements.append(ScriptElement(OpCode.OP_1NEGATE, None))
         elif 1 <= number <= 16:
             self.elements.append(ScriptElement(OpCode(0x50 + number), None))
         else:
-            # 将数字转换为字节并添加
-            data = number.to_bytes((number.bit_length() + 7) // 8, 'little')
-            self.elements.append(ScriptElement(None, data))
+            # 按脚本数字格式（小端序，最高位为符号位）编码后压栈
+            self.elements.append(ScriptElement(None, encode_script_num(number)))
         return self
     
     def build(self) -> List[ScriptElement]:
@@ -365,13 +893,21 @@ if __name__ == "__main__":
     print("比特币脚本系统完整演示")
     print("=" * 50)
     
+    if ecdsa is None:
+        print("演示需要ecdsa库，请安装: pip install ecdsa")
+        raise SystemExit(1)
+    
     # 1. P2PKH脚本演示
     print("\n1. P2PKH (Pay to Public Key Hash) 脚本演示:")
     
-    # 生成模拟的公钥哈希
-    pubkey = secrets.token_bytes(33)  # 33字节公钥
+    # 模拟的交易摘要（真实交易中由交易内容和被花费的输出计算得到）
+    sighash = hashlib.sha256(hashlib.sha256("Alice -> Bob 1 BTC".encode()).digest()).digest()
+    
+    # 生成密钥并对交易摘要签名
+    signing_key = ecdsa.SigningKey.generate(curve=SECP256k1)
+    pubkey = signing_key.get_verifying_key().to_string("compressed")  # 33字节压缩公钥
     pubkey_hash = hashlib.new('ripemd160', hashlib.sha256(pubkey).digest()).digest()
-    signature = secrets.token_bytes(64)  # 64字节签名
+    signature = signing_key.sign_digest(sighash, sigencode=sigencode_der) + b'\x01'  # DER签名 + SIGHASH_ALL
     
     # 创建P2PKH脚本
     scriptpubkey = StandardScripts.p2pkh_scriptpubkey(pubkey_hash)
@@ -381,7 +917,7 @@ if __name__ == "__main__":
     print(f"解锁脚本: {' '.join(str(elem) for elem in scriptsig)}")
     
     # 执行脚本
-    executor = ScriptExecutor()
+    executor = ScriptExecutor(sighash)
     combined_script = scriptsig + scriptpubkey
     result = executor.execute_script(combined_script)
     print(f"执行结果: {'成功' if result else '失败'}")
@@ -394,9 +930,17 @@ if __name__ == "__main__":
     print(f"脚本类型: {script_type}")
     print(f"脚本大小: {script_size} 字节")
     
+    # 序列化成原始字节，再直接执行原始字节（和decoderawtransaction里的hex格式相同）
+    scriptpubkey_hex = serialize_script(scriptpubkey).hex()
+    scriptsig_hex = serialize_script(scriptsig).hex()
+    print(f"锁定脚本hex: {scriptpubkey_hex}")
+    raw_result = ScriptExecutor(sighash).execute_raw(scriptsig_hex, scriptpubkey_hex)
+    print(f"直接执行原始字节: {'成功' if raw_result else '失败'}")
+    
     # 3. 多重签名脚本演示
     print("\n3. 多重签名脚本演示:")
-    pubkeys = [secrets.token_bytes(33) for _ in range(3)]
+    multisig_keys = [ecdsa.SigningKey.generate(curve=SECP256k1) for _ in range(3)]
+    pubkeys = [key.get_verifying_key().to_string("compressed") for key in multisig_keys]
     multisig_script = StandardScripts.multisig_script(2, pubkeys)
     
     print(f"2-of-3多重签名脚本:")
@@ -408,6 +952,24 @@ if __name__ == "__main__":
     print(f"脚本类型: {multisig_type}")
     print(f"脚本大小: {multisig_size} 字节")
     
+    # 用第1和第3把私钥签名；解锁脚本以OP_0开头，签名顺序要和公钥顺序一致
+    multisig_sigs = [multisig_keys[i].sign_digest(sighash, sigencode=sigencode_der) + b'\x01'
+                     for i in (0, 2)]
+    multisig_scriptsig = [ScriptElement(OpCode.OP_0, None)] + [ScriptElement(None, sig) for sig in multisig_sigs]
+    multisig_result = ScriptExecutor(sighash).execute_script(multisig_scriptsig + multisig_script)
+    print(f"2-of-3签名验证: {'成功' if multisig_result else '失败'}")
+    reversed_scriptsig = [multisig_scriptsig[0]] + multisig_scriptsig[:0:-1]
+    reversed_result = ScriptExecutor(sighash).execute_script(reversed_scriptsig + multisig_script)
+    print(f"签名顺序颠倒: {'成功' if reversed_result else '失败'}")
+    
+    # Schnorr签名（Taproot使用的32字节x-only公钥）
+    schnorr_secret = secrets.randbelow(SECP256k1.order - 1) + 1
+    xonly_pubkey = (SECP256k1.generator * schnorr_secret).x().to_bytes(32, 'big')
+    schnorr_script = [ScriptElement(None, sign_schnorr(schnorr_secret, sighash)),
+                      ScriptElement(None, xonly_pubkey), ScriptElement(OpCode.OP_CHECKSIG, None)]
+    schnorr_result = ScriptExecutor(sighash).execute_script(schnorr_script)
+    print(f"Schnorr签名验证: {'成功' if schnorr_result else '失败'}")
+    
     # 4. 时间锁脚本演示
     print("\n4. 时间锁脚本演示:")
     
@@ -441,13 +1003,88 @@ if __name__ == "__main__":
     custom_result = custom_executor.execute_script(custom_script)
     print(f"自定义脚本执行结果: {'成功' if custom_result else '失败'}")
     
-    # 6. 脚本统计信息
-    print("\n6. 脚本系统统计:")
+    # 压入-1时最短编码是OP_1NEGATE，序列化后再解析应得到相同的字节并同样执行成功
+    negate_script = (ScriptBuilder().add_data(b'\x81').add_number(1).add_op(OpCode.OP_ADD)
+                     .add_number(0).add_op(OpCode.OP_EQUAL).build())
+    negate_raw = serialize_script(negate_script)
+    round_trip = serialize_script(script_from_bytes(negate_raw)) == negate_raw
+    negate_result = (ScriptExecutor().execute_script(negate_script) and
+                     ScriptExecutor().execute_raw(b'', negate_raw))
+    print(f"-1 + 1 == 0 原始字节: {negate_raw.hex()}, 往返一致: {'✅' if round_trip else '❌'}, "
+          f"执行结果: {'成功' if negate_result else '失败'}")
+    
+    # 6. 预编译脚本的批量执行
+    print("\n6. 预编译脚本批量执行:")
+    iterations = 20000
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        ScriptExecutor(sighash).execute_script(combined_script)
+    per_run_compile = time.perf_counter() - start_time
+    
+    program = ScriptExecutor.compile(combined_script)
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        ScriptExecutor(sighash).execute_compiled(program)
+    precompiled = time.perf_counter() - start_time
+    print(f"执行 {iterations} 次P2PKH: 每次编译 {per_run_compile:.3f}s, 预编译后 {precompiled:.3f}s")
+    
+    # 签名缓存：同一签名第二次验证（例如内存池验证过、打包进区块时再验证）不再做椭圆曲线运算
+    uncached_runs = 200
+    no_cache = SignatureCache(max_entries=0)
+    start_time = time.perf_counter()
+    for _ in range(uncached_runs):
+        ScriptExecutor(sighash, signature_cache=no_cache).execute_compiled(program)
+    uncached = (time.perf_counter() - start_time) / uncached_runs
+    stats = SIGNATURE_CACHE.get_stats()
+    print(f"每次验证: 无缓存 {uncached * 1e6:.0f}µs, 命中缓存 {precompiled / iterations * 1e6:.1f}µs")
+    print(f"签名缓存: {stats['entries']} 条, 命中率 {stats['hit_rate']:.2%}")
+    
+    # 7. 并行批量验证一个区块的所有输入
+    print("\n7. 并行批量验证:")
+    block_inputs = []
+    for i in range(400):
+        input_sighash = hashlib.sha256(f"input-{i}".encode()).digest()
+        input_key = ecdsa.SigningKey.generate(curve=SECP256k1)
+        input_pubkey = input_key.get_verifying_key().to_string("compressed")
+        input_sig = input_key.sign_digest(input_sighash, sigencode=sigencode_der) + b'\x01'
+        input_hash = hashlib.new('ripemd160', hashlib.sha256(input_pubkey).digest()).digest()
+        block_inputs.append((serialize_script(StandardScripts.p2pkh_scriptsig(input_sig, input_pubkey)),
+                             serialize_script(StandardScripts.p2pkh_scriptpubkey(input_hash)),
+                             input_sighash))
+    # 篡改一个输入的签名摘要
+    block_inputs[123] = block_inputs[123][:2] + (bytes(32),)
+    
+    for workers in sorted({1, multiprocessing.cpu_count()}):
+        SIGNATURE_CACHE.clear()
+        with BatchScriptValidator(workers=workers) as validator:
+            report = validator.validate(block_inputs)
+        print(f"{workers} 个进程: {report['inputs']} 个输入耗时 {report['elapsed']:.3f}s "
+              f"({report['inputs_per_second']:,.0f} 个/秒), 失败的输入: {report['failed_inputs']}")
+    
+    # 8. 按字节模板分类整个区块的输出脚本
+    print("\n8. 区块输出脚本分类:")
+    output_samples = [
+        serialize_script(StandardScripts.p2pkh_scriptpubkey(pubkey_hash)),
+        b'\x00\x14' + pubkey_hash,
+        b'\x51\x20' + xonly_pubkey,
+        serialize_script(multisig_script),
+        b'\x6a\x0bhello block',
+    ]
+    block_outputs = [output_samples[i % len(output_samples)] for i in range(100000)]
+    start_time = time.perf_counter()
+    output_types = classify_scripts(block_outputs)
+    elapsed = time.perf_counter() - start_time
+    type_counts = {name: output_types.count(name) for name in SCRIPT_TYPES if name in output_types}
+    print(f"分类 {len(block_outputs)} 个输出耗时: {elapsed:.3f}s"
+          f"{'' if np is not None else '（未安装NumPy，逐个分类）'}")
+    print(f"类型统计: {type_counts}")
+    
+    # 9. 脚本统计信息
+    print("\n9. 脚本系统统计:")
     total_opcodes = len([op for op in OpCode])
     supported_opcodes = [
-        OpCode.OP_0, OpCode.OP_1, OpCode.OP_DUP, OpCode.OP_DROP,
-        OpCode.OP_EQUAL, OpCode.OP_EQUALVERIFY, OpCode.OP_HASH160,
-        OpCode.OP_SHA256, OpCode.OP_CHECKSIG
+        op for op in OpCode
+        if ScriptExecutor.DISPATCH_TABLE[op.value] or OpCode.OP_1.value <= op.value <= OpCode.OP_16.value
     ]
     
     print(f"总操作码数量: {total_opcodes}")
@@ -455,7 +1092,7 @@ if __name__ == "__main__":
     print(f"实现率: {len(supported_opcodes)/total_opcodes*100:.1f}%")
     
     print("\n注意：这是教学示例，实际生产环境需要:")
-    print("- 完整的ECDSA签名验证")
+    print("- 完整的sighash计算（这里由调用方传入）")
     print("- 所有操作码的实现")
     print("- 完善的错误处理")
     print("- 安全性检查和限制")
\ No newline at end of file